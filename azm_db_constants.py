@@ -12,3 +12,9 @@ BULK_INSERT_LINE_SEPARATOR_PARAM = "!\\n" # like c_bitwise_or, also called pipe
 
 BULK_INSERT_COL_SEPARATOR_VALUE = "\t!"
 BULK_INSERT_COL_SEPARATOR_PARAM = "\\t!"
+
+# errors of these tables are only warned - create/dump of other tables continues
+IGNORE_ERROR_TABLES = [
+    "lte_rrc_tmsi",
+    "nr_handover_stats" # pg col name too long - most servers are spark already anyway - migrating the rest
+]
@@ -14,6 +14,11 @@ Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
 import subprocess
 from subprocess import call
 import sys
+import azm_sqlite_reader
+import azm_db_constants
+import azm_folder_watcher
+import azm_ledger
+import azm_schema_cache
 import signal
 import argparse
 import importlib
@@ -22,6 +27,8 @@ import debug_helpers
 from debug_helpers import dprint
 import zipfile
 import os
+import concurrent.futures
+import threading
 import shutil
 import uuid
 import traceback
@@ -32,6 +39,7 @@ import psutil
 from datetime import timedelta
 from datetime import datetime
 from datetime import tzinfo
+from dateutil.relativedelta import relativedelta
 class timezone(tzinfo):
     """UTC"""
     offset_seconds = None
@@ -56,12 +64,20 @@ def parse_cmd_args():
 
     parser.add_argument('--azm_file',help='''An AZENQOS Android .azm file (or directory that contains multiple .azm files)
     that contains the SQLite3 "azqdata.db" to merge/import. If you want azm_db_merge to try find from multiple full paths, using whichever is first present, separate the strings with a comma.
-    (a .azm is actually a zip file)''', required=True)
+    (a .azm is actually a zip file) - required unless --pg10_provision_partitions or --unmerge_log_hashes.''', default=None)
     
     parser.add_argument('--unmerge',
                         action='store_true',
                         help="un-merge mode: remove all rows of this azm from target_db.",
                         default=False)
+
+    parser.add_argument('--reimport',
+                        action='store_true',
+                        help="""re-import mode: replace all rows of this azm in target_db (or import it if not there yet) - the deletes
+                        of its old rows and the COPYs of its new rows are committed in one transaction so readers see either the old or
+                        the new rows of the log - instead of --unmerge then a merge. postgresql only. With --parquet_object_store the
+                        new parquet files get new keys - the files of the previous import are removed after the new manifest replaced its one.""",
+                        default=False)
     
     parser.add_argument('--folder_mode_stop_on_first_failure',
                         action='store_true',
@@ -71,6 +87,13 @@ def parse_cmd_args():
                         """,
                         default=False)
     
+    parser.add_argument('--workers',
+                        type=int,
+                        help="""If --azm_file supplied was a folder, process this number of azm files in parallel -
+                        each in its own process with its own temp dir and target db connection.
+                        Default 1: process the azm files one by one.""",
+                        default=1)
+
     parser.add_argument('--target_db_type', choices=g_target_db_types,
                         help="Target DBMS type ", required=True)
 
@@ -116,6 +139,54 @@ def parse_cmd_args():
                         help="Full path to sqlite3 executable.",
                         default="sqlite3")
 
+    parser.add_argument('--sqlite3_cli_reader',
+                        action='store_true',
+                        help="""Read the azqdata.db with the --sqlite3_executable (one process per query/table dump)
+                        instead of the default in-process python sqlite3 reader (that opens the db only once).""",
+                        default=False)
+
+    parser.add_argument('--in_memory_db',
+                        action='store_true',
+                        help="""Decompress the azqdata.db of each azm into memory and read it from there (python sqlite3 deserialize)
+                        instead of extracting it to the temp dir first. Falls back to extracting it to disk if its uncompressed size is over
+                        --in_memory_db_max_mb or if the azqdata.db file is needed on disk: with --sqlite3_cli_reader,
+                        --call_preprocess_func_in_module_before_import or --target_db_type sqlite3.""",
+                        default=False)
+
+    parser.add_argument('--in_memory_db_max_mb',
+                        type=int,
+                        help="""Max uncompressed azqdata.db size (MB) for --in_memory_db - reading needs about twice this much memory.""",
+                        default=2048)
+
+    parser.add_argument('--prefetch_azm_files',
+                        type=int,
+                        help="""Folder mode (without --workers): number of the next azm files to unzip to their tmp processing folders
+                        in a background thread while the current azm is imported - 0 to disable. Prefetch of an azm is skipped if
+                        the tmp folder would have less than 8 GB free space after it.""",
+                        default=1)
+
+    parser.add_argument('--pg_stream_copy',
+                        action='store_true',
+                        help="""PostgreSQL only: stream each table's rows from the azqdata.db (through the geom conversion)
+                        directly into 'COPY ... FROM STDIN' at commit instead of writing/adjusting csv files in the temp dir first.
+                        Not used with --sqlite3_cli_reader or --dump_parquet.""",
+                        default=False)
+
+    parser.add_argument('--pg_pipeline_copy',
+                        action='store_true',
+                        help="""PostgreSQL only: COPY each table as soon as its dump is ready (on a second connection, in a
+                        thread) while the next tables are still being created/dumped instead of running all COPYs at commit.
+                        All COPYs are still in one transaction that is committed only after the last table - or rolled back on failure.
+                        Not with --workers > 1: the open COPY transaction of one worker would block the table/partition DDL of the others.""",
+                        default=False)
+
+    parser.add_argument('--table_jobs',
+                        type=int,
+                        help="""Number of threads to dump (and convert in --dump_parquet mode) the tables of each azm in parallel.
+                        Create/alter of tables stay in order in the main thread and all COPY/bulk inserts are still
+                        executed in the same single commit after all tables are dumped. Default 1: dump tables one by one.""",
+                        default=1)
+
     parser.add_argument('--dump_to_file_mode',
                         action='store_true',
                         help="""Set this to force full dump of sqlite3 db to .sql file
@@ -165,10 +236,21 @@ def parse_cmd_args():
                         required=False)
 
     parser.add_argument('--daemon_mode_rerun_on_folder_after_seconds',
-                        help='''If specified, azm_db_merge will block re-run on the same folder (specified with '--azm_file') again after the specified number of seconds.''',
+                        help='''If specified, azm_db_merge will block re-run on the same folder (specified with '--azm_file') again after the specified number of seconds.
+                        After the first run, new azm files are processed as soon as they are fully written (see --daemon_mode_watch) and the failed
+                        azm files are retried after the specified number of seconds.''',
                         default=None,
                         required=False)
 
+    parser.add_argument('--daemon_mode_watch',
+                        help='''How --daemon_mode_rerun_on_folder_after_seconds finds new azm files in the folder:
+                        'inotify' (linux): process each new azm as soon as it is closed after writing or renamed/moved into the folder tree - no rescans of the tree,
+                        'poll': walk the folder tree every --daemon_mode_rerun_on_folder_after_seconds and process the azm files whose size and mtime didn't change since the previous walk (for network shares written by other hosts),
+                        'auto': inotify if available, otherwise poll.''',
+                        choices=azm_folder_watcher.WATCH_MODES,
+                        default="auto",
+                        required=False)
+
     parser.add_argument('--add_imei_id_to_all_tables',
                         action='store_true',
                         help="""Add log device's IMEI to all rows in all tables.""",
@@ -194,6 +276,46 @@ def parse_cmd_args():
                         default=False)
 
 
+    parser.add_argument('--parquet_row_group_size',
+                        type=int,
+                        help="""--dump_parquet: number of rows per parquet row group - each table is read, converted and written
+                        in batches so only about this many rows of a table are in memory at once.""",
+                        default=100000)
+
+    parser.add_argument('--parquet_profile',
+                        choices=['fast', 'balanced', 'archive'],
+                        help="""--dump_parquet: codec/encoding settings of the parquet files (see PARQUET_PROFILES in gen_sql_handler.py and
+                        bench_parquet_profiles.py for their write/read time and size): 'fast': snappy and dictionary encoding for all cols (as before),
+                        'balanced': zstd level 3, dictionary encoding for int/string cols and byte stream split for float cols,
+                        'archive': like balanced but zstd level 15 and 8 MB data pages. The zstd and byte stream split profiles need Spark 3.2+
+                        to read.""",
+                        default='fast')
+
+    parser.add_argument('--parquet_hive_layout',
+                        action='store_true',
+                        help="""--dump_parquet: write the parquet files in a hive partitioned layout: table=<table>/month=<YYYY-MM>/<table>_<log_hash>.parquet
+                        (copied to the bucket root) instead of the flat <YYYY-MM>/<table>_<log_hash>.parquet - with rows sorted by time
+                        and column statistics and page indexes written so readers can skip row groups by time and log_hash.""",
+                        default=False)
+
+    parser.add_argument('--parquet_dataset_dir',
+                        help="""--parquet_hive_layout: move the parquet files to this local (or mounted) dataset dir instead of the mc cp
+                        to the object store - the '_common_metadata'/'_metadata' summary files of each partition folder are rebuilt there after
+                        each import/unmerge.""",
+                        default=None)
+
+    parser.add_argument('--parquet_object_store',
+                        help="""--dump_parquet: upload the parquet files (and manifests) in-process to this store instead of the mc cp to
+                        minio_logs/<bucket>: a local dir path (or file:///dir) or s3://bucket[/prefix] - with the S3 options in the query
+                        string like s3://azm-mydomain?endpoint_override=localhost:9000&scheme=http and the credentials in the
+                        AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY env vars. Each file is uploaded as soon as it is written.""",
+                        default=None)
+
+    parser.add_argument('--parquet_upload_threads',
+                        type=int,
+                        help="""--parquet_object_store: number of concurrent uploads.""",
+                        default=8)
+
     parser.add_argument('--get_schema_shasum_and_exit',
                         action='store_true',
                         help="""Compute the schema of the azqdata.db inside the specified azm and exit. Example:
@@ -201,6 +323,22 @@ python azm_db_merge.py --target_db_type sqlite3 --azm_file example_logs/35809607
                         """,
                         default=False)
 
+    parser.add_argument('--schema_cache_file',
+                        help="""Path of a local cache file (created if not exists) of the target tables/columns already created/checked
+                        for each azqdata.db schema sha1 (see --get_schema_shasum_and_exit), target db and --pg_schema.
+                        Azms with an already cached schema skip the table exists check, create and alter checks of each cached table.
+                        The cache entry is dropped if an azm that used it fails - and an azm that failed on a missing column
+                        of its cached tables is retried once without the cache.""",
+                        default=None)
+
+    parser.add_argument('--ledger_file',
+                        help="""Path of a local ledger file (created if not exists) of the azm files processed by folder runs (--azm_file
+                        is a folder, also --daemon_mode_rerun_on_folder_after_seconds) for this target db and operation: their path, size, mtime,
+                        content hash, outcome, log_hash and timings. The next runs skip the unchanged azm files that were merged (or
+                        already merged) without opening them and retry the failed ones on a backoff schedule (1 minute after the first
+                        failure, doubled after each further failure up to 1 day) - or right away if they changed.""",
+                        default=None)
+
     parser.add_argument('--pg10_partition_by_month',
                         action='store_true',
                         help="""For postgresql v10 only - when create tables - do declartive partitioning by month like '2017_06' etc""",
@@ -210,8 +348,40 @@ python azm_db_merge.py --target_db_type sqlite3 --azm_file example_logs/35809607
                         action='store_true',
                         help="""For postgresql v10 only - when creating partitions, set log_hash as the index of the table""",
                         default=False)
+
+    parser.add_argument('--pg10_partition_by_log_hash',
+                        action='store_true',
+                        help="""For postgresql v10 or newer with --pg10_partition_by_month - new month partitions are partitioned by list (log_hash)
+                        and each log gets its own partition of them (per_month_<table>.logs_<YYYY_MM>_<log_hash>) so --unmerge drops
+                        the partitions of the log instead of deleting its rows - no dead tuples left for vacuum in the month partitions.
+                        Month partitions created without this option are kept and their rows are still deleted at --unmerge.""",
+                        default=False)
+
+    parser.add_argument('--pg10_provision_partitions',
+                        help="""For postgresql v10 only - create the per_month schemas and month partitions of all already existing
+                        partitioned tables in --pg_schema for the months in the range 'YYYY_MM:YYYY_MM' (or a single 'YYYY_MM') then exit
+                        - so a following batch of imports only needs to look up existing partitions instead of creating them.
+                        example:
+                        python azm_db_merge.py --target_db_type postgresql --server_user postgres --server_password pass --server_database azqdb --pg10_partition_index_log_hash --pg10_provision_partitions 2024_01:2024_12""",
+                        default=None)
+
+    parser.add_argument('--unmerge_log_hashes',
+                        help="""Un-merge the logs of these log_hash values without their azm files then exit: a comma separated list of log_hash
+                        values or the path of a text file with one log_hash per line (or comma/space separated). All rows of these logs are
+                        deleted from all tables with a log_hash col in --pg_schema (only from the month partitions of each log with
+                        --pg10_partition_by_month tables) in one transaction.
+                        example:
+                        python azm_db_merge.py --target_db_type postgresql --server_user postgres --server_password pass --server_database azqdb --unmerge_log_hashes bad_campaign_log_hashes.txt""",
+                        default=None)
     
     args = vars(parser.parse_args())
+    if args['pg10_partition_by_log_hash'] and not args['pg10_partition_by_month']:
+        parser.error("--pg10_partition_by_log_hash needs --pg10_partition_by_month")
+    if args['pg_pipeline_copy'] and args['workers'] > 1:
+        # the row exclusive locks of its uncommitted COPYs would block the ALTER/partition DDL of the other workers until the lock_timeout
+        parser.error("--pg_pipeline_copy can't be used with --workers > 1")
+    if args['azm_file'] is None and not (args['pg10_provision_partitions'] or args['unmerge_log_hashes']):
+        parser.error("the following arguments are required: --azm_file")
     return args
 
 def is_dump_schema_only_for_target_db_type(args):
@@ -245,8 +415,13 @@ def popen_sqlite3_dump(args):
 """
 
 # Dump db to a text sql file
-def dump_db_to_sql(dir_processing_azm):
+def dump_db_to_sql(args, dir_processing_azm):
     dumped_sql_fp = "{}_dump.sql".format(args['file'])
+    if azm_sqlite_reader.is_open() and is_dump_schema_only_for_target_db_type(args):
+        with open(dumped_sql_fp, "w") as f:
+            f.write(azm_sqlite_reader.get_schema())
+        print("dump db schema to {} file with azm_sqlite_reader success".format(dumped_sql_fp))
+        return dumped_sql_fp
     cmd = [
         "{}".format(args['sqlite3_executable']),
         "{}".format(args['file']),
@@ -277,6 +452,14 @@ g_create_function = None
 g_commit_function = None
 g_close_function = None
 
+# global vars for --prefetch_azm_files
+g_prefetch_executor = None
+g_prefetch_futures = {}  # azm_file -> future of prefetch_azm_file()
+g_prefetched_dirs = set()  # dir_processing_azm of prefetched azms not yet taken by process_azm_file() - cleaned up on SIGTERM
+# reentrant: sigterm_handler() runs stop_azm_prefetches() in the main thread - also while it is inside a 'with g_prefetch_lock' block
+g_prefetch_lock = threading.RLock()
+g_prefetch_stopped = False
+
 # g_insert_function = None
 
 
@@ -371,11 +554,7 @@ def handle_sql3_dump_line(args, line):
             handle_ret = g_create_function(args, line)
         except Exception as e:
             estr = str(e)
-            ignore_tables = [
-                "lte_rrc_tmsi",
-                "nr_handover_stats" # pg col name too long - most servers are spark already anyway - migrating the rest
-            ]
-            if table_name.strip() in ignore_tables:
+            if table_name.strip() in azm_db_constants.IGNORE_ERROR_TABLES:
                 print("WARNING: ignoring error: {} for table: {}".format(e, table_name))
             else:
                 raise e
@@ -410,28 +589,39 @@ def handle_sql3_dump_line(args, line):
 
 
 # unzip azm file to a tmp processing folder
-def unzip_azm_to_tmp_folder(args):         
-    
-    dprint("unzip_azm_to_tmp_folder 0")
-    print("args['azm_file']: "+args['azm_file'])
-    azm_fp = os.path.abspath(args['azm_file'])
-    print("azm_fp: "+azm_fp)
-    
-    if os.path.isfile(azm_fp):
-        pass
-    else:
-        raise Exception("INVALID: - azm file does not exist at given path: "+str(azm_fp)+" - ABORT")        
-    
+def get_schema_shasum(schema):
+    # schema: bytes of the sqlite3 '.schema' output of azqdata.db
+    sha1 = hashlib.sha1()
+    sha1.update(schema)
+    return str(sha1.hexdigest())
+
+
+def can_use_in_memory_db(args, azm):
+    if not args['in_memory_db']:
+        return False
+    # these read the extracted azqdata.db file itself
+    if args['sqlite3_cli_reader'] or args['call_preprocess_func_in_module_before_import'] or args['target_db_type'] == "sqlite3" or args['get_schema_shasum_and_exit']:
+        print("--in_memory_db: not used as the azqdata.db file is needed on disk for the specified options")
+        return False
+    db_size = azm.getinfo("azqdata.db").file_size
+    max_size = args['in_memory_db_max_mb'] * 1024 * 1024
+    if db_size > max_size:
+        print("--in_memory_db: not used as azqdata.db uncompressed size {} > --in_memory_db_max_mb {}".format(db_size, args['in_memory_db_max_mb']))
+        return False
+    return True
+
+
+TMPFS_DIR = "/tmpfs"
+GB_BYTES = 1024 * 1024 * 1024
+MIN_TMPFS_REMAIN_SPACE_BYTES = 8 * GB_BYTES
+
+
+def get_dir_azm_unpack(azm_fp):
     dir_azm_unpack = os.path.dirname(azm_fp)
     print("dir_azm_unpack: "+dir_azm_unpack)
-    azm_name_no_ext = os.path.splitext(os.path.basename(azm_fp))[0]
-    print("azm_name_no_ext: "+azm_name_no_ext)
     if 'TMP_GEN_PATH' in os.environ:
         dir_azm_unpack = os.environ['TMP_GEN_PATH']
         print("dir_azm_unpack using TMP_GEN_PATH:", dir_azm_unpack)
-    TMPFS_DIR = "/tmpfs"
-    GB_BYTES = 1024 * 1024 * 1024
-    MIN_TMPFS_REMAIN_SPACE_BYTES = 8 * GB_BYTES
     if os.path.isdir(TMPFS_DIR) and os.system("touch /tmpfs/test_touch") == 0:
         cleanup_old_tmpfs_tmp_dirs_with_invalid_pid_files()
         statvfs = os.statvfs(TMPFS_DIR)
@@ -443,6 +633,24 @@ def unzip_azm_to_tmp_folder(args):
         else:
             print("NOT using /tmpfs because remain_space {} MIN_TMPFS_REMAIN_SPACE_BYTES {}".format(remain_space,
                                                                                                     MIN_TMPFS_REMAIN_SPACE_BYTES))
+    return dir_azm_unpack
+
+
+def unzip_azm_to_tmp_folder(args):         
+    
+    dprint("unzip_azm_to_tmp_folder 0")
+    print("args['azm_file']: "+args['azm_file'])
+    azm_fp = os.path.abspath(args['azm_file'])
+    print("azm_fp: "+azm_fp)
+    
+    if os.path.isfile(azm_fp):
+        pass
+    else:
+        raise Exception("INVALID: - azm file does not exist at given path: "+str(azm_fp)+" - ABORT")        
+    
+    dir_azm_unpack = get_dir_azm_unpack(azm_fp)
+    azm_name_no_ext = os.path.splitext(os.path.basename(azm_fp))[0]
+    print("azm_name_no_ext: "+azm_name_no_ext)
     dir_processing_azm = os.path.join(dir_azm_unpack, "tmp_azm_db_merge_"+str(uuid.uuid4())+"_"+azm_name_no_ext.replace(" ","-")) # replace 'space' in azm file name
     args['dir_processing_azm'] = dir_processing_azm
     dprint("unzip_azm_to_tmp_folder 1 dir_processing_azm:", dir_processing_azm)
@@ -468,7 +676,11 @@ def unzip_azm_to_tmp_folder(args):
     
     try:
         azm = zipfile.ZipFile(args['azm_file'],'r')
-        azm.extract("azqdata.db", dir_processing_azm)
+        args['in_memory_db_used'] = can_use_in_memory_db(args, azm)
+        if args['in_memory_db_used']:
+            print("--in_memory_db: azqdata.db would be read from memory - not extracted to:", dir_processing_azm)
+        else:
+            azm.extract("azqdata.db", dir_processing_azm)
 
         '''
         try:
@@ -505,17 +717,14 @@ def unzip_azm_to_tmp_folder(args):
         
         if args['get_schema_shasum_and_exit']:
             print("get_schema_shasum_and_exit start")
-            sha1 = hashlib.sha1()
             #print "get_schema_shasum_and_exit 1"
             dbfile = os.path.join(dir_processing_azm,"azqdata.db")
             #print "get_schema_shasum_and_exit 2"
             cmd = [args['sqlite3_executable'],dbfile,".schema"]
             print("call cmd:", cmd)
-            schema = subprocess.check_output(cmd).decode()
+            schema = subprocess.check_output(cmd)
             #print "get_schema_shasum_and_exit 3"
-            sha1.update(schema)
-            #print "get_schema_shasum_and_exit 4"
-            print(str(sha1.hexdigest())+" is the sha1 for the schema of azqdata.db inside azm: "+args['azm_file'])
+            print(get_schema_shasum(schema)+" is the sha1 for the schema of azqdata.db inside azm: "+args['azm_file'])
             print("get_schema_shasum_and_exit done")
             azm.close()
             cleanup_tmp_dir(dir_processing_azm)
@@ -557,15 +766,149 @@ def cleanup_tmp_dir(dir_processing_azm):
             pass
 
 
+def prefetch_azm_file(args):
+    """
+    --prefetch_azm_files: unzip the azqdata.db of args['azm_file'] to its tmp processing folder (in a background
+    thread while the previous azm is imported) - returns dict of the unzip_azm_to_tmp_folder() results to use
+    in process_azm_file() or None if skipped because of the tmp space limit
+    """
+    azm_fp = os.path.abspath(args['azm_file'])
+    with zipfile.ZipFile(azm_fp, 'r') as azm:
+        db_size = azm.getinfo("azqdata.db").file_size
+    dir_azm_unpack = get_dir_azm_unpack(azm_fp)
+    statvfs = os.statvfs(dir_azm_unpack)
+    remain_space = statvfs.f_frsize * statvfs.f_bavail
+    if remain_space - db_size < MIN_TMPFS_REMAIN_SPACE_BYTES:
+        print("prefetch_azm_file: skip prefetch of {} because remain_space {} - azqdata.db size {} < MIN_TMPFS_REMAIN_SPACE_BYTES {}".format(azm_fp, remain_space, db_size, MIN_TMPFS_REMAIN_SPACE_BYTES))
+        return None
+    # set by unzip_azm_to_tmp_folder() - not the one of the azm being imported now from the copied args
+    args['dir_processing_azm'] = None
+    try:
+        dir_processing_azm = unzip_azm_to_tmp_folder(args)
+        with g_prefetch_lock:
+            if not g_prefetch_stopped:
+                g_prefetched_dirs.add(dir_processing_azm)
+                dir_processing_azm = None
+        if dir_processing_azm is not None:
+            # stop_azm_prefetches() was called while this azm was being unzipped
+            cleanup_tmp_dir(dir_processing_azm)
+            return None
+        if not args['in_memory_db_used']:
+            # check it can be read now so a corrupt azqdata.db doesn't wait for its turn to fail
+            azm_sqlite_reader.check_db(args['file'])
+    except:
+        # pop_prefetched_azm() falls back to a normal unzip - dont leave this unpack in the tmp dir (like /dev/shm) until exit
+        if args['dir_processing_azm'] is not None:
+            with g_prefetch_lock:
+                g_prefetched_dirs.discard(args['dir_processing_azm'])
+            cleanup_tmp_dir(args['dir_processing_azm'])
+        raise
+    print("prefetch_azm_file: done:", azm_fp)
+    return {
+        "dir_processing_azm": args['dir_processing_azm'],
+        "file": args['file'],
+        "in_memory_db_used": args['in_memory_db_used'],
+    }
+
+
+def submit_azm_prefetches(args, next_azm_files):
+    # keep up to --prefetch_azm_files of the next azms prefetched/prefetching
+    global g_prefetch_executor
+    with g_prefetch_lock:
+        if g_prefetch_stopped:
+            return
+        if g_prefetch_executor is None:
+            g_prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        for azm in next_azm_files[:args['prefetch_azm_files']]:
+            if azm not in g_prefetch_futures:
+                prefetch_args = args.copy()
+                prefetch_args['azm_file'] = azm
+                g_prefetch_futures[azm] = g_prefetch_executor.submit(prefetch_azm_file, prefetch_args)
+
+
+def pop_prefetched_azm(azm):
+    # returns the prefetch_azm_file() result of azm (waits if it is still being unzipped) or None if it was not prefetched
+    with g_prefetch_lock:
+        future = g_prefetch_futures.pop(azm, None)
+    if future is None:
+        return None
+    try:
+        prefetched = future.result()
+    except Exception as e:
+        # process_azm_file() would unzip it again and handle the failure as usual
+        print("WARNING: prefetch of azm {} failed - exception: {}".format(azm, e))
+        return None
+    if prefetched is not None:
+        with g_prefetch_lock:
+            g_prefetched_dirs.discard(prefetched['dir_processing_azm'])
+    return prefetched
+
+
+def stop_azm_prefetches():
+    global g_prefetch_stopped
+    with g_prefetch_lock:
+        g_prefetch_stopped = True
+        if g_prefetch_executor is not None:
+            g_prefetch_executor.shutdown(wait=False, cancel_futures=True)
+        g_prefetch_futures.clear()
+        dirs = list(g_prefetched_dirs)
+        g_prefetched_dirs.clear()
+    for dir_processing_azm in dirs:
+        cleanup_tmp_dir(dir_processing_azm)
+
+
+class LogMetadata(object):
+    """
+    metadata of the log in azqdata.db - read once per azm by read_log_metadata() and shared by all later stages
+    """
+    def __init__(self):
+        self.log_hash = None  # int
+        self.log_timezone_offset = None  # int - in millis
+        self.log_start_time_str = None
+        self.log_end_time_str = None
+        self.log_start_time = None  # datetime
+        self.log_end_time = None  # datetime
+        self.log_app_version = None  # like "v3.0.562"
+        self.imei = None  # only read for --add_imei_id_to_all_tables
+
+
+def read_log_metadata(args):
+    # one query on the logs table (there is always only 1 row of logs per azm) instead of one per value - then the fallbacks
+    sqlstr = "select log_hash, log_timezone_offset, log_start_time, log_end_time, strftime('%s', log_start_time), strftime('%s', log_end_time), log_app_version from logs limit 1"
+    vals = get_sql_result(sqlstr, args).split("|")
+    if len(vals) != 7:
+        raise Exception("FATAL: failed to read log metadata from logs table - got: {}".format(vals))
+    log_metadata = LogMetadata()
+    log_metadata.log_hash = int(vals[0])
+    log_metadata.log_timezone_offset = int(vals[1])
+    log_metadata.log_start_time_str = vals[2]
+    log_metadata.log_end_time_str = vals[3]
+    print("parse log_start_time:", vals[4])
+    log_metadata.log_start_time = datetime.fromtimestamp(int(vals[4]))
+    log_end_time = vals[5]
+    # some rare cases older apks log_end_time somehow didnt get into db
+    if not log_end_time:
+        log_end_time = get_sql_result(
+            "select strftime('%s', max(time)) from android_info_1sec",
+            args
+        )
+    print("parse log_end_time:", log_end_time)
+    log_metadata.log_end_time = datetime.fromtimestamp(int(log_end_time))
+    log_metadata.log_app_version = vals[6]
+    if args['add_imei_id_to_all_tables']:
+        log_metadata.imei = get_sql_result(
+            "select IMEI from log_info where IMEI != '' order by seqid desc limit 1;",  # not null and not empty
+            args
+        )
+    return log_metadata
+
+
 def check_azm_azq_app_version(args):
     # check version of AZENQOS app that produced the .azm file - must be at least 3.0.562    
     MIN_APP_V0 = 3
     MIN_APP_V1 = 0
     MIN_APP_V2 = 587
-    sqlstr = "select log_app_version from logs" # there is always only 1 ver of AZENQOS app for 1 azm - and normally 1 row of logs per azm too - but limit just in-case to be future-proof 
-    cmd = [args['sqlite3_executable'],args['file'],sqlstr]
-    print("call cmd:", cmd)
-    outstr = subprocess.check_output(cmd).decode().strip()
+    outstr = args['log_metadata'].log_app_version
     try:
         args["azm_apk_version"] = "0.0.0"
         outstr = outstr.replace("v","") # replace 'v' prefix - like "v3.0.562" outstr
@@ -591,7 +934,7 @@ def mv_azm_to_target_folder(args):
 
     if not mv_target_folder is None:
         if not os.path.exists(mv_target_folder):
-            os.makedirs(mv_target_folder)        
+            os.makedirs(mv_target_folder, exist_ok=True)        
         azm_fp = os.path.abspath(args['azm_file'])
         target_fp = os.path.join(mv_target_folder,os.path.basename(azm_fp))
         try:
@@ -612,6 +955,7 @@ def process_azm_file(args):
     ret = -9
     use_popen_mode = True
     sql_dump_file = None
+    schema_cache_retry = False
             
     
     try:
@@ -627,7 +971,14 @@ def process_azm_file(args):
             print("dry_mode - dont unzip azm for azqdata.db - let preprocess func handle itself")
         else:
             print("normal import mode")
-            dir_processing_azm = unzip_azm_to_tmp_folder(args)
+            prefetched = args.get('prefetched_azm')
+            if prefetched is not None:
+                print("using prefetched azm tmp dir:", prefetched['dir_processing_azm'])
+                dir_processing_azm = prefetched['dir_processing_azm']
+                args['file'] = prefetched['file']
+                args['in_memory_db_used'] = prefetched['in_memory_db_used']
+            else:
+                dir_processing_azm = unzip_azm_to_tmp_folder(args)
             args['dir_processing_azm'] = dir_processing_azm
 
         preprocess_module = args['call_preprocess_func_in_module_before_import']
@@ -645,6 +996,29 @@ def process_azm_file(args):
             print("dry_mode - end here")
             mv_azm_to_target_folder(args)
             return 0
+
+        if args['in_memory_db_used']:
+            try:
+                azm_sqlite_reader.open_db_from_zip(args['azm_file'], "azqdata.db")
+            except Exception as e:
+                print("WARNING: azm_sqlite_reader open_db_from_zip failed - fallback to extract azqdata.db to disk - exception:", e)
+                azm_sqlite_reader.close_db()
+                args['in_memory_db_used'] = False
+                with zipfile.ZipFile(args['azm_file'], 'r') as azm:
+                    azm.extract("azqdata.db", dir_processing_azm)
+
+        if not args['sqlite3_cli_reader'] and not args['in_memory_db_used']:
+            try:
+                azm_sqlite_reader.open_db(args['file'])
+            except Exception as e:
+                print("WARNING: azm_sqlite_reader open_db failed - fallback to use --sqlite3_executable for reads - exception:", e)
+                azm_sqlite_reader.close_db()
+
+        log_metadata = read_log_metadata(args)
+        args['log_metadata'] = log_metadata
+        if args['add_imei_id_to_all_tables']:
+            args['imei'] = log_metadata.imei
+            print("args['imei']:", args['imei'])
             
         app_ver = check_azm_azq_app_version(args)
         print("app_ver:", app_ver)
@@ -687,9 +1061,13 @@ def process_azm_file(args):
                 raise Exception("FATAL: dump_process is None in popen_mode - ABORT")
         else:
             print("starting sqlite3 to dump db to .sql file...")
-            dumped_sql_fp = dump_db_to_sql(dir_processing_azm)
+            dumped_sql_fp = dump_db_to_sql(args, dir_processing_azm)
             if dumped_sql_fp is None:
                 raise Exception("FATAL: dumped_sql_fp is None in non popen_mode - ABORT")
+            if args['schema_cache_file'] and is_dump_schema_only_for_target_db_type(args):
+                with open(dumped_sql_fp, "rb") as f:
+                    args['schema_shasum'] = get_schema_shasum(f.read())
+                print("args['schema_shasum']:", args['schema_shasum'])
         
         
         # sqlite3 merge is simple run .read on args['dumped_sql_fp']
@@ -764,20 +1142,11 @@ def process_azm_file(args):
 
         # check if this azm is already imported/merged in target db (and exit of already imported)
         # get log_hash
-        sqlstr = "select log_hash from logs limit 1"
-        cmd = [args['sqlite3_executable'],args['file'],sqlstr]
-        print("call cmd:", cmd)
-        outstr = subprocess.check_output(cmd).decode()
-        log_hash = outstr.strip()
-        args['log_hash'] = int(log_hash)
+        args['log_hash'] = log_metadata.log_hash
+        log_hash = str(log_metadata.log_hash)
         print("args['log_hash']:", args['log_hash'])
 
-        sqlstr = "select log_timezone_offset from logs limit 1"
-        cmd = [args['sqlite3_executable'],args['file'],sqlstr]
-        print("call cmd:", cmd)
-        outstr = subprocess.check_output(cmd).decode()
-        tzoff = outstr.strip()
-        args['log_timezone_offset'] = int(tzoff)  # in millis
+        args['log_timezone_offset'] = log_metadata.log_timezone_offset  # in millis
         print("args['log_timezone_offset']:", args['log_timezone_offset'])
         
         ori_log_hash_datetime =  datetime.fromtimestamp(
@@ -791,44 +1160,15 @@ def process_azm_file(args):
         args['log_hash_ym_str'] = log_hash_ym_str
         print("args['log_hash_ym_str']:", args['log_hash_ym_str'])
 
-        if log_hash == 0:
+        if args['log_hash'] == 0:
             raise Exception("FATAL: invalid log_hash == 0 case")
 
-
-        args['log_start_time_str'] = get_sql_result(
-            "select log_start_time from logs limit 1",
-            args
-        )
-        args['log_end_time_str'] = get_sql_result(
-            "select log_end_time from logs limit 1",
-            args
-        )
-        #print "args['log_end_time_str']:", args['log_end_time_str']
-
-        
-        args['log_start_time'] = get_sql_result(
-            "select strftime('%s', log_start_time) from logs limit 1",
-            args
-        )
-        print("parse log_start_time:", args['log_start_time'])
-        args['log_start_time'] = datetime.fromtimestamp(int(args['log_start_time']))
+        args['log_start_time_str'] = log_metadata.log_start_time_str
+        args['log_end_time_str'] = log_metadata.log_end_time_str
+        args['log_start_time'] = log_metadata.log_start_time
         print("args['log_start_time']:", args['log_start_time'])
         print("args['log_start_time_str']:", args['log_start_time_str'])
-
-        args['log_end_time'] = get_sql_result(
-            "select strftime('%s', log_end_time) from logs limit 1",
-            args
-        )
-
-        # some rare cases older apks log_end_time somehow didnt get into db
-        if not args['log_end_time']:
-            args['log_end_time'] = get_sql_result(
-                "select strftime('%s', max(time)) from android_info_1sec",
-                args
-            )            
-        
-        print("parse log_end_time:", args['log_end_time'])
-        args['log_end_time'] = datetime.fromtimestamp(int(args['log_end_time']))
+        args['log_end_time'] = log_metadata.log_end_time
         print("args['log_end_time']:", args['log_end_time'])
         print("args['log_end_time_str']:", args['log_end_time_str'])
 
@@ -839,9 +1179,6 @@ def process_azm_file(args):
         print("args['log_data_max_time']:", args['log_data_max_time'])
 
 
-        if log_hash == 0:
-            raise Exception("FATAL: invalid log_hash == 0 case")
-
         g_check_if_already_merged_function(args, log_hash)
                 
         ''' now we're connected and ready to import, open dumped file and hadle CREATE/INSERT
@@ -881,6 +1218,8 @@ def process_azm_file(args):
         operation = "merge/import"
         if (args['unmerge']):
             operation = "unmerge/delete"
+        elif args['reimport']:
+            operation = "reimport/replace"
         else:
             pass
             
@@ -893,35 +1232,40 @@ def process_azm_file(args):
         
     
     except Exception as e:
-        type_, value_, traceback_ = sys.exc_info()
-        exstr = traceback.format_exception(type_, value_, traceback_)
+        if azm_schema_cache.STALE_EXCEPTION_STR in str(e) and not args.get('schema_cache_retried'):
+            # its schema cache entries are invalidated - retry once with the table create/alter checks (after the cleanup below)
+            print("WARNING: schema cache was stale for this azm - retry it once without the cache - exception:", e)
+            schema_cache_retry = True
+        else:
+            type_, value_, traceback_ = sys.exc_info()
+            exstr = traceback.format_exception(type_, value_, traceback_)
 
-        mv_target_folder = args['move_failed_import_azm_files_to_folder']            
-        if not mv_target_folder is None and not os.path.exists(mv_target_folder):
-            os.makedirs(mv_target_folder)            
-        if not mv_target_folder is None:
-            azm_fp = os.path.abspath(args['azm_file'])
-            target_fp = os.path.join(mv_target_folder,os.path.basename(azm_fp))
-            try:
-                os.remove(target_fp)
-                os.remove(target_fp+"_output.txt")
-            except Exception as x:
-                pass
+            mv_target_folder = args['move_failed_import_azm_files_to_folder']            
+            if not mv_target_folder is None and not os.path.exists(mv_target_folder):
+                os.makedirs(mv_target_folder, exist_ok=True)            
+            if not mv_target_folder is None:
+                azm_fp = os.path.abspath(args['azm_file'])
+                target_fp = os.path.join(mv_target_folder,os.path.basename(azm_fp))
+                try:
+                    os.remove(target_fp)
+                    os.remove(target_fp+"_output.txt")
+                except Exception as x:
+                    pass
             
-            print("move the failed_import_azm_files_to_folder: mv {} to {}".format(azm_fp,target_fp))
-            try:
-                os.rename(azm_fp, target_fp)
+                print("move the failed_import_azm_files_to_folder: mv {} to {}".format(azm_fp,target_fp))
                 try:
-                    os.rename(azm_fp+"_output.txt", target_fp+"_output.txt")
-                except:
+                    os.rename(azm_fp, target_fp)
+                    try:
+                        os.rename(azm_fp+"_output.txt", target_fp+"_output.txt")
+                    except:
+                        pass
+                except Exception as x:
+                    print("WARNING: move_failed_import_azm_files_to_folder failed")
                     pass
-            except Exception as x:
-                print("WARNING: move_failed_import_azm_files_to_folder failed")
-                pass
 
     
-        print("re-raise exception e - ",exstr)
-        raise e
+            print("re-raise exception e - ",exstr)
+            raise e
     
     finally:
         print("cleanup start...")
@@ -941,6 +1285,7 @@ def process_azm_file(args):
             g_close_function(args)
         except:
             pass
+        azm_sqlite_reader.close_db()
         
         if debug_helpers.debug == 1 or args['keep_temp_dir']:
             print("debug mode keep_tmp_dir:", dir_processing_azm)
@@ -948,17 +1293,248 @@ def process_azm_file(args):
         else:
             print("cleanup_tmp_dir...")
             cleanup_tmp_dir(dir_processing_azm)
+
+    if schema_cache_retry:
+        args['schema_cache_retried'] = True
+        # its prefetched unpack dir is removed by the cleanup above - unzip again
+        args['prefetched_azm'] = None
+        try:
+            return process_azm_file(args)
+        finally:
+            args['schema_cache_retried'] = False
     
     return ret
 
 
+def load_handler_module(args):
+    global g_connect_function
+    global g_check_if_already_merged_function
+    global g_create_function
+    global g_commit_function
+    global g_close_function
+
+    mod_name = args['target_db_type']
+    if args['debug']:
+        print("set_debug 1")
+        debug_helpers.set_debug(1)
+    else:
+        print("set_debug 0")
+        debug_helpers.set_debug(0)
+
+    #if  mod_name in ['postgresql','mssql']:
+    mod_name = 'gen_sql'
+    mod_name = mod_name + "_handler"
+    print("### get module: ", mod_name)
+    importlib.import_module(mod_name)
+    mod = sys.modules[mod_name]
+    #print "module dir: "+str(dir(mod))
+
+    g_connect_function = getattr(mod, 'connect')
+    g_check_if_already_merged_function = getattr(mod, 'check_if_already_merged')
+    g_create_function = getattr(mod, 'create')
+    g_commit_function = getattr(mod, 'commit')
+    g_close_function = getattr(mod, 'close')
+
+
+def init_worker(args):
+    # --workers pool process: module globals of the handler are not inherited in 'spawn' mode so load them here again
+    load_handler_module(args)
+
+
+def process_azm_file_in_worker(args):
+    # runs in a --workers pool process (with its own tmp dir and target db connection like any other single azm run)
+    # returns table_operation_stats of this azm for the aggregated stats, the exception str instead of raising to the main process
+    # and the log_hash (None if not read yet) for the --ledger_file
+    args['table_operation_stats'] = {
+        "table": [],
+        "operation": [],
+        "duration": []
+    }
+    print("## START process azm in worker pid {}: '{}'".format(os.getpid(), args['azm_file']))
+    ret = -9
+    exstr = None
+    try:
+        ret = process_azm_file(args)
+    except Exception as e:
+        type_, value_, traceback_ = sys.exc_info()
+        exstr = "{}\n{}".format(str(e), traceback.format_exception(type_, value_, traceback_))
+    return ret, args['table_operation_stats'], exstr, args.get('log_hash')
+
+
+def process_azm_files_with_workers(args, azm_files, failed_azm_files=None):
+    # process azm_files in a pool of --workers processes - returns (n_done, n_failed, ret) like the single process loop in __main__
+    # the failed azm files are appended to failed_azm_files if given
+    nazm = len(azm_files)
+    iazm = 0
+    ifailed = 0
+    ret = -1
+    stop = False
+    print("processing {} azm files with --workers {} processes".format(nazm, args['workers']))
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=args['workers'], initializer=init_worker, initargs=(args,))
+    try:
+        pending_azm_files = list(azm_files)
+        running = {}
+        start_times = {}
+        while pending_azm_files or running:
+            # submit only as many as there are workers - so nothing more gets started after a failure with --folder_mode_stop_on_first_failure
+            while pending_azm_files and len(running) < args['workers'] and not stop:
+                worker_args = args.copy()
+                worker_args['azm_file'] = pending_azm_files.pop(0)
+                running[executor.submit(process_azm_file_in_worker, worker_args)] = worker_args['azm_file']
+                start_times[worker_args['azm_file']] = time.time()
+            if not running:
+                break
+            done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                azm = running.pop(future)
+                iazm = iazm + 1
+                try:
+                    azm_ret, azm_table_operation_stats, exstr, log_hash = future.result()
+                except Exception as e:
+                    azm_ret, azm_table_operation_stats, exstr, log_hash = -9, None, "worker process failed: {}".format(e), None
+                if azm_table_operation_stats is not None:
+                    for k in args["table_operation_stats"]:
+                        args["table_operation_stats"][k] += azm_table_operation_stats[k]
+                if exstr is None and azm_ret != 0:
+                    exstr = "ABORT: process_azm_file failed with ret code: "+str(azm_ret)
+                record_azm_in_ledger(args, azm, start_times.pop(azm), exstr, log_hash)
+                if exstr is None:
+                    ret = azm_ret
+                    print("## DONE process azm {}/{}: '{}' retcode {}".format(iazm, nazm, azm, azm_ret))
+                else:
+                    ifailed = ifailed + 1
+                    if failed_azm_files is not None:
+                        failed_azm_files.append(azm)
+                    print("## FAILED: process azm {} failed with below exception:\n(start of exception)\n{}(end of exception)".format(azm, exstr))
+                    if args['folder_mode_stop_on_first_failure'] and not stop:
+                        print("--folder_mode_stop_on_first_failure specified - wait for the already running azm files then exit...")
+                        stop = True
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    if stop:
+        print("--folder_mode_stop_on_first_failure specified - exit now.")
+        exit(-9)
+    return iazm, ifailed, ret
+
+
+def get_ledger_key(args):
+    # (target, operation) of the --ledger_file entries of this run
+    if args['target_db_type'] == 'postgresql':
+        target = "postgresql://{}:{}/{}/{}".format(args['pg_host'], args['pg_port'], args['server_database'], args['pg_schema'])
+    else:
+        target = "{}://{}".format(args['target_db_type'], args['server_database'])
+    operation = "merge"
+    if args['unmerge']:
+        operation = "unmerge"
+    elif args['reimport']:
+        operation = "reimport"
+    if args['dump_parquet']:
+        operation += "+parquet"
+    return (target, operation)
+
+
+def record_azm_in_ledger(args, azm, start_time, exstr, log_hash):
+    if not azm_ledger.is_open():
+        return
+    try:
+        outcome = azm_ledger.record(get_ledger_key(args), azm, start_time, time.time() - start_time, exstr, None if log_hash is None else int(log_hash))
+        print("azm_ledger: recorded {} outcome: {}".format(azm, outcome))
+    except Exception as e:
+        print("WARNING: azm_ledger record failed: "+str(e))
+
+
 def sigterm_handler(_signo, _stack_frame):
     print("azm_db_merge.py: received SIGTERM - exit(0) now...")
+    stop_azm_prefetches()
     sys.exit(0)
     return
 
 
+def parse_provision_partitions_months(months_str):
+    # 'YYYY_MM:YYYY_MM' or 'YYYY_MM' -> list of datetimes of each month in the range
+    parts = months_str.split(":")
+    if len(parts) > 2:
+        raise Exception("ABORT: invalid --pg10_provision_partitions (must be YYYY_MM:YYYY_MM or YYYY_MM): "+months_str)
+    first_month = datetime.strptime(parts[0].strip(), "%Y_%m")
+    last_month = datetime.strptime(parts[-1].strip(), "%Y_%m")
+    if last_month < first_month:
+        raise Exception("ABORT: invalid --pg10_provision_partitions (end month before start month): "+months_str)
+    months = []
+    month = first_month
+    while month <= last_month:
+        months.append(month)
+        month += relativedelta(months=+1)
+    return months
+
+
+def provision_partitions_and_exit(args):
+    if args['target_db_type'] != 'postgresql':
+        raise Exception("ABORT: --pg10_provision_partitions is only supported for --target_db_type postgresql")
+    months = parse_provision_partitions_months(args['pg10_provision_partitions'])
+    print("provision_partitions_and_exit months:", [month.strftime("%Y_%m") for month in months])
+    args['dir_processing_azm'] = None
+    ret = False
+    try:
+        if g_connect_function(args) == False:
+            raise Exception("FATAL: connect_function failed")
+        import gen_sql_handler
+        ret = gen_sql_handler.provision_partitions(args, months)
+    finally:
+        g_close_function(args)
+    print("provision_partitions_and_exit done - ret:", ret)
+    sys.exit(0 if ret else 1)
+
+
+def parse_log_hashes(log_hashes_str):
+    # --unmerge_log_hashes: file path or comma separated list -> list of unique int log_hash values in the given order
+    if os.path.isfile(log_hashes_str):
+        with open(log_hashes_str, "r") as f:
+            log_hashes_str = f.read()
+    log_hashes = []
+    for log_hash_str in log_hashes_str.replace(",", " ").split():
+        try:
+            log_hash = int(log_hash_str)
+        except ValueError:
+            raise Exception("ABORT: invalid log_hash in --unmerge_log_hashes: "+log_hash_str)
+        if log_hash == 0:
+            raise Exception("ABORT: invalid log_hash == 0 in --unmerge_log_hashes")
+        if log_hash not in log_hashes:
+            log_hashes.append(log_hash)
+    if not log_hashes:
+        raise Exception("ABORT: no log_hash in --unmerge_log_hashes: "+log_hashes_str)
+    return log_hashes
+
+
+def unmerge_log_hashes_and_exit(args):
+    if args['target_db_type'] == 'sqlite3':
+        raise Exception("ABORT: --unmerge_log_hashes is not supported for --target_db_type sqlite3")
+    log_hashes = parse_log_hashes(args['unmerge_log_hashes'])
+    print("unmerge_log_hashes_and_exit: {} log_hashes".format(len(log_hashes)))
+    args['dir_processing_azm'] = None
+    args['unmerge'] = True
+    ret = False
+    try:
+        if g_connect_function(args) == False:
+            raise Exception("FATAL: connect_function failed")
+        import gen_sql_handler
+        ret = gen_sql_handler.unmerge_log_hashes(args, log_hashes)
+    finally:
+        g_close_function(args)
+    if args['ledger_file']:
+        # the merge entries of these logs must not skip their next merge
+        azm_ledger.open_ledger(args['ledger_file'])
+        try:
+            azm_ledger.invalidate_log_hashes(get_ledger_key(args)[0], log_hashes)
+        finally:
+            azm_ledger.close_ledger()
+    print("unmerge_log_hashes_and_exit done - ret:", ret)
+    sys.exit(0 if ret else 1)
+
+
 def get_sql_result(sqlstr, args):
+    if azm_sqlite_reader.is_open():
+        print("get_sql_result azm_sqlite_reader sqlstr:", sqlstr)
+        return azm_sqlite_reader.get_sql_result(sqlstr)
     cmd = [args['sqlite3_executable'],args['file'],sqlstr]
     print("get_sql_result cmd:", cmd)
     outstr = subprocess.check_output(cmd).decode()
@@ -1048,6 +1624,20 @@ if __name__ == '__main__':
     if (args['unmerge']):
         print("starting with --unmerge mode")
 
+    if args['reimport']:
+        print("starting with --reimport mode")
+        if args['unmerge']:
+            raise Exception("INVALID: --reimport and --unmerge can't be used together - ABORT")
+        if args['target_db_type'] != 'postgresql':
+            raise Exception("INVALID: --reimport is only supported for --target_db_type postgresql - ABORT")
+
+    if args['parquet_dataset_dir'] and args['parquet_object_store']:
+        raise Exception("INVALID: --parquet_dataset_dir and --parquet_object_store can't be used together - ABORT")
+
+    if args['parquet_dataset_dir'] and not args['parquet_hive_layout']:
+        print("--parquet_dataset_dir: using --parquet_hive_layout")
+        args['parquet_hive_layout'] = True
+
     print("checking --sqlite3_executable: ",args['sqlite3_executable'])
     try:
         cmd = [
@@ -1121,27 +1711,13 @@ if __name__ == '__main__':
         else:
             raise Exception("ABORT: Can't create or access folder specified by --move_imported_azm_files_to_folder: "+str(args['move_imported_azm_files_to_folder']))
 
-    mod_name = args['target_db_type']
-    if args['debug']:
-        print("set_debug 1")
-        debug_helpers.set_debug(1)
-    else:
-        print("set_debug 0")
-        debug_helpers.set_debug(0)
+    load_handler_module(args)
 
-    #if  mod_name in ['postgresql','mssql']:
-    mod_name = 'gen_sql'
-    mod_name = mod_name + "_handler"
-    print("### get module: ", mod_name)
-    importlib.import_module(mod_name)
-    mod = sys.modules[mod_name]
-    #print "module dir: "+str(dir(mod))
+    if args['pg10_provision_partitions']:
+        provision_partitions_and_exit(args)
 
-    g_connect_function = getattr(mod, 'connect')
-    g_check_if_already_merged_function = getattr(mod, 'check_if_already_merged')
-    g_create_function = getattr(mod, 'create')
-    g_commit_function = getattr(mod, 'commit')
-    g_close_function = getattr(mod, 'close')
+    if args['unmerge_log_hashes']:
+        unmerge_log_hashes_and_exit(args)
 
     if "," in args['azm_file']:
         print("found comman in args['azm_file'] - split and use whichever is first present in the list")
@@ -1167,19 +1743,17 @@ if __name__ == '__main__':
         print("folder_daemon_wait_seconds: ",folder_daemon_wait_seconds)
         if folder_daemon_wait_seconds <= 0:
             raise Exception("ABORT: --daemon_mode_rerun_on_folder_after_seconds option must be greater than 0.")
+    if args['ledger_file']:
+        if not azm_file_is_folder:
+            print("WARNING: --ledger_file is only used when --azm_file is a folder")
+        elif args['dry'].strip().lower() == "true" or args['get_schema_shasum_and_exit']:
+            print("WARNING: --ledger_file is not used with --dry true or --get_schema_shasum_and_exit")
+        else:
+            azm_ledger.open_ledger(args['ledger_file'])
     ori_args = args
-
-    if args['add_imei_id_to_all_tables']:
-        # get imei
-        imei = None
-        col = "IMEI"
-        table = "log_info"
-        where = "where {} != ''".format(col) # not null and not empty
-        sqlstr = "select {} from {} {} order by seqid desc limit 1;".format(col, table, where)
-        cmd = [args['sqlite3_executable'],args['file'],sqlstr]
-        print("call cmd:", cmd)
-        imei = subprocess.check_output(cmd).decode().strip()
-        args['imei'] = imei
+    daemon_azm_files = None  # azm files of the next folder_daemon run from azm_folder_watcher
+    retry_azm_files = []  # failed azm files of folder_daemon runs - retried after folder_daemon_wait_seconds
+    retry_time = None
 
     while(True):
 
@@ -1188,8 +1762,15 @@ if __name__ == '__main__':
         args = ori_args.copy() # args gets modified by each run - especially ['azm_file'] gets changed - so we want to use a copy of the original_args here (otherwise args would get modified and we won't be able to restore to the original for daemon_mon
 
         azm_files = []
+        failed_azm_files = []
         # check if supplied 'azm_file' is a folder - then iterate over all azms in that folder
-        if azm_file_is_folder:
+        if folder_daemon:
+            if daemon_azm_files is None:
+                # first run: all azm files in the folder - then only the new ones from the watcher
+                azm_files = azm_folder_watcher.start(args['azm_file'], args['daemon_mode_watch'], folder_daemon_wait_seconds)
+            else:
+                azm_files = daemon_azm_files
+        elif azm_file_is_folder:
             dir = args['azm_file']
             print("supplied --azm_file: ",dir," is a directory - get a list of .azm files to process:")
             matches = []
@@ -1202,6 +1783,10 @@ if __name__ == '__main__':
         else:
             azm_files = [args['azm_file']]
 
+        deferred_azm_files = []
+        if azm_ledger.is_open():
+            azm_files, deferred_azm_files = azm_ledger.filter_azm_files(get_ledger_key(args), azm_files)
+
         nazm = len(azm_files)
         print("n_azm_files to process: {}".format(nazm))
         print("list of azm files to process: "+str(azm_files))
@@ -1210,24 +1795,39 @@ if __name__ == '__main__':
         ret = -1
         had_errors = False
 
-        for azm in azm_files:
-            iazm = iazm + 1
-            args['azm_file'] = azm
-            print("## START process azm {}/{}: '{}'".format(iazm, nazm, azm))
-            try: 
-                ret = process_azm_file(args)
-                if (ret != 0):
-                    raise Exception("ABORT: process_azm_file failed with ret code: "+str(ret))        
-                print("## DONE process azm {}/{}: '{}' retcode {}".format(iazm, nazm, azm, ret))        
-            except Exception as e:
-                ifailed = ifailed + 1
-                had_errors = True
-                type_, value_, traceback_ = sys.exc_info()
-                exstr = traceback.format_exception(type_, value_, traceback_)
-                print("## FAILED: process azm {} failed with below exception:\n(start of exception)\n{}\n{}(end of exception)".format(azm,str(e),exstr))
-                if (args['folder_mode_stop_on_first_failure']):
-                    print("--folder_mode_stop_on_first_failure specified - exit now.")
-                    exit(-9)
+        if args['workers'] > 1 and nazm > 1:
+            iazm, ifailed, ret = process_azm_files_with_workers(args, azm_files, failed_azm_files)
+            had_errors = ifailed > 0
+        else:
+            use_prefetch = args['prefetch_azm_files'] > 0 and nazm > 1 and args['dry'].strip().lower() != "true" and not args['get_schema_shasum_and_exit']
+            for azm in azm_files:
+                iazm = iazm + 1
+                args['azm_file'] = azm
+                args['prefetched_azm'] = None
+                if use_prefetch:
+                    submit_azm_prefetches(args, azm_files[iazm:])
+                    args['prefetched_azm'] = pop_prefetched_azm(azm)
+                print("## START process azm {}/{}: '{}'".format(iazm, nazm, azm))
+                azm_start_time = time.time()
+                args.pop('log_hash', None)  # of the previous azm
+                try: 
+                    ret = process_azm_file(args)
+                    if (ret != 0):
+                        raise Exception("ABORT: process_azm_file failed with ret code: "+str(ret))        
+                    print("## DONE process azm {}/{}: '{}' retcode {}".format(iazm, nazm, azm, ret))        
+                    record_azm_in_ledger(args, azm, azm_start_time, None, args.get('log_hash'))
+                except Exception as e:
+                    ifailed = ifailed + 1
+                    failed_azm_files.append(azm)
+                    had_errors = True
+                    type_, value_, traceback_ = sys.exc_info()
+                    exstr = traceback.format_exception(type_, value_, traceback_)
+                    record_azm_in_ledger(args, azm, azm_start_time, "{}\n{}".format(str(e), exstr), args.get('log_hash'))
+                    print("## FAILED: process azm {} failed with below exception:\n(start of exception)\n{}\n{}(end of exception)".format(azm,str(e),exstr))
+                    if (args['folder_mode_stop_on_first_failure']):
+                        print("--folder_mode_stop_on_first_failure specified - exit now.")
+                        stop_azm_prefetches()
+                        exit(-9)
 
         if (had_errors == False):
             print("SUCCESS - operation completed successfully for all azm files (tatal: %d) - in %.03f seconds." % (iazm,  time.time() - process_start_time))
@@ -1240,7 +1840,15 @@ if __name__ == '__main__':
             print("exit code:",str(ret))
             exit(ret)
         else:
-            print("*** folder_daemon mode: wait seconds: ",folder_daemon_wait_seconds)
-            for i in range(0,folder_daemon_wait_seconds):
-                print("** folder_daemon mode: waiting ",i,"/",folder_daemon_wait_seconds," seconds")
-                time.sleep(1)
+            # wait for new azm files instead of walking the whole folder again - the failed ones are retried after folder_daemon_wait_seconds
+            # with --ledger_file also the failed ones not retried yet because of their backoff
+            retry_azm_files += [azm for azm in failed_azm_files + deferred_azm_files if azm not in retry_azm_files]
+            if retry_time is None:
+                retry_time = time.time() + folder_daemon_wait_seconds
+            print("*** folder_daemon mode: {} watch - wait for new azm files - retry {} failed azm files in {:.0f} seconds".format(
+                azm_folder_watcher.get_mode(), len(retry_azm_files), max(retry_time - time.time(), 0)))
+            daemon_azm_files = azm_folder_watcher.wait_for_azm_files(max(retry_time - time.time(), 0))
+            if time.time() >= retry_time:
+                daemon_azm_files += [azm for azm in retry_azm_files if os.path.isfile(azm) and azm not in daemon_azm_files]
+                retry_azm_files = []
+                retry_time = None
@@ -0,0 +1,272 @@
+'''
+module for the --daemon_mode_rerun_on_folder_after_seconds folder daemon:
+watch the --azm_file folder tree for new .azm files instead of sleeping
+then walking the whole tree again for every run.
+
+- 'inotify' mode (linux): an .azm is queued as soon as it is fully written -
+  when the writer closes it (IN_CLOSE_WRITE) or it is renamed/moved into the
+  tree (IN_MOVED_TO - like an upload to a tmp name then an atomic rename).
+  New sub folders are watched (and scanned) as they appear. The tree is only
+  walked again if the kernel event queue overflowed.
+- 'poll' mode (no inotify, like network shares where remote writes have no
+  events, or not enough inotify watches): the tree is walked every
+  poll_interval_seconds and an .azm is queued once its size and mtime did
+  not change since the previous walk.
+
+Files are queued again only if their size or mtime changed since they were
+last queued (like a re-upload).
+
+Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
+
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import os
+import select
+import struct
+import time
+
+
+AZM_FILE_PATTERN = "*.azm"
+WATCH_MODES = ["auto", "inotify", "poll"]
+
+# from linux <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+INOTIFY_READ_SIZE = 64 * 1024
+
+# global vars
+g_mode = None
+g_root_dir = None
+g_poll_interval_seconds = None
+g_libc = None
+g_inotify_fd = None
+g_watch_dirs = {}  # inotify wd -> dir
+g_queued = {}  # path -> (size, mtime_ns) when it was last queued
+g_poll_pending = {}  # poll mode: path -> (size, mtime_ns) seen in the previous walk but not queued yet
+g_next_poll_time = None
+g_rescan = False  # inotify mode: event queue overflowed - walk the tree again
+
+
+def get_file_stat(fp):
+    # (size, mtime_ns) or None if fp is gone
+    try:
+        st = os.stat(fp)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+def is_azm_file_name(name):
+    return fnmatch.fnmatch(name, AZM_FILE_PATTERN)
+
+
+def walk_azm_files(root_dir, on_dir=None):
+    # all .azm files under root_dir (like the folder run of azm_db_merge) - on_dir(dir) is called for each dir first
+    azm_files = []
+    for root, dirnames, filenames in os.walk(root_dir):
+        if on_dir is not None:
+            on_dir(root)
+        for filename in fnmatch.filter(filenames, AZM_FILE_PATTERN):
+            azm_files.append(os.path.join(root, filename))
+    return azm_files
+
+
+def queue_if_changed(fp, azm_files):
+    stat = get_file_stat(fp)
+    if stat is None or g_queued.get(fp) == stat or fp in azm_files:
+        return False
+    g_queued[fp] = stat
+    azm_files.append(fp)
+    return True
+
+
+def init_inotify():
+    global g_libc, g_inotify_fd
+    g_libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    g_libc.inotify_init1.argtypes = [ctypes.c_int]
+    g_libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    fd = g_libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed: " + os.strerror(ctypes.get_errno()))
+    g_inotify_fd = fd
+
+
+def add_watch(dir):
+    wd = g_libc.inotify_add_watch(g_inotify_fd, os.fsencode(dir), INOTIFY_WATCH_MASK)
+    if wd < 0:
+        err = ctypes.get_errno()
+        if err in (errno.ENOENT, errno.ENOTDIR):
+            # already gone again
+            return None
+        raise OSError(err, "inotify_add_watch {} failed: {}".format(dir, os.strerror(err)))
+    g_watch_dirs[wd] = dir
+    return wd
+
+
+def start(root_dir, mode="auto", poll_interval_seconds=60):
+    """
+    start watching root_dir - returns the list of .azm files already in it (for the first run).
+    mode: 'inotify', 'poll' or 'auto' (inotify - or poll if inotify is not available).
+    """
+    global g_mode, g_root_dir, g_poll_interval_seconds, g_next_poll_time
+
+    stop()
+    if mode not in WATCH_MODES:
+        raise Exception("azm_folder_watcher: invalid mode: {}".format(mode))
+    g_root_dir = os.path.abspath(root_dir)
+    g_poll_interval_seconds = poll_interval_seconds
+    azm_files = None
+    if mode in ["auto", "inotify"]:
+        try:
+            init_inotify()
+            # watch each dir before listing its files so no file written in between is missed
+            azm_files = walk_azm_files(g_root_dir, on_dir=add_watch)
+            g_mode = "inotify"
+        except (OSError, AttributeError) as e:
+            if mode == "inotify":
+                stop()
+                raise
+            print("WARNING: azm_folder_watcher: inotify not available - use poll mode - exception: {}".format(e))
+            stop()
+            g_root_dir = os.path.abspath(root_dir)
+            g_poll_interval_seconds = poll_interval_seconds
+    if azm_files is None:
+        g_mode = "poll"
+        azm_files = walk_azm_files(g_root_dir)
+        g_next_poll_time = time.time() + g_poll_interval_seconds
+    ret = []
+    for fp in azm_files:
+        queue_if_changed(fp, ret)
+    print("azm_folder_watcher: started in {} mode on {} - {} azm files - {} watched dirs".format(g_mode, g_root_dir, len(ret), len(g_watch_dirs)))
+    return ret
+
+
+def stop():
+    global g_mode, g_root_dir, g_poll_interval_seconds, g_inotify_fd, g_next_poll_time, g_rescan
+    if g_inotify_fd is not None:
+        os.close(g_inotify_fd)
+    g_mode = None
+    g_root_dir = None
+    g_poll_interval_seconds = None
+    g_inotify_fd = None
+    g_watch_dirs.clear()
+    g_queued.clear()
+    g_poll_pending.clear()
+    g_next_poll_time = None
+    g_rescan = False
+    return True
+
+
+def get_mode():
+    return g_mode
+
+
+def read_inotify_events():
+    # list of (dir, mask, name) of the events ready now
+    global g_rescan
+    events = []
+    while True:
+        try:
+            buf = os.read(g_inotify_fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            break
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, name_len = INOTIFY_EVENT_HEADER.unpack_from(buf, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = os.fsdecode(buf[offset:offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                print("WARNING: azm_folder_watcher: inotify event queue overflow - walk the tree again")
+                g_rescan = True
+                continue
+            if mask & IN_IGNORED:
+                g_watch_dirs.pop(wd, None)
+                continue
+            if wd in g_watch_dirs:
+                events.append((g_watch_dirs[wd], mask, name))
+    return events
+
+
+def handle_inotify_events(events, azm_files):
+    for dir, mask, name in events:
+        fp = os.path.join(dir, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # new sub folder - watch it and take the azm files already moved/written into it
+                for azm_fp in walk_azm_files(fp, on_dir=add_watch):
+                    queue_if_changed(azm_fp, azm_files)
+            continue
+        if not is_azm_file_name(name):
+            continue
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            queue_if_changed(fp, azm_files)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            # a later file with the same path and stat (like a re-upload after a move) must be queued again
+            g_queued.pop(fp, None)
+
+
+def poll(azm_files):
+    seen = set()
+    for fp in walk_azm_files(g_root_dir):
+        seen.add(fp)
+        stat = get_file_stat(fp)
+        if stat is None or g_queued.get(fp) == stat:
+            continue
+        if g_poll_pending.get(fp) == stat:
+            # not changed since the previous walk - fully written
+            g_poll_pending.pop(fp)
+            queue_if_changed(fp, azm_files)
+        else:
+            g_poll_pending[fp] = stat
+    for fp in list(g_queued):
+        if fp not in seen:
+            g_queued.pop(fp)
+    for fp in list(g_poll_pending):
+        if fp not in seen:
+            g_poll_pending.pop(fp)
+
+
+def wait_for_azm_files(timeout_seconds):
+    """
+    block until new (fully written) azm files are in the watched tree or timeout_seconds passed -
+    returns the list of the new azm files (empty on timeout).
+    """
+    global g_rescan, g_next_poll_time
+    deadline = time.time() + timeout_seconds
+    azm_files = []
+    while True:
+        if g_mode == "inotify":
+            remaining = max(deadline - time.time(), 0)
+            readable, _, _ = select.select([g_inotify_fd], [], [], remaining)
+            if readable:
+                handle_inotify_events(read_inotify_events(), azm_files)
+            if g_rescan:
+                g_rescan = False
+                # add_watch() of an already watched dir just returns its wd again
+                for fp in walk_azm_files(g_root_dir, on_dir=add_watch):
+                    queue_if_changed(fp, azm_files)
+        else:
+            time.sleep(max(min(g_next_poll_time, deadline) - time.time(), 0))
+            if time.time() >= g_next_poll_time:
+                poll(azm_files)
+                g_next_poll_time = time.time() + g_poll_interval_seconds
+        if azm_files or time.time() >= deadline:
+            return azm_files
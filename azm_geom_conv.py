@@ -0,0 +1,155 @@
+'''
+module to convert spatialite 'geom' point blobs (from azqdata.db) to
+PostGIS EWKB / MS-SQL geography point bytes - on whole batches of
+column values at once with numpy instead of per csv line string parsing.
+
+See find_and_conv_spatialite_blob_to_wkb() in gen_sql_handler.py for the
+blob format details - this module keeps its semantics:
+- NULL (or empty) blobs stay NULL
+- 60 byte little-endian srid 4326 spatialite point blobs get converted
+- any other blob is kept as is
+
+conv_geom_arrow_array_to_wkb_lat_lon() does the same for the geom column of
+the --dump_parquet arrow tables - but any other blob becomes NULL there.
+
+Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
+
+'''
+
+import binascii
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+SPATIALITE_POINT_BLOB_LEN = 60
+SPATIALITE_POINT_BLOB_HEADER = bytes.fromhex("0001E6100000")  # start 00, little endian 01, srid 4326 E6100000
+SPATIALITE_POINT_XY_OFFSET = 43  # X (8 bytes) then Y (8 bytes)
+SPATIALITE_POINT_XY_LEN = 16
+
+# endian 01 + class_type point|wkbSRID 01000020 + srid 4326 E6100000 - then X, Y
+PG_EWKB_POINT_HEADER = bytes.fromhex("0101000020E6100000")
+PG_EWKB_POINT_LEN = len(PG_EWKB_POINT_HEADER) + SPATIALITE_POINT_XY_LEN
+# srid 4326 E6100000 + version 01 + serialization properties 0C (valid, single point) - then X, Y
+MS_GEOGRAPHY_POINT_HEADER = bytes.fromhex("E6100000010C")
+
+g_spatialite_point_blob_header_np = np.frombuffer(SPATIALITE_POINT_BLOB_HEADER, dtype=np.uint8)
+
+
+def get_spatialite_point_blob_indexes(blobs):
+    """
+    returns (lens, point_indexes, blob_arr):
+    lens: int64 array of the blob lengths (0 for None)
+    point_indexes: indexes of blobs that are spatialite points - None/other blobs are filtered out by length first
+    blob_arr: uint8 array of shape (len(point_indexes), 60) of those point blobs
+    """
+    lens = np.fromiter((0 if blob is None else len(blob) for blob in blobs), dtype=np.int64, count=len(blobs))
+    candidate_indexes = np.flatnonzero(lens == SPATIALITE_POINT_BLOB_LEN)
+    if len(candidate_indexes) == 0:
+        return lens, candidate_indexes, np.empty((0, SPATIALITE_POINT_BLOB_LEN), dtype=np.uint8)
+    blob_arr = np.frombuffer(
+        b"".join([blobs[i] for i in candidate_indexes.tolist()]),
+        dtype=np.uint8
+    ).reshape(-1, SPATIALITE_POINT_BLOB_LEN)
+    header_ok_mask = (blob_arr[:, :len(SPATIALITE_POINT_BLOB_HEADER)] == g_spatialite_point_blob_header_np).all(axis=1)
+    return lens, candidate_indexes[header_ok_mask], blob_arr[header_ok_mask]
+
+
+def spatialite_point_blob_arr_to_wkb_arr(blob_arr, wkb_point_header):
+    # blob_arr: uint8 array of shape (n, 60) - returns uint8 array of shape (n, len(wkb_point_header) + 16)
+    header_len = len(wkb_point_header)
+    wkb_arr = np.empty((blob_arr.shape[0], header_len + SPATIALITE_POINT_XY_LEN), dtype=np.uint8)
+    wkb_arr[:, :header_len] = np.frombuffer(wkb_point_header, dtype=np.uint8)
+    wkb_arr[:, header_len:] = blob_arr[:, SPATIALITE_POINT_XY_OFFSET:SPATIALITE_POINT_XY_OFFSET + SPATIALITE_POINT_XY_LEN]
+    return wkb_arr
+
+
+def conv_spatialite_point_blobs(blobs, wkb_point_header, to_hex):
+    lens, point_indexes, blob_arr = get_spatialite_point_blob_indexes(blobs)
+    ret = list(blobs)
+    for i in np.flatnonzero(lens == 0).tolist():
+        ret[i] = None  # nullif(..., '')
+    other_indexes = np.setdiff1d(np.flatnonzero(lens), point_indexes, assume_unique=True).tolist()
+    if to_hex:
+        for i in other_indexes:
+            ret[i] = binascii.hexlify(ret[i]).upper()
+    if len(point_indexes):
+        wkb_bytes = spatialite_point_blob_arr_to_wkb_arr(blob_arr, wkb_point_header).tobytes()
+        wkb_len = len(wkb_point_header) + SPATIALITE_POINT_XY_LEN
+        if to_hex:
+            wkb_bytes = binascii.hexlify(wkb_bytes).upper()
+            wkb_len *= 2
+        for i, offset in zip(point_indexes.tolist(), range(0, len(wkb_bytes), wkb_len)):
+            ret[i] = wkb_bytes[offset:offset + wkb_len]
+    return ret
+
+
+def conv_spatialite_point_blobs_to_wkb(blobs, wkb_point_header=PG_EWKB_POINT_HEADER):
+    """
+    blobs: list of bytes/None (one column of a batch of rows)
+    returns: list of the wkb bytes for point blobs, the original bytes for other blobs and None for NULL/empty blobs
+    """
+    return conv_spatialite_point_blobs(blobs, wkb_point_header, to_hex=False)
+
+
+def conv_spatialite_point_blobs_to_hex(blobs, wkb_point_header=PG_EWKB_POINT_HEADER):
+    """
+    same as conv_spatialite_point_blobs_to_wkb() but returns upper-case hex bytes - the same text
+    as "nullif(hex(geom),'')" in the sqlite3 csv dump after find_and_conv_spatialite_blob_to_wkb()
+    """
+    return conv_spatialite_point_blobs(blobs, wkb_point_header, to_hex=True)
+
+
+def conv_geom_arrow_array_to_wkb_lat_lon(geom_arr, geom_is_hex, geom_is_wkb):
+    """
+    geom_arr: arrow (chunked) binary array of the geom col - spatialite point blobs or (if geom_is_wkb)
+    PG_EWKB_POINT_HEADER wkb points - as upper-case hex text if geom_is_hex (like the "nullif(hex(geom),'')" csv dump)
+    returns (wkb_arr, lat_arr, lon_arr) arrow arrays: binary wkb points and float64 Y/X - NULL for NULL or non-point blobs
+
+    the point blobs are decoded once into one fixed-width (n, PG_EWKB_POINT_LEN) buffer and lat/lon are strided
+    numpy views over it - no per-row python calls
+    """
+    if isinstance(geom_arr, pa.ChunkedArray):
+        geom_arr = geom_arr.combine_chunks()
+    n = len(geom_arr)
+    blob_len = PG_EWKB_POINT_LEN if geom_is_wkb else SPATIALITE_POINT_BLOB_LEN
+    blob_header = PG_EWKB_POINT_HEADER if geom_is_wkb else SPATIALITE_POINT_BLOB_HEADER
+    in_len = blob_len * 2 if geom_is_hex else blob_len
+
+    # all candidate blobs have the same len so after filter() they are contiguous in the values buffer
+    candidate_mask = pc.fill_null(pc.equal(pc.binary_length(geom_arr), in_len), False)
+    candidate_indexes = np.flatnonzero(candidate_mask.to_numpy(zero_copy_only=False))
+    candidates = pc.filter(geom_arr, candidate_mask)
+    data = np.empty(0, dtype=np.uint8)
+    if len(candidates):
+        value_offsets = np.frombuffer(candidates.buffers()[1], dtype=np.int64 if pa.types.is_large_binary(candidates.type) else np.int32)
+        start = value_offsets[candidates.offset]
+        data = np.frombuffer(candidates.buffers()[2], dtype=np.uint8)[start:start + len(candidates) * in_len]
+        if geom_is_hex:
+            data = np.frombuffer(binascii.unhexlify(data), dtype=np.uint8)
+    blob_arr = data.reshape(-1, blob_len)
+    header_ok_mask = (blob_arr[:, :len(blob_header)] == np.frombuffer(blob_header, dtype=np.uint8)).all(axis=1)
+    point_indexes = candidate_indexes[header_ok_mask]
+    blob_arr = blob_arr[header_ok_mask]
+
+    valid_mask = np.zeros(n, dtype=bool)
+    valid_mask[point_indexes] = True
+    wkb_arr = np.zeros((n, PG_EWKB_POINT_LEN), dtype=np.uint8)
+    if geom_is_wkb:
+        wkb_arr[point_indexes] = blob_arr
+    else:
+        wkb_arr[point_indexes] = spatialite_point_blob_arr_to_wkb_arr(blob_arr, PG_EWKB_POINT_HEADER)
+    wkb_buf = wkb_arr.tobytes()
+
+    # X then Y little-endian doubles at the same offset of every fixed-width wkb
+    xy_offset = len(PG_EWKB_POINT_HEADER)
+    lon = np.ndarray((n,), dtype="<f8", buffer=wkb_buf, offset=xy_offset, strides=(PG_EWKB_POINT_LEN,))
+    lat = np.ndarray((n,), dtype="<f8", buffer=wkb_buf, offset=xy_offset + 8, strides=(PG_EWKB_POINT_LEN,))
+    null_mask = ~valid_mask
+    validity_buf = pa.py_buffer(np.packbits(valid_mask, bitorder="little").tobytes())
+    wkb_pa_arr = pa.Array.from_buffers(pa.binary(PG_EWKB_POINT_LEN), n, [validity_buf, pa.py_buffer(wkb_buf)])
+    return (
+        wkb_pa_arr.cast(pa.binary()),
+        pa.array(lat, type=pa.float64(), mask=null_mask),
+        pa.array(lon, type=pa.float64(), mask=null_mask),
+    )
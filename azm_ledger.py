@@ -0,0 +1,215 @@
+'''
+module for the --ledger_file: a persistent local sqlite3 file of the azm
+files already processed by folder runs (and the folder daemon) - so the next
+runs can skip the unchanged ones without unzipping/checking them again:
+
+- files merged successfully (or already merged in the target db) are
+  skipped while their size and mtime are the same - or their content hash
+  if only the mtime changed (like a copy that kept the content). The files
+  are only hashed in that case (filter_azm_files()) - record() reuses that
+  hash for the attempt, so a file gets its content hash at the first attempt
+  after an mtime-only change, not by a second full read of every file.
+- failed files are retried on a backoff schedule: LEDGER_RETRY_BASE_SECONDS
+  after the first failure, doubled after each further failure up to
+  LEDGER_RETRY_MAX_SECONDS - or right away if the file changed (re-upload).
+
+Entries are keyed by (target, operation, path) and record the size, mtime,
+content hash, outcome, log_hash, duration and error of the last attempt.
+A successful attempt removes the entries of the other operations of the same
+target and path (like the 'merge' entry of an azm unmerged since, so the
+next merge of it isn't skipped) - and --unmerge_log_hashes removes the
+entries of its log_hashes (invalidate_log_hashes()).
+
+Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
+
+'''
+
+import hashlib
+import os
+import sqlite3
+import time
+
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_ALREADY_MERGED = "already_merged"
+OUTCOME_FAILED = "failed"
+SKIP_OUTCOMES = [OUTCOME_SUCCESS, OUTCOME_ALREADY_MERGED]
+# check_if_already_merged() exception of an azm already imported into the target db
+ALREADY_MERGED_EXCEPTION_STR = "has already been imported"
+LEDGER_RETRY_BASE_SECONDS = 60
+LEDGER_RETRY_MAX_SECONDS = 24 * 3600
+HASH_READ_SIZE = 1024 * 1024
+ERROR_MAX_LEN = 4000
+
+# global vars
+g_conn = None
+g_content_hashes = {}  # path -> ((size, mtime_ns), content_hash) taken by filter_azm_files() - for record() of the same attempt
+
+
+def open_ledger(ledger_fp):
+    global g_conn
+
+    close_ledger()
+    print("azm_ledger open_ledger:", ledger_fp)
+    # timeout: other azm_db_merge processes might be writing the same ledger file
+    conn = sqlite3.connect(ledger_fp, timeout=60)
+    with conn:
+        conn.execute(
+            "create table if not exists azm_files (target text, operation text, path text, size integer, mtime_ns integer, content_hash text, outcome text, log_hash integer, n_failures integer, next_retry_time real, start_time real, duration_seconds real, error text, primary key (target, operation, path))"
+        )
+    g_conn = conn
+    return True
+
+
+def close_ledger():
+    global g_conn
+    if g_conn is not None:
+        try:
+            g_conn.close()
+        except Exception as e:
+            print("WARNING: azm_ledger close_ledger failed: "+str(e))
+    g_conn = None
+    g_content_hashes.clear()
+    return True
+
+
+def is_open():
+    return g_conn is not None
+
+
+def get_file_stat(fp):
+    st = os.stat(fp)
+    return st.st_size, st.st_mtime_ns
+
+
+def get_content_hash(fp):
+    sha1 = hashlib.sha1()
+    with open(fp, "rb") as f:
+        while True:
+            buf = f.read(HASH_READ_SIZE)
+            if not buf:
+                break
+            sha1.update(buf)
+    return sha1.hexdigest()
+
+
+def get_entry(key, path):
+    # key: (target, operation) - returns dict of the last attempt of path or None if not in ledger
+    cursor = g_conn.execute(
+        "select * from azm_files where target = ? and operation = ? and path = ?",
+        tuple(key) + (path,)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip([desc[0] for desc in cursor.description], row))
+
+
+def get_outcome(exstr):
+    # outcome of an attempt from its exception str (None if it succeeded)
+    if exstr is None:
+        return OUTCOME_SUCCESS
+    if ALREADY_MERGED_EXCEPTION_STR in exstr:
+        return OUTCOME_ALREADY_MERGED
+    return OUTCOME_FAILED
+
+
+def filter_azm_files(key, azm_files, now=None):
+    """
+    returns (azm_files to process, failed azm_files deferred to their next retry time) - unchanged files with a
+    SKIP_OUTCOMES entry are in neither.
+    """
+    if now is None:
+        now = time.time()
+    process = []
+    deferred = []
+    n_skipped = 0
+    for fp in azm_files:
+        path = os.path.abspath(fp)
+        entry = get_entry(key, path)
+        try:
+            stat = get_file_stat(path)
+        except OSError:
+            # gone since listed - let the processing fail/report it as before
+            process.append(fp)
+            continue
+        if entry is None:
+            process.append(fp)
+            continue
+        unchanged = (entry['size'], entry['mtime_ns']) == stat
+        if not unchanged and entry['size'] == stat[0] and entry['outcome'] in SKIP_OUTCOMES:
+            # only the mtime changed - check the content
+            content_hash = get_content_hash(path)
+            g_content_hashes[path] = (stat, content_hash)
+            unchanged = entry['content_hash'] == content_hash
+            if unchanged:
+                with g_conn:
+                    g_conn.execute(
+                        "update azm_files set mtime_ns = ? where target = ? and operation = ? and path = ?",
+                        (stat[1],) + tuple(key) + (path,)
+                    )
+        if not unchanged:
+            process.append(fp)
+        elif entry['outcome'] in SKIP_OUTCOMES:
+            n_skipped += 1
+        elif entry['next_retry_time'] is not None and now < entry['next_retry_time']:
+            deferred.append(fp)
+        else:
+            process.append(fp)
+    print("azm_ledger filter_azm_files: {} azm files: process {} skip {} unchanged done - defer {} failed until their retry time".format(
+        len(azm_files), len(process), n_skipped, len(deferred)))
+    return process, deferred
+
+
+def record(key, fp, start_time, duration_seconds, exstr=None, log_hash=None):
+    # record the outcome of an attempt to process fp (exstr: None if it succeeded) - returns the outcome
+    path = os.path.abspath(fp)
+    outcome = get_outcome(exstr)
+    if outcome == OUTCOME_SUCCESS:
+        # also if fp is gone below (moved): the entries of the other operations don't hold anymore
+        with g_conn:
+            g_conn.execute(
+                "delete from azm_files where target = ? and operation != ? and path = ?",
+                tuple(key) + (path,)
+            )
+    try:
+        size, mtime_ns = get_file_stat(path)
+    except OSError:
+        # like moved by --move_imported_azm_files_to_folder - nothing to skip at this path anymore
+        print("azm_ledger record: {} is gone - not recorded".format(path))
+        return outcome
+    # the hash of filter_azm_files() for this attempt if the file is still the same - no full read of the file here
+    content_hash = None
+    stat_and_hash = g_content_hashes.pop(path, None)
+    if stat_and_hash is not None and stat_and_hash[0] == (size, mtime_ns):
+        content_hash = stat_and_hash[1]
+    entry = get_entry(key, path)
+    n_failures = 0
+    next_retry_time = None
+    if outcome == OUTCOME_FAILED:
+        # failures of the same file (size and mtime) count towards the backoff - a changed file starts over
+        n_failures = 1
+        if entry is not None and entry['outcome'] == OUTCOME_FAILED and (entry['size'], entry['mtime_ns']) == (size, mtime_ns):
+            n_failures = entry['n_failures'] + 1
+        next_retry_time = start_time + duration_seconds + min(LEDGER_RETRY_BASE_SECONDS * 2 ** (n_failures - 1), LEDGER_RETRY_MAX_SECONDS)
+    if exstr is not None:
+        exstr = exstr[:ERROR_MAX_LEN]
+    with g_conn:
+        g_conn.execute(
+            "insert or replace into azm_files (target, operation, path, size, mtime_ns, content_hash, outcome, log_hash, n_failures, next_retry_time, start_time, duration_seconds, error) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            tuple(key) + (path, size, mtime_ns, content_hash, outcome, log_hash, n_failures, next_retry_time, start_time, duration_seconds, exstr)
+        )
+    return outcome
+
+
+def invalidate_log_hashes(target, log_hashes):
+    # remove the entries of log_hashes (of all operations) of target - like after --unmerge_log_hashes - returns the number of removed entries
+    n = 0
+    with g_conn:
+        for log_hash in log_hashes:
+            n += g_conn.execute(
+                "delete from azm_files where target = ? and log_hash = ?",
+                (target, int(log_hash))
+            ).rowcount
+    print("azm_ledger invalidate_log_hashes: removed {} entries of {} log_hashes".format(n, len(log_hashes)))
+    return n
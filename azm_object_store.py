@@ -0,0 +1,192 @@
+'''
+module for the --parquet_object_store: in-process concurrent upload of the
+--dump_parquet files (and their manifests) to a pyarrow.fs filesystem
+instead of the sequential 'mc cp' of the whole dump dir at commit:
+
+- a local (or mounted) dir: /some/dir or file:///some/dir
+- S3-compatible storage (AWS S3, MinIO, ...): s3://bucket[/prefix] with the
+  pyarrow S3 options in the query string, for example:
+  s3://azm-mydomain?endpoint_override=localhost:9000&scheme=http
+  (credentials from the usual AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY env vars)
+
+Uploads run in a thread pool as soon as each file is written (while the
+next tables are still being dumped), pyarrow uploads the S3 objects in
+concurrent multipart parts and each object is retried on failure.
+
+Keys are '/' separated paths relative to the store root (same as the
+manifest file paths).
+
+Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
+
+'''
+
+import concurrent.futures
+import os
+import threading
+import time
+import uuid
+
+import pyarrow.fs as pafs
+
+
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_SLEEP_SECONDS = 2  # doubled after each failed attempt
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# global vars
+g_fs = None
+g_root = None
+g_executor = None
+g_uploads = {}  # key -> future of the uploads since the last finish_uploads()/abort_uploads()
+g_uploads_lock = threading.Lock()
+
+
+def open_store(uri, n_threads):
+    global g_fs, g_root, g_executor
+
+    close_store()
+    print("azm_object_store open_store:", uri)
+    if "://" not in uri:
+        uri = "file://" + os.path.abspath(uri)
+    g_fs, g_root = pafs.FileSystem.from_uri(uri)
+    g_root = g_root.rstrip("/")
+    if g_fs.type_name == "local":
+        g_fs.create_dir(g_root, recursive=True)
+    g_executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix="object_store_upload")
+    return True
+
+
+def close_store():
+    global g_fs, g_root, g_executor
+    if g_executor is not None:
+        abort_uploads()
+        g_executor.shutdown(wait=True)
+    g_fs = None
+    g_root = None
+    g_executor = None
+    return True
+
+
+def is_open():
+    return g_fs is not None
+
+
+def get_path(key):
+    return g_root + "/" + key
+
+
+def put_file(local_fp, key):
+    """
+    copy local_fp to key - the object is never visible partially: s3 objects only appear when their (multipart) upload completes,
+    local files are written to a tmp file then renamed
+    """
+    path = get_path(key)
+    dst_path = path
+    if g_fs.type_name == "local":
+        g_fs.create_dir(path.rsplit("/", 1)[0], recursive=True)
+        dst_path = "{}/.{}.{}.tmp".format(path.rsplit("/", 1)[0], path.rsplit("/", 1)[1], uuid.uuid4())
+    try:
+        with open(local_fp, "rb") as src, g_fs.open_output_stream(dst_path) as dst:
+            while True:
+                buf = src.read(COPY_BUFFER_SIZE)
+                if not buf:
+                    break
+                dst.write(buf)
+        if dst_path != path:
+            g_fs.move(dst_path, path)
+    finally:
+        if dst_path != path and g_fs.get_file_info(dst_path).type != pafs.FileType.NotFound:
+            g_fs.delete_file(dst_path)
+    return True
+
+
+def put_file_with_retries(local_fp, key):
+    sleep_seconds = UPLOAD_RETRY_SLEEP_SECONDS
+    for attempt in range(1, UPLOAD_RETRIES + 1):
+        try:
+            start_time = time.time()
+            put_file(local_fp, key)
+            print("azm_object_store uploaded {} ({} bytes) in {:.2f} seconds".format(key, os.path.getsize(local_fp), time.time() - start_time))
+            return key
+        except Exception as e:
+            if attempt == UPLOAD_RETRIES:
+                raise
+            print("WARNING: azm_object_store upload {} attempt {}/{} failed - retry in {} seconds - exception: {}".format(key, attempt, UPLOAD_RETRIES, sleep_seconds, e))
+            time.sleep(sleep_seconds)
+            sleep_seconds *= 2
+
+
+def submit_upload(local_fp, key):
+    # start the upload of local_fp to key in the upload thread pool - local_fp must not change until finish_uploads()/abort_uploads()
+    future = g_executor.submit(put_file_with_retries, local_fp, key)
+    with g_uploads_lock:
+        g_uploads[key] = future
+    return future
+
+
+def finish_uploads():
+    # wait for all submitted uploads - raises the first failed upload (after all are done) - returns the list of uploaded keys
+    with g_uploads_lock:
+        uploads = dict(g_uploads)
+        g_uploads.clear()
+    concurrent.futures.wait(uploads.values())
+    for key, future in uploads.items():
+        exception = future.exception()
+        if exception is not None:
+            raise Exception("azm_object_store upload of {} failed - exception: {}".format(key, exception))
+    return sorted(uploads.keys())
+
+
+def abort_uploads():
+    # cancel (or wait for) the submitted uploads then delete the already uploaded objects - for an azm failed before its commit
+    with g_uploads_lock:
+        uploads = dict(g_uploads)
+        g_uploads.clear()
+    if not uploads:
+        return []
+    for future in uploads.values():
+        future.cancel()
+    concurrent.futures.wait(uploads.values())
+    uploaded = [key for key, future in uploads.items() if not future.cancelled() and future.exception() is None]
+    print("azm_object_store abort_uploads: delete {} already uploaded objects".format(len(uploaded)))
+    delete_objects(uploaded)
+    return uploaded
+
+
+def put_bytes(key, data):
+    # small objects like the manifests - one put for s3, tmp file then rename for local
+    path = get_path(key)
+    if g_fs.type_name == "local":
+        g_fs.create_dir(path.rsplit("/", 1)[0], recursive=True)
+        tmp_path = "{}/.{}.{}.tmp".format(path.rsplit("/", 1)[0], path.rsplit("/", 1)[1], uuid.uuid4())
+        with g_fs.open_output_stream(tmp_path) as f:
+            f.write(data)
+        g_fs.move(tmp_path, path)
+    else:
+        with g_fs.open_output_stream(path) as f:
+            f.write(data)
+    return True
+
+
+def get_bytes(key):
+    # None if key doesn't exist
+    try:
+        with g_fs.open_input_stream(get_path(key)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def delete_objects(keys):
+    # delete keys in the upload thread pool - already missing keys are ok (like a retry of a failed unmerge)
+    def delete_object(key):
+        try:
+            g_fs.delete_file(get_path(key))
+        except FileNotFoundError:
+            pass
+        return key
+
+    futures = [g_executor.submit(delete_object, key) for key in keys]
+    for future in futures:
+        future.result()
+    return len(futures)
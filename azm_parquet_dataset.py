@@ -0,0 +1,306 @@
+'''
+module for the --parquet_hive_layout of --dump_parquet: the parquet files of
+each log are written to a hive partitioned tree:
+
+table=<table_name>/month=<YYYY-MM>/<table_name>_<log_hash>.parquet
+
+instead of one flat folder - so Spark/pandas readers can prune by table and
+month from the paths and skip row groups by time/log_hash from the column
+statistics and page indexes in the files (rows are sorted by time).
+
+Each partition folder also gets the '_common_metadata' (schema) and
+'_metadata' (schema + row group statistics of all files in the folder)
+summary files - the footers of added files are appended to '_metadata'
+(no re-read of the footers of all files of the month at each import), it is
+rebuilt from all file footers when files are replaced or removed. Summary
+updates of a partition are serialized by an flock on its lock file (next to
+the partition folder) as concurrent imports (--workers, several processes)
+can add files to the same partition.
+
+Per log manifests (both layouts): _manifests/<YYYY-MM>/<log_hash>.json (at
+the bucket/dataset root) list the parquet files of the log (paths relative
+to the root) with their row counts, sizes and min/max time - written last
+(atomically) at commit so unmerge can delete exactly the listed files and
+readers can plan scans of a month without listing the bucket.
+
+Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
+
+'''
+
+import contextlib
+import datetime
+import glob
+import json
+import os
+import shutil
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:
+    # windows: no flock - summary updates of concurrent imports into the same partition are not serialized there
+    fcntl = None
+
+
+STAGING_DIR_NAME = "parquet_dataset"
+COMMON_METADATA_FILE_NAME = "_common_metadata"
+METADATA_FILE_NAME = "_metadata"
+# timestamp options of the hive layout data files (and the summary files - same schema needed): INT64 microsecond
+# timestamps instead of the INT96 of flavor='spark' as parquet writers don't write statistics for INT96 columns
+# so readers couldn't skip row groups by time - the azqdata.db times have millisecond precision anyway
+TIMESTAMP_WRITER_KWARGS = {
+    'use_deprecated_int96_timestamps': False,
+    'coerce_timestamps': 'us',
+    'allow_truncated_timestamps': True,
+}
+
+
+MANIFESTS_DIR_NAME = "_manifests"
+MANIFEST_VERSION = 1
+
+
+def get_month_str(log_hash_ym_str):
+    # 'YYYY_MM' of args['log_hash_ym_str'] to the 'YYYY-MM' of the month partitions (same as the flat layout bucket folders)
+    return log_hash_ym_str.replace("_", "-")
+
+
+def get_partition_dir(root_dir, table_name, month_str):
+    return os.path.join(root_dir, "table={}".format(table_name), "month={}".format(month_str))
+
+
+def get_log_file_name(table_name, log_hash):
+    return "{}_{}.parquet".format(table_name, log_hash)
+
+
+def list_partition_dirs(root_dir):
+    return sorted(glob.glob(os.path.join(root_dir, "table=*", "month=*")))
+
+
+def list_partition_files(partition_dir):
+    # data files only - readers ignore the '_' (summary) and '.' (tmp) prefixed files
+    return sorted(
+        fp for fp in glob.glob(os.path.join(partition_dir, "*.parquet"))
+        if not os.path.basename(fp).startswith(("_", "."))
+    )
+
+
+def write_metadata_file(schema, fp, metadata_collector=None):
+    # write to a tmp file then rename so readers never see a partial summary file
+    tmp_fp = os.path.join(os.path.dirname(fp), ".{}.{}.tmp".format(os.path.basename(fp), uuid.uuid4()))
+    try:
+        pq.write_metadata(schema, tmp_fp, metadata_collector=metadata_collector, flavor='spark', **TIMESTAMP_WRITER_KWARGS)
+        os.replace(tmp_fp, fp)
+    finally:
+        if os.path.isfile(tmp_fp):
+            os.remove(tmp_fp)
+
+
+def get_partition_lock_path(partition_dir):
+    # in the table dir, not in the partition dir so an emptied partition dir stays empty - '.' prefixed: ignored by readers
+    return os.path.join(os.path.dirname(partition_dir), ".{}.summary.lock".format(os.path.basename(partition_dir)))
+
+
+@contextlib.contextmanager
+def partition_summary_lock(partition_dir):
+    # exclusive lock of the summary files of partition_dir - blocks until other processes/threads are done with them
+    if fcntl is None:
+        yield
+        return
+    with open(get_partition_lock_path(partition_dir), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def write_partition_summary(partition_dir, added_fps=None):
+    """
+    update the '_common_metadata' and '_metadata' summary files of partition_dir - or remove them if it has no data
+    files anymore. with added_fps (the files just added to partition_dir): only their footers are appended to the
+    '_metadata' if possible - else it is rebuilt from the footers of all data files.
+
+    files from different app versions can have different columns: then '_common_metadata' gets the unified schema
+    and '_metadata' (which needs the same schema in all row groups) is not written (with a WARNING).
+    """
+    with partition_summary_lock(partition_dir):
+        if added_fps and append_partition_summary(partition_dir, added_fps):
+            return True
+        return rebuild_partition_summary(partition_dir)
+
+
+def append_partition_summary(partition_dir, added_fps):
+    # append the footers of added_fps to the '_metadata' of partition_dir - returns False if it must be rebuilt instead:
+    # no '_metadata' yet (or different schemas), a different schema in added_fps or added_fps replaced files already in it
+    metadata_fp = os.path.join(partition_dir, METADATA_FILE_NAME)
+    if not os.path.isfile(metadata_fp):
+        return False
+    summary = pq.read_metadata(metadata_fp)
+    schema = summary.schema.to_arrow_schema()
+    summary_file_names = set(
+        summary.row_group(i).column(0).file_path for i in range(summary.num_row_groups) if summary.num_columns
+    )
+    metadatas = [summary]
+    for fp in added_fps:
+        if os.path.basename(fp) in summary_file_names:
+            return False
+        metadata = pq.read_metadata(fp)
+        if not metadata.schema.to_arrow_schema().equals(schema):
+            return False
+        metadata.set_file_path(os.path.basename(fp))
+        metadatas.append(metadata)
+    write_metadata_file(schema, metadata_fp, metadata_collector=metadatas)
+    return True
+
+
+def rebuild_partition_summary(partition_dir):
+    # rebuild the summary files of partition_dir from the footers of all its data files - call with its partition_summary_lock()
+    common_metadata_fp = os.path.join(partition_dir, COMMON_METADATA_FILE_NAME)
+    metadata_fp = os.path.join(partition_dir, METADATA_FILE_NAME)
+    fps = list_partition_files(partition_dir)
+    if not fps:
+        for fp in [common_metadata_fp, metadata_fp]:
+            if os.path.isfile(fp):
+                os.remove(fp)
+        return False
+
+    metadatas = []
+    schemas = []
+    for fp in fps:
+        metadata = pq.read_metadata(fp)
+        # row group file paths in '_metadata' are relative to the partition dir
+        metadata.set_file_path(os.path.basename(fp))
+        metadatas.append(metadata)
+        schema = metadata.schema.to_arrow_schema()
+        if not schemas or not schema.equals(schemas[0]):
+            schemas.append(schema)
+
+    if len(schemas) == 1:
+        write_metadata_file(schemas[0], common_metadata_fp)
+        write_metadata_file(schemas[0], metadata_fp, metadata_collector=metadatas)
+    else:
+        print("WARNING: azm_parquet_dataset: {} files of different schemas in {} - not writing {}".format(len(fps), partition_dir, METADATA_FILE_NAME))
+        write_metadata_file(pa.unify_schemas(schemas), common_metadata_fp)
+        if os.path.isfile(metadata_fp):
+            os.remove(metadata_fp)
+    return True
+
+
+def move_into_dataset(staging_dir, dataset_dir):
+    """
+    move the data files of the hive tree at staging_dir into the same partitions of dataset_dir (replacing the
+    same named files of a previous import of the same log) and rebuild the summaries of those partitions.
+    returns the list of (dataset_dir relative) file paths moved.
+    """
+    moved = []
+    for staging_partition_dir in list_partition_dirs(staging_dir):
+        rel_partition_dir = os.path.relpath(staging_partition_dir, staging_dir)
+        partition_dir = os.path.join(dataset_dir, rel_partition_dir)
+        fps = list_partition_files(staging_partition_dir)
+        if not fps:
+            # empty table
+            continue
+        os.makedirs(partition_dir, exist_ok=True)
+        added_fps = []
+        for fp in fps:
+            # copy as a '.' tmp file first then rename so readers never see a partial file - the dataset dir can be on another fs
+            dst_fp = os.path.join(partition_dir, os.path.basename(fp))
+            tmp_fp = os.path.join(partition_dir, ".{}.{}.tmp".format(os.path.basename(fp), uuid.uuid4()))
+            shutil.copyfile(fp, tmp_fp)
+            os.replace(tmp_fp, dst_fp)
+            os.remove(fp)
+            moved.append(os.path.join(rel_partition_dir, os.path.basename(fp)))
+            added_fps.append(dst_fp)
+        write_partition_summary(partition_dir, added_fps)
+    return moved
+
+
+def remove_log_files(dataset_dir, month_str, log_hash):
+    # remove the files of log_hash from the month partitions of all tables in dataset_dir and rebuild their summaries - returns the list of removed file paths
+    removed = []
+    for partition_dir in glob.glob(os.path.join(dataset_dir, "table=*", "month={}".format(month_str))):
+        table_name = os.path.basename(os.path.dirname(partition_dir))[len("table="):]
+        fp = os.path.join(partition_dir, get_log_file_name(table_name, log_hash))
+        if os.path.isfile(fp):
+            os.remove(fp)
+            removed.append(fp)
+            write_partition_summary(partition_dir)
+    return removed
+
+
+def get_manifest_rel_path(month_str, log_hash):
+    # '/' separated - same key in the object store and (with os.path.join(*split('/'))) in a dataset dir
+    return "/".join([MANIFESTS_DIR_NAME, month_str, "{}.json".format(log_hash)])
+
+
+def gen_manifest(log_hash, month_str, layout, files):
+    """
+    files: list of dicts of each parquet file of the log: 'path' (relative to the bucket/dataset root), 'table',
+    'num_rows', 'size_bytes', 'min_time', 'max_time' (str or None if the table has no time col)
+    """
+    files = sorted(files, key=lambda f: f['path'])
+    times = [f[k] for f in files for k in ['min_time', 'max_time'] if f[k] is not None]
+    return {
+        'version': MANIFEST_VERSION,
+        'log_hash': log_hash,
+        'month': month_str,
+        'layout': layout,
+        'created': datetime.datetime.now().isoformat(),
+        'num_rows': sum(f['num_rows'] for f in files),
+        'size_bytes': sum(f['size_bytes'] for f in files),
+        'min_time': min(times) if times else None,
+        'max_time': max(times) if times else None,
+        'files': files,
+    }
+
+
+def manifest_to_bytes(manifest):
+    return json.dumps(manifest, indent=1).encode()
+
+
+def manifest_from_bytes(data, source):
+    manifest = json.loads(data)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise Exception("azm_parquet_dataset: unsupported manifest version {} in {}".format(manifest.get('version'), source))
+    return manifest
+
+
+def write_manifest(fp, manifest):
+    # write to a tmp file then rename so readers (and unmerge) never see a partial manifest
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    tmp_fp = os.path.join(os.path.dirname(fp), ".{}.{}.tmp".format(os.path.basename(fp), uuid.uuid4()))
+    try:
+        with open(tmp_fp, "wb") as f:
+            f.write(manifest_to_bytes(manifest))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fp, fp)
+    finally:
+        if os.path.isfile(tmp_fp):
+            os.remove(tmp_fp)
+
+
+def read_manifest(fp):
+    with open(fp, "rb") as f:
+        return manifest_from_bytes(f.read(), fp)
+
+
+def remove_manifest_files(dataset_dir, manifest_fp):
+    # remove the files listed in the manifest at manifest_fp from dataset_dir, rebuild the summaries of their partitions then remove the manifest - returns the list of removed file paths
+    manifest = read_manifest(manifest_fp)
+    removed = []
+    partition_dirs = set()
+    for f in manifest['files']:
+        fp = os.path.join(dataset_dir, *f['path'].split("/"))
+        if os.path.isfile(fp):
+            os.remove(fp)
+            removed.append(fp)
+        partition_dirs.add(os.path.dirname(fp))
+    for partition_dir in sorted(partition_dirs):
+        if os.path.isdir(partition_dir):
+            write_partition_summary(partition_dir)
+    os.remove(manifest_fp)
+    return removed
@@ -0,0 +1,94 @@
+'''
+module for the --schema_cache_file: a persistent local sqlite3 file of the
+target db tables (and their columns) already known to exist for the
+.schema of an azqdata.db - so create() of the next azms with the same
+schema (from the same app version) can skip the table exists check, the
+CREATE, get_remote_columns() and the ALTER diff for each table.
+
+Entries are keyed by (schema_shasum, schema_args, target, pg_schema) +
+table_name - schema_args: the azm_db_merge args that change the created
+tables/columns (like --import_geom_column_in_location_table_only) - and
+only written after the import that created/checked the tables was
+committed successfully. An import that used cached tables and then failed on
+a missing column invalidates its key and raises STALE_EXCEPTION_STR so
+azm_db_merge retries it once without the cache.
+
+Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
+
+'''
+
+import json
+import sqlite3
+
+
+# exception str of a COPY/insert failed on a missing column of cached tables - azm_db_merge retries the azm once
+STALE_EXCEPTION_STR = "schema cache stale"
+KEY_COLUMNS = ["schema_shasum", "schema_args", "target", "pg_schema"]
+
+# global vars
+g_conn = None
+
+
+def open_cache(cache_fp):
+    global g_conn
+
+    close_cache()
+    print("azm_schema_cache open_cache:", cache_fp)
+    # timeout: other azm_db_merge processes (like --workers) might be writing the same cache file
+    conn = sqlite3.connect(cache_fp, timeout=60)
+    with conn:
+        column_names = [row[1] for row in conn.execute("pragma table_info(remote_tables)")]
+        if column_names and column_names[:len(KEY_COLUMNS)] != KEY_COLUMNS:
+            # cache file of an older version without schema_args in its key - it is only a cache: start over
+            print("azm_schema_cache open_cache: old cache format - drop its entries")
+            conn.execute("drop table remote_tables")
+        conn.execute(
+            "create table if not exists remote_tables (schema_shasum text, schema_args text, target text, pg_schema text, table_name text, remote_column_names text, primary key (schema_shasum, schema_args, target, pg_schema, table_name))"
+        )
+    g_conn = conn
+    return True
+
+
+def close_cache():
+    global g_conn
+    if g_conn is not None:
+        try:
+            g_conn.close()
+        except Exception as e:
+            print("WARNING: azm_schema_cache close_cache failed: "+str(e))
+    g_conn = None
+    return True
+
+
+def is_open():
+    return g_conn is not None
+
+
+def get_remote_column_names(key, table_name):
+    # key: (schema_shasum, schema_args, target, pg_schema) - returns list of remote col names of table_name or None if not in cache
+    row = g_conn.execute(
+        "select remote_column_names from remote_tables where schema_shasum = ? and schema_args = ? and target = ? and pg_schema = ? and table_name = ?",
+        tuple(key) + (table_name,)
+    ).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0])
+
+
+def put_remote_column_names(key, table_to_remote_column_names):
+    with g_conn:
+        g_conn.executemany(
+            "insert or replace into remote_tables (schema_shasum, schema_args, target, pg_schema, table_name, remote_column_names) values (?, ?, ?, ?, ?, ?)",
+            [tuple(key) + (table_name, json.dumps(remote_column_names)) for table_name, remote_column_names in table_to_remote_column_names.items()]
+        )
+    return True
+
+
+def invalidate(key):
+    print("azm_schema_cache invalidate:", key)
+    with g_conn:
+        g_conn.execute(
+            "delete from remote_tables where schema_shasum = ? and schema_args = ? and target = ? and pg_schema = ?",
+            tuple(key)
+        )
+    return True
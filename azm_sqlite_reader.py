@@ -0,0 +1,402 @@
+'''
+module to read the azqdata.db (extracted from azq .azm files) in-process
+with the python sqlite3 module - the db is opened once (read-only,
+immutable, mmap) and serves the schema, log metadata lookups and table
+dumps that were previously done by one sqlite3 executable process each.
+
+Output of the dump/query functions is byte-identical to the equivalent
+sqlite3 executable commands used by azm_db_merge (-csv/-list .out and
+.schema) so the target handlers don't need to know which reader was used.
+
+iter_select_record_batches() reads rows directly into typed arrow arrays for the
+--dump_parquet tables - without any csv text in between.
+
+With open_db_from_zip() (--in_memory_db) the azqdata.db is decompressed from
+the azm straight into memory instead of being extracted to the temp dir.
+
+Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
+
+'''
+
+import os
+import re
+import sqlite3
+import pathlib
+import threading
+import uuid
+import zipfile
+import numpy as np
+import pyarrow as pa
+
+
+MMAP_SIZE_BYTES = 4 * 1024 * 1024 * 1024
+FETCHMANY_N_ROWS = 10000
+
+# global vars
+g_conn = None  # conn of the thread that called open_db()
+g_db_fp = None
+g_db_uri = None
+# each thread (like the --table_jobs pool threads) reads with its own conn - one sqlite conn serializes its users
+g_thread_local = threading.local()
+g_thread_conns = []
+g_thread_conns_lock = threading.Lock()
+g_db_generation = 0  # incremented on each open_db() so threads re-connect to the new db
+
+# same as needCsvQuote[] in sqlite3 shell.c: control chars, space, double-quote, single-quote and non-ascii bytes
+g_csv_need_quote_re = re.compile(b'[\x00-\x20"\'\x7f-\xff]')
+
+
+def get_db_uri(db_fp):
+    # immutable=1: no locking/change detection needed - nothing else writes the extracted azqdata.db while we read it
+    return pathlib.Path(os.path.abspath(db_fp)).as_uri() + "?mode=ro&immutable=1"
+
+
+def connect(db_uri):
+    conn = sqlite3.connect(db_uri, uri=True, check_same_thread=False)
+    conn.text_factory = bytes
+    conn.execute("PRAGMA mmap_size = {}".format(MMAP_SIZE_BYTES))
+    with g_thread_conns_lock:
+        g_thread_conns.append(conn)
+    g_thread_local.conn = conn
+    g_thread_local.db_generation = g_db_generation
+    return conn
+
+
+def check_db(db_fp):
+    """
+    raise if db_fp is not a readable, intact sqlite db - with a private conn (not in g_thread_conns and not the
+    conn of this thread) so it can run in a background thread (like --prefetch_azm_files) while another db is open
+    """
+    conn = sqlite3.connect(get_db_uri(db_fp), uri=True, check_same_thread=False)
+    try:
+        conn.execute("select count(*) from sqlite_master").fetchone()
+        rows = conn.execute("PRAGMA quick_check").fetchall()
+    finally:
+        conn.close()
+    if [row[0] for row in rows] != ["ok"]:
+        raise Exception("azm_sqlite_reader check_db: {} failed quick_check: {}".format(db_fp, [row[0] for row in rows][:10]))
+    return True
+
+
+def open_db(db_fp):
+    global g_conn, g_db_fp, g_db_uri, g_db_generation
+
+    close_db()
+    print("azm_sqlite_reader open_db:", db_fp)
+    g_db_generation += 1
+    g_db_uri = get_db_uri(db_fp)
+    conn = connect(g_db_uri)
+    # make sure this really is a readable sqlite db now instead of failing later at the first table dump
+    conn.execute("select count(*) from sqlite_master").fetchone()
+    g_conn = conn
+    g_db_fp = db_fp
+    return True
+
+
+def open_db_from_zip(zip_fp, member_name):
+    """
+    decompress member_name (like 'azqdata.db') of zip_fp into memory and open it - nothing is written to disk.
+
+    Connection.deserialize() loads the db into a private in-memory db of a single conn, so it is then
+    copied with backup() into a named 'memdb' vfs db which the conns of all threads (get_conn()) can
+    open read-only - peak memory is about twice the uncompressed db size.
+    """
+    global g_conn, g_db_fp, g_db_uri, g_db_generation
+
+    close_db()
+    print("azm_sqlite_reader open_db_from_zip:", zip_fp, member_name)
+    g_db_generation += 1
+    with zipfile.ZipFile(zip_fp, "r") as zf:
+        db_bytes = zf.read(member_name)
+    deserialized_conn = sqlite3.connect(":memory:")
+    try:
+        deserialized_conn.deserialize(db_bytes)
+        del db_bytes
+        db_uri = "file:/azm_sqlite_reader_{}?vfs=memdb".format(uuid.uuid4())
+        memdb_conn = sqlite3.connect(db_uri, uri=True)
+        try:
+            deserialized_conn.backup(memdb_conn)
+            deserialized_conn.close()
+            # the memdb db is freed when its last conn is closed - so open the read-only g_conn before closing memdb_conn
+            g_db_uri = db_uri + "&mode=ro"
+            conn = connect(g_db_uri)
+        finally:
+            memdb_conn.close()
+    finally:
+        deserialized_conn.close()
+    conn.execute("select count(*) from sqlite_master").fetchone()
+    g_conn = conn
+    g_db_fp = None
+    return True
+
+
+def get_conn():
+    # conn of the current thread - connect on first use in this thread (for this db)
+    if getattr(g_thread_local, "db_generation", None) != g_db_generation:
+        return connect(g_db_uri)
+    return g_thread_local.conn
+
+
+def close_db():
+    global g_conn, g_db_fp, g_db_uri
+    with g_thread_conns_lock:
+        for conn in g_thread_conns:
+            try:
+                conn.close()
+            except Exception as e:
+                print("WARNING: azm_sqlite_reader close_db failed: "+str(e))
+        del g_thread_conns[:]
+    g_conn = None
+    g_db_fp = None
+    g_db_uri = None
+    return True
+
+
+def is_open():
+    return g_conn is not None
+
+
+def value_to_text(val):
+    # same text as sqlite3_column_text() which the sqlite3 executable prints
+    if val is None:
+        return ""
+    if isinstance(val, bytes):
+        return val.decode(errors="replace")
+    if isinstance(val, float):
+        # sqlite uses "%!.15g" - like %.15g but always with a decimal point: 1.0, 1.0e+20
+        if val != val:
+            return ""
+        if val in (float("inf"), float("-inf")):
+            return "Inf" if val > 0 else "-Inf"
+        ret = "%.15g" % val
+        if "." not in ret:
+            if "e" in ret:
+                ret = ret.replace("e", ".0e", 1)
+            else:
+                ret += ".0"
+        return ret
+    return str(val)
+
+
+def get_sql_result(sqlstr):
+    # like sqlite3 executable default -list mode output: '|' col separator, '\n' row separator, then strip()
+    rows = get_conn().execute(sqlstr).fetchall()
+    outstr = "\n".join(["|".join([value_to_text(val) for val in row]) for row in rows])
+    return outstr.strip()
+
+
+def get_schema():
+    # like sqlite3 executable '.schema' command output
+    rows = get_conn().execute(
+        "SELECT sql FROM sqlite_master WHERE type!='meta' AND sql NOTNULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+    ).fetchall()
+    schema = ""
+    for row in rows:
+        sql = row[0].decode()
+        # shell.c printSchemaLine(): quoted table names get 'IF NOT EXISTS'
+        if re.match("CREATE TABLE ['\"]", sql):
+            sql = "CREATE TABLE IF NOT EXISTS " + sql[13:]
+        schema += sql + ";\n"
+    return schema
+
+
+def csv_quote(val, col_separator):
+    if val == b"" or g_csv_need_quote_re.search(val) is not None or col_separator in val:
+        return b'"' + val.replace(b'"', b'""') + b'"'
+    return val
+
+
+def select_sqlstr_as_text(col_exprs, from_sqlstr, raw_col_indexes=()):
+    # each col expr is cast to text in sqlite itself so numbers get the same text as the sqlite3 executable output
+    return "select " + ",".join([
+        col_expr if i in raw_col_indexes else "CAST(({}) AS TEXT)".format(col_expr)
+        for i, col_expr in enumerate(col_exprs)
+    ]) + " " + from_sqlstr
+
+
+def iter_select_chunks(col_exprs, from_sqlstr, col_separator, row_separator, csv_mode, col_funcs=None, chunk_func=None):
+    """
+    yield the rows of 'select <col_exprs> <from_sqlstr>' as bytes chunks (one per fetchmany batch)
+    exactly like the output of:
+    sqlite3 <db> [-csv|-list] -separator <col_separator> -newline <row_separator> "select ..."
+
+    col_funcs: optional dict of col index -> func(list_of_vals) -> list_of_bytes_or_none, called once per batch
+    with the raw (not cast to text) values of that col - like azm_geom_conv for the 'geom' blobs.
+    chunk_func: optional func(bytes_chunk) -> bytes_chunk to adjust each chunk of output lines before yield.
+
+    a db read failure part-way raises sqlite3.DatabaseError after the rows read until then were yielded.
+    """
+    if col_funcs is None:
+        col_funcs = {}
+    sqlstr = select_sqlstr_as_text(col_exprs, from_sqlstr, raw_col_indexes=col_funcs)
+    col_separator = col_separator.encode()
+    row_separator = row_separator.encode()
+    cursor = get_conn().execute(sqlstr)
+    try:
+        while True:
+            rows = cursor.fetchmany(FETCHMANY_N_ROWS)
+            if not rows:
+                break
+            if col_funcs:
+                cols = list(zip(*rows))
+                for i, col_func in col_funcs.items():
+                    cols[i] = col_func(cols[i])
+                rows = zip(*cols)
+            if csv_mode:
+                lines = [
+                    col_separator.join([b"" if val is None else csv_quote(val, col_separator) for val in row])
+                    for row in rows
+                ]
+            else:
+                lines = [
+                    col_separator.join([b"" if val is None else val for val in row])
+                    for row in rows
+                ]
+            lines.append(b"")
+            chunk = row_separator.join(lines)
+            if chunk_func is not None:
+                chunk = chunk_func(chunk)
+            yield chunk
+    finally:
+        cursor.close()
+
+
+def dump_select_to_file(col_exprs, from_sqlstr, out_fp, col_separator, row_separator, csv_mode, col_funcs=None, chunk_func=None):
+    """
+    write rows of 'select <col_exprs> <from_sqlstr>' into out_fp exactly like:
+    sqlite3 <db> [-csv|-list] -separator <col_separator> -newline <row_separator> ".out <out_fp>" "select ..."
+
+    returns 0 on success like call() of the sqlite3 executable - non-zero if the
+    db read failed part-way (the rows read until then are kept in out_fp like
+    in the sqlite3 executable case).
+    """
+    ret = 0
+    with open(out_fp, "wb") as f:
+        try:
+            for chunk in iter_select_chunks(col_exprs, from_sqlstr, col_separator, row_separator, csv_mode, col_funcs=col_funcs, chunk_func=chunk_func):
+                f.write(chunk)
+        except sqlite3.DatabaseError as e:
+            print("WARNING: azm_sqlite_reader dump_select_to_file failed - exception: {} - from_sqlstr: {}".format(e, from_sqlstr))
+            ret = 1
+    return ret
+
+
+class SelectStream(object):
+    """
+    read-only file-like object of the same bytes that dump_select_to_file() would write - for
+    psycopg2 copy_expert() 'COPY ... FROM STDIN' directly from azqdata.db without any csv file.
+
+    the select only starts at the first read() - so it can be created in create() and read in commit().
+    """
+
+    def __init__(self, col_exprs, from_sqlstr, col_separator, row_separator, csv_mode, col_funcs=None, chunk_func=None):
+        self.col_exprs = col_exprs
+        self.from_sqlstr = from_sqlstr
+        self.col_separator = col_separator
+        self.row_separator = row_separator
+        self.csv_mode = csv_mode
+        self.col_funcs = col_funcs
+        self.chunk_func = chunk_func
+        self.chunks = None
+        self.buf = b""
+        self.buf_offset = 0
+        self.n_bytes_read = 0
+
+    def iter_chunks(self):
+        try:
+            for chunk in iter_select_chunks(self.col_exprs, self.from_sqlstr, self.col_separator, self.row_separator, self.csv_mode, col_funcs=self.col_funcs, chunk_func=self.chunk_func):
+                yield chunk
+        except sqlite3.DatabaseError as e:
+            # same as dump_select_to_file() - keep rows read until the failure
+            print("WARNING: azm_sqlite_reader SelectStream read failed - exception: {} - from_sqlstr: {}".format(e, self.from_sqlstr))
+
+    def read(self, size=-1):
+        if self.chunks is None:
+            self.chunks = self.iter_chunks()
+        while size < 0 or len(self.buf) - self.buf_offset < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buf = self.buf[self.buf_offset:] + chunk
+            self.buf_offset = 0
+        end = len(self.buf) if size < 0 else min(len(self.buf), self.buf_offset + size)
+        ret = self.buf[self.buf_offset:end]
+        self.buf_offset = end
+        self.n_bytes_read += len(ret)
+        return ret
+
+    def close(self):
+        if self.chunks is not None:
+            self.chunks.close()
+        self.buf = b""
+        self.buf_offset = 0
+
+
+def get_arrow_coerce_func(pa_type):
+    """
+    func(val) -> val that fits pa_type or None - for the sqlite values (dynamically typed, with
+    text as bytes) of a col that could not be converted to pa_type as they are
+    """
+    if pa.types.is_integer(pa_type):
+        int_info = np.iinfo(pa_type.to_pandas_dtype())
+
+        def coerce_int(val):
+            try:
+                if isinstance(val, bytes):
+                    val = float(val) if (b"." in val or b"e" in val.lower()) else int(val)
+                if isinstance(val, float):
+                    if val != val or val in (float("inf"), float("-inf")):
+                        return None
+                    val = int(val)
+            except ValueError:
+                return None
+            if val is None or not (int_info.min <= val <= int_info.max):
+                return None
+            return val
+        return coerce_int
+    if pa.types.is_floating(pa_type):
+
+        def coerce_float(val):
+            try:
+                return None if val is None else float(val)
+            except ValueError:
+                return None
+        return coerce_float
+    if pa.types.is_binary(pa_type):
+        return lambda val: val if (val is None or isinstance(val, bytes)) else value_to_text(val).encode()
+    return lambda val: None if val is None else value_to_text(val)
+
+
+def vals_to_arrow_array(vals, pa_type, coerce_func):
+    try:
+        return pa.array(vals, type=pa_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+        # some values are not of the declared col type - like '' in double cols or non utf-8 text
+        return pa.array([coerce_func(val) for val in vals], type=pa_type)
+
+
+def iter_select_record_batches(col_exprs, from_sqlstr, schema):
+    """
+    yield the rows of 'select <col_exprs> <from_sqlstr>' as arrow RecordBatches (one per fetchmany batch) of schema:
+    the type plan - one field per col expr. Values that don't fit the field type (and can't be converted to it) become null.
+
+    a db read failure part-way ends the batches (with a WARNING) - the rows read until then are kept like in dump_select_to_file().
+    """
+    coerce_funcs = [get_arrow_coerce_func(field.type) for field in schema]
+    cursor = get_conn().execute("select " + ",".join(col_exprs) + " " + from_sqlstr)
+    try:
+        while True:
+            try:
+                rows = cursor.fetchmany(FETCHMANY_N_ROWS)
+            except sqlite3.DatabaseError as e:
+                print("WARNING: azm_sqlite_reader iter_select_record_batches failed - exception: {} - from_sqlstr: {}".format(e, from_sqlstr))
+                break
+            if not rows:
+                break
+            cols = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays(
+                [vals_to_arrow_array(cols[i], field.type, coerce_funcs[i]) for i, field in enumerate(schema)],
+                schema=schema
+            )
+    finally:
+        cursor.close()
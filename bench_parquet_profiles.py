@@ -0,0 +1,130 @@
+'''
+benchmark: write time, read time and file size of the --dump_parquet tables
+of azm files with each --parquet_profile (gen_sql_handler.PARQUET_PROFILES).
+
+The tables are read from the azqdata.db and converted like in --dump_parquet
+once, then written/read with each profile - the best of --repeat runs is
+reported for the times.
+
+example:
+python bench_parquet_profiles.py
+python bench_parquet_profiles.py --azm example_logs/352497331102030-13_11_2023-13_52_22_lte_data.azm --repeat 5
+
+Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
+'''
+
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import azm_sqlite_reader
+import gen_sql_handler
+
+
+def read_azm_tables(azm_fp, tmp_dir):
+    # table_name -> converted arrow table of the --dump_parquet tables (with a 'time' col) of the azm
+    with zipfile.ZipFile(azm_fp) as zf:
+        zf.extract("azqdata.db", tmp_dir)
+    azm_sqlite_reader.open_db(os.path.join(tmp_dir, "azqdata.db"))
+    tables = {}
+    try:
+        table_names = [row[0] for row in azm_sqlite_reader.get_conn().execute("select name from sqlite_master where type = 'table' order by name")]
+        for table_name in table_names:
+            table_name = table_name.decode() if isinstance(table_name, bytes) else table_name
+            if table_name == "logs" or table_name.startswith("spatialite") or table_name.startswith("sql_") or "_layer_statistics" in table_name or table_name.startswith("idx_"):
+                continue
+            local_column_dict = {}
+            for row in azm_sqlite_reader.get_conn().execute('pragma table_info("{}")'.format(table_name)):
+                col_name, col_type = [x.decode() if isinstance(x, bytes) else x for x in row[1:3]]
+                local_column_dict[col_name] = col_type.lower()
+            if "time" not in local_column_dict:
+                continue
+            try:
+                pa_column_types = gen_sql_handler.get_parquet_column_types(table_name, local_column_dict)
+                col_exprs = ['nullif("{}",\'\')'.format(col) if pa_column_types[col] == pa.string() else '"{}"'.format(col) for col in local_column_dict]
+                schema = pa.schema([pa.field(col, pa_column_types[col]) for col in local_column_dict])
+                batches = [
+                    gen_sql_handler.conv_parquet_table(table_name, pa.Table.from_batches([batch]), geom_is_hex=False, geom_is_wkb=False)
+                    for batch in azm_sqlite_reader.iter_select_record_batches(col_exprs, "from " + table_name, schema)
+                    if batch.num_rows
+                ]
+            except Exception as e:
+                print("WARNING: skip table {} of {} - exception: {}".format(table_name, azm_fp, e))
+                continue
+            if batches:
+                tables[table_name] = pa.concat_tables(batches)
+    finally:
+        azm_sqlite_reader.close_db()
+    return tables
+
+
+def bench_profile(profile_name, tables, out_dir, repeat):
+    # returns {table_name: (write_seconds, read_seconds, size_bytes)}
+    os.makedirs(out_dir, exist_ok=True)
+    ret = {}
+    for table_name, table in tables.items():
+        fp = os.path.join(out_dir, table_name + ".parquet")
+        writer_kwargs = gen_sql_handler.get_parquet_writer_kwargs(profile_name, table.schema)
+        write_seconds = None
+        read_seconds = None
+        for i in range(repeat):
+            start_time = time.perf_counter()
+            pq.write_table(table, fp, flavor='spark', **writer_kwargs)
+            duration = time.perf_counter() - start_time
+            write_seconds = duration if write_seconds is None else min(write_seconds, duration)
+            start_time = time.perf_counter()
+            read_table = pq.read_table(fp)
+            duration = time.perf_counter() - start_time
+            read_seconds = duration if read_seconds is None else min(read_seconds, duration)
+        assert read_table.num_rows == table.num_rows
+        ret[table_name] = (write_seconds, read_seconds, os.path.getsize(fp))
+    return ret
+
+
+def print_results(title, results, table_filter):
+    print(title)
+    print("{:<10} {:>12} {:>12} {:>14}".format("profile", "write (s)", "read (s)", "size (bytes)"))
+    for profile_name, table_results in results.items():
+        vals = [v for table_name, v in table_results.items() if table_filter(table_name)]
+        print("{:<10} {:>12.3f} {:>12.3f} {:>14}".format(
+            profile_name,
+            sum(v[0] for v in vals),
+            sum(v[1] for v in vals),
+            sum(v[2] for v in vals),
+        ))
+    print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--azm', action='append', help="azm file to bench - can be repeated - default: all azm files in example_logs")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = vars(parser.parse_args())
+    azm_fps = args['azm'] or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "example_logs", "**", "*.azm"), recursive=True))
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        tables = {}
+        for azm_fp in azm_fps:
+            print("read azm:", azm_fp)
+            azm_tmp_dir = tempfile.mkdtemp(dir=tmp_dir)
+            for table_name, table in read_azm_tables(azm_fp, azm_tmp_dir).items():
+                tables["{}/{}".format(os.path.basename(azm_fp), table_name)] = table
+        print("n_tables: {} n_rows: {}".format(len(tables), sum(table.num_rows for table in tables.values())))
+        print()
+
+        results = {}
+        for profile_name in gen_sql_handler.PARQUET_PROFILES:
+            results[profile_name] = bench_profile(profile_name, {k.replace("/", "_"): v for k, v in tables.items()}, os.path.join(tmp_dir, profile_name), args['repeat'])
+
+        print_results("all tables:", results, lambda table_name: True)
+        print_results("nr_*/lte_* tables:", results, lambda table_name: table_name.split(".azm_", 1)[1].startswith(("nr_", "lte_")))
+    finally:
+        shutil.rmtree(tmp_dir)
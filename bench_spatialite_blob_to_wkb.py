@@ -0,0 +1,124 @@
+'''
+micro-benchmark: per csv line gen_sql_handler.find_and_conv_spatialite_blob_to_wkb()
+vs the batch azm_geom_conv.conv_spatialite_point_blobs_to_hex() used with azm_sqlite_reader.
+
+--parquet: per row pandas apply() wkb lat/lon extraction of the --dump_parquet geom col
+vs azm_geom_conv.conv_geom_arrow_array_to_wkb_lat_lon().
+
+example:
+python bench_spatialite_blob_to_wkb.py --n_rows 1000000
+python bench_spatialite_blob_to_wkb.py --n_rows 1000000 --parquet
+
+Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
+'''
+
+import argparse
+import binascii
+import random
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import azm_geom_conv
+import azm_sqlite_reader
+import gen_sql_handler
+
+
+def gen_spatialite_point_blob(lon, lat):
+    xy = struct.pack("<dd", lon, lat)
+    return (
+        azm_geom_conv.SPATIALITE_POINT_BLOB_HEADER
+        + xy  # MBR_MIN_X, MBR_MIN_Y
+        + xy  # MBR_MAX_X, MBR_MAX_Y
+        + b"\x7c" + struct.pack("<I", 1)  # MBR_END, CLASS_TYPE point
+        + xy
+        + b"\xfe"
+    )
+
+
+def gen_blobs(n_rows, null_ratio):
+    blobs = []
+    for i in range(n_rows):
+        if random.random() < null_ratio:
+            blobs.append(None)
+        else:
+            blobs.append(gen_spatialite_point_blob(100.0 + random.random(), 13.0 + random.random()))
+    return blobs
+
+
+def bench(n_rows, null_ratio, batch_size):
+    random.seed(0)
+    blobs = gen_blobs(n_rows, null_ratio)
+    # same csv lines as the sqlite3 csv dump of: select log_hash, time, nullif(hex(geom),''), seqid from ...
+    csv_lines = [
+        '1422072392189068736,"2023-11-13 13:44:29.014",{},{}\n'.format(
+            "" if blob is None else binascii.hexlify(blob).decode().upper(),
+            i
+        )
+        for i, blob in enumerate(blobs)
+    ]
+    gen_sql_handler.g_is_postgre = True
+
+    start_time = time.time()
+    old_geoms = []
+    for csv_line in csv_lines:
+        old_geoms.append(gen_sql_handler.find_and_conv_spatialite_blob_to_wkb(csv_line).split(",")[2])
+    old_duration = time.time() - start_time
+
+    start_time = time.time()
+    new_geoms = []
+    for offset in range(0, n_rows, batch_size):
+        new_geoms += gen_sql_handler.conv_geom_col_vals_to_wkb_hex(blobs[offset:offset + batch_size])
+    new_duration = time.time() - start_time
+
+    assert old_geoms == ["" if x is None else x.decode() for x in new_geoms]
+    print("n_rows: {} null_ratio: {} batch_size: {}".format(n_rows, null_ratio, batch_size))
+    print("find_and_conv_spatialite_blob_to_wkb per csv line: {:.3f} seconds".format(old_duration))
+    print("azm_geom_conv.conv_spatialite_point_blobs_to_hex per batch: {:.3f} seconds".format(new_duration))
+    print("speedup: {:.1f}x".format(old_duration / new_duration))
+
+
+def bench_parquet(n_rows, null_ratio):
+    random.seed(0)
+    blobs = gen_blobs(n_rows, null_ratio)
+    # geom col as read from the csv dump by pyarrow csv.read_csv()
+    geom_arr = pa.array([None if blob is None else binascii.hexlify(blob).upper() for blob in blobs], type=pa.binary())
+
+    start_time = time.time()
+    # same steps as the previous gen_sql_handler parquet geom code (with bytes.fromhex() for the py2 str.decode("hex") and [0] for the 1 element arrays)
+    geom_sr = geom_arr.to_pandas()
+    geom_sr_null_mask = pd.isnull(geom_sr)
+    geom_sr = geom_sr.str.decode('ascii').fillna("")
+    geom_sr = "01" + "01000020E6100000" + geom_sr.str.slice(start=86, stop=118)
+    geom_sr = geom_sr.apply(bytes.fromhex)
+    geom_sr[geom_sr_null_mask] = None
+    lon_sr = geom_sr.apply(lambda x: None if (pd.isnull(x) or len(x) != 25) else np.frombuffer(x[9:9+8], dtype=np.float64)[0]).astype(np.float64)
+    lat_sr = geom_sr.apply(lambda x: None if (pd.isnull(x) or len(x) != 25) else np.frombuffer(x[9+8:9+8+8], dtype=np.float64)[0]).astype(np.float64)
+    old_lat, old_lon = pa.Array.from_pandas(lat_sr), pa.Array.from_pandas(lon_sr)
+    old_duration = time.time() - start_time
+
+    start_time = time.time()
+    wkb_arr, lat_arr, lon_arr = azm_geom_conv.conv_geom_arrow_array_to_wkb_lat_lon(geom_arr, geom_is_hex=True, geom_is_wkb=False)
+    new_duration = time.time() - start_time
+
+    assert lat_arr.equals(old_lat) and lon_arr.equals(old_lon)
+    print("n_rows: {} null_ratio: {}".format(n_rows, null_ratio))
+    print("pandas apply() per row: {:.3f} seconds".format(old_duration))
+    print("azm_geom_conv.conv_geom_arrow_array_to_wkb_lat_lon: {:.3f} seconds".format(new_duration))
+    print("speedup: {:.1f}x".format(old_duration / new_duration))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_rows', type=int, default=200000)
+    parser.add_argument('--null_ratio', type=float, default=0.1)
+    parser.add_argument('--batch_size', type=int, default=azm_sqlite_reader.FETCHMANY_N_ROWS)
+    parser.add_argument('--parquet', action='store_true', default=False)
+    args = vars(parser.parse_args())
+    if args['parquet']:
+        bench_parquet(args['n_rows'], args['null_ratio'])
+    else:
+        bench(args['n_rows'], args['null_ratio'], args['batch_size'])
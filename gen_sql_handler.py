@@ -8,7 +8,12 @@ Copyright: Copyright (C) 2016 Freewill FX Co., Ltd. All rights reserved.
 
 from debug_helpers import dprint
 import azm_db_constants
-from subprocess import call
+import azm_sqlite_reader
+import azm_geom_conv
+import azm_schema_cache
+import azm_parquet_dataset
+import azm_object_store
+from subprocess import call, check_output
 import os
 import sys
 import traceback
@@ -17,14 +22,54 @@ import datetime
 from dateutil.relativedelta import relativedelta
 import random
 import glob
+import threading
+import queue
+import uuid
+import concurrent.futures
 import pandas as pd
 import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 from pyarrow import csv
 import pyarrow.parquet as pq
 
 PARQUET_COMPRESSION = 'snappy'
+# --parquet_profile: writer settings per arrow column kind - see get_parquet_writer_kwargs() and bench_parquet_profiles.py
+# dictionary/byte_stream_split: the column kinds ('float', 'int', 'string', 'binary', 'timestamp', 'bool') they are used for
+PARQUET_PROFILES = {
+    # the previous fixed settings
+    'fast': {
+        'compression': PARQUET_COMPRESSION,
+        'compression_level': None,
+        'dictionary': ['float', 'int', 'string', 'binary', 'timestamp', 'bool'],
+        'byte_stream_split': [],
+        'data_page_size': None,
+    },
+    # float cols (mostly unique measurements) plain byte-stream-split instead of dictionary then zstd
+    'balanced': {
+        'compression': 'zstd',
+        'compression_level': 3,
+        'dictionary': ['int', 'string', 'bool'],
+        'byte_stream_split': ['float'],
+        'data_page_size': 1024 * 1024,
+    },
+    'archive': {
+        'compression': 'zstd',
+        'compression_level': 15,
+        'dictionary': ['int', 'string', 'bool'],
+        'byte_stream_split': ['float'],
+        'data_page_size': 8 * 1024 * 1024,
+    },
+}
+# rows of a log are imported only within this margin of its log_start_time/log_end_time (azm_db_merge log_data_min_time/log_data_max_time)
+LOG_DATA_TIME_MARGIN = datetime.timedelta(hours=48)
+PARQUET_MC_RM_BATCH_SIZE = 500  # object paths per 'mc rm' call of parquet unmerge
+PG_STREAM_COPY_READ_SIZE = 1024 * 1024
+# --pg_pipeline_copy: DDL of the main conn must not wait forever on tables held by the copy transaction of another azm_db_merge process
+# - SET LOCAL for each DDL transaction of exec_creatept_or_alter_handle_concurrency() only, the other statements keep the server default
+PG_PIPELINE_COPY_DDL_LOCK_TIMEOUT = '300s'
 WKB_POINT_LAT_LON_BYTES_LEN = 25
+DATETIME_STR_MAX_LEN = 64
 # global vars
 g_is_postgre = False
 g_is_ms = False
@@ -38,6 +83,45 @@ g_cursor = None
 g_conn = None
 g_exec_buf = []
 
+# --table_jobs: pool running dump_table() - its futures are put in g_exec_buf in table order and resolved at commit()
+g_table_jobs_executor = None
+g_table_jobs = {}  # future -> table_name
+g_table_operation_stats_lock = threading.Lock()
+
+# --pg_pipeline_copy: COPY of each dumped table runs in g_copy_thread on its own conn (one transaction
+# committed only at commit()) while the next tables are created/dumped in the main thread
+g_copy_conn = None
+g_copy_cursor = None
+g_copy_queue = None
+g_copy_thread = None
+g_copy_exception = None
+
+# --schema_cache_file: args that change the created tables/columns - part of the cache key
+SCHEMA_CACHE_KEY_ARGS = ['import_geom_column_in_location_table_only', 'pg10_partition_by_month']
+# parts of the exception str of a COPY/insert into a column missing in the target table (pg, mssql)
+COLUMN_ERROR_STRS = [('column "', '" does not exist'), ('Invalid column name',)]
+
+# --schema_cache_file: (schema_shasum, schema_args, target, pg_schema) of this azm - None if not used
+g_schema_cache_key = None
+g_schema_cache_hit = False
+g_schema_cache_new_tables = {}  # table_name -> remote_column_names - put in cache after the commit
+
+# table_name -> [[col_name, col_type], ...] of all tables in the target schema - loaded by one catalog query per connection
+g_remote_catalog = None
+
+# --pg10_partition_by_month: per_month_* schemas and their partitions ("schema.table") - loaded by one query per connection
+g_remote_per_month_schemas = None
+g_remote_partitions = None
+# --pg10_partition_by_log_hash: month partitions ("schema.table") that are partitioned by list (log_hash) - subset of g_remote_partitions
+g_remote_log_hash_partitioned = None
+
+# --dump_parquet: pqfp -> {'table', 'num_rows', 'size_bytes', 'min_time', 'max_time'} of the parquet files written for the current azm - for its manifest
+g_parquet_files = {}
+# --reimport --parquet_object_store: suffix of the keys of the new files so they never replace the files of the current import
+# before the commit - see get_parquet_rel_path()
+g_parquet_generation = None
+g_parquet_files_lock = threading.Lock()
+
 """
 now we already use 'autocommit = True' as recommended by MSDN doc
 so set g_always_commit to False
@@ -98,9 +182,12 @@ def get_module_path():
 def connect(args):
     global g_bulk_insert_mode
     global g_dir_processing_azm
+    global g_parquet_generation
     global g_cursor, g_conn
     global g_exec_buf
     global g_is_ms, g_is_postgre
+    global g_copy_conn, g_copy_cursor
+    global g_schema_cache_key
 
     if (args['target_db_type'] == 'postgresql'):
         print("PostgreSQL mode initializing...")
@@ -119,6 +206,9 @@ def connect(args):
     
     g_dir_processing_azm = args['dir_processing_azm']
 
+    if args['reimport'] and args['dump_parquet'] and args['parquet_object_store']:
+        g_parquet_generation = uuid.uuid4().hex[:12]
+
     if g_is_ms:
         print("Connecting... Target DBMS type: mssql")
         connect_str = args['mssql_conn_str']
@@ -162,6 +252,11 @@ def connect(args):
         #unsafe as users might see in logs print "using connect_str: "+connect_str
         args['connect_str'] = connect_str
         g_conn = psycopg2.connect(connect_str)
+        if args['pg_pipeline_copy'] and args['reimport']:
+            print("--pg_pipeline_copy: not used with --reimport - the COPYs must be in the same transaction as the deletes")
+        elif args['pg_pipeline_copy'] and not args['unmerge']:
+            print("--pg_pipeline_copy: connect copy conn")
+            g_copy_conn = psycopg2.connect(connect_str)
     if (g_conn is None):
         print("psycopg2.connect returned None")
         return False
@@ -170,6 +265,20 @@ def connect(args):
     
     g_cursor = g_conn.cursor()
 
+    if args['schema_cache_file'] and args.get('schema_shasum'):
+        if g_is_ms:
+            target = "mssql://{}/{}".format(args["mssql_conn_str_dict"].get("Server"), args["mssql_conn_str_dict"].get("Database"))
+        else:
+            target = "postgresql://{}:{}/{}".format(args['pg_host'], args['pg_port'], args['server_database'])
+        azm_schema_cache.open_cache(args['schema_cache_file'])
+        g_schema_cache_key = (args['schema_shasum'], get_schema_cache_args_str(args), target, args['pg_schema'])
+        print("schema cache key:", g_schema_cache_key)
+
+    if g_copy_conn is not None:
+        g_copy_cursor = g_copy_conn.cursor()
+        if args["pg_schema"] != "public":
+            g_copy_cursor.execute("SET search_path = '{}','public';".format(args["pg_schema"]))
+
     # post connect steps for each dbms
     if g_is_postgre and not args['unmerge']:
 
@@ -322,6 +431,16 @@ def check_if_already_merged(args, log_hash):
                 
                 g_exec_buf.append(sqlstr)
                 print("delete from logs table added to g_exec_buf: ", sqlstr)
+
+            elif args['reimport']:
+                # queue the deletes of all tables with rows of this log (also tables not in this azm anymore) before
+                # any COPY of the import - all run in the commit() transaction
+                print("### reimport mode - replace rows of already imported azm: log_hash {}".format(log_hash))
+                remote_catalog = load_remote_catalog(args)
+                for table_name in sorted(remote_catalog):
+                    if "log_hash" in [col[0] for col in remote_catalog[table_name]]:
+                        g_exec_buf.extend(gen_log_delete_sqls(args, table_name, log_hash, reimport=True))
+                print("reimport mode: {} deletes added to g_exec_buf".format(len(g_exec_buf)))
                 
             else:
                 raise Exception("ABORT: This log ({}) has already been imported/exists in target db (use --unmerge to remove first if you want to re-import).".format(log_hash))
@@ -345,6 +464,15 @@ def check_if_already_merged(args, log_hash):
     return False
         
 
+def get_schema_cache_args_str(args):
+    # like 'import_geom_column_in_location_table_only=0,pg10_partition_by_month=1'
+    return ",".join("{}={}".format(arg, int(bool(args[arg]))) for arg in SCHEMA_CACHE_KEY_ARGS)
+
+
+def is_column_error(exstr):
+    return any(all(part in exstr for part in parts) for parts in COLUMN_ERROR_STRS)
+
+
 def close(args):
     global g_cursor, g_conn
     global g_exec_buf    
@@ -352,6 +480,12 @@ def close(args):
     global g_prev_create_statement_table_name
     global g_bulk_insert_mode
     global g_unmerge_logs_row
+    global g_table_jobs_executor
+    global g_copy_conn, g_copy_cursor
+    global g_schema_cache_key, g_schema_cache_hit
+    global g_remote_catalog
+    global g_remote_per_month_schemas, g_remote_partitions, g_remote_log_hash_partitioned
+    global g_parquet_generation
     
     print("mssql_handler close() - cleanup()")
     
@@ -361,7 +495,46 @@ def close(args):
     g_unmerge_logs_row = None
     
     del g_exec_buf[:]
+
+    # a still running copy thread means this azm failed - let it skip the rest, its transaction is rolled back by conn close below
+    stop_copy_pipeline(Exception("close() before commit()"))
+
+    if g_table_jobs_executor is not None:
+        # wait for (or cancel not yet started) table jobs of a failed azm before the next azm reuses the dump dir
+        g_table_jobs_executor.shutdown(wait=True, cancel_futures=True)
+        g_table_jobs_executor = None
+    g_table_jobs.clear()
         
+    if g_schema_cache_key is not None:
+        if g_schema_cache_hit and g_schema_cache_new_tables:
+            # close() before the commit() of an azm that used cached tables - maybe the target tables changed since - dont trust the cache next time
+            try:
+                azm_schema_cache.invalidate(g_schema_cache_key)
+            except Exception as e:
+                print("WARNING: schema cache invalidate failed: "+str(e))
+        azm_schema_cache.close_cache()
+    g_schema_cache_key = None
+    g_schema_cache_hit = False
+    g_schema_cache_new_tables.clear()
+    g_remote_catalog = None
+    g_remote_per_month_schemas = None
+    g_remote_partitions = None
+    g_remote_log_hash_partitioned = None
+    with g_parquet_files_lock:
+        g_parquet_files.clear()
+    if azm_object_store.is_open():
+        # uploads of an azm that failed before its commit - finish_uploads() in commit() already took those of a committed azm
+        azm_object_store.abort_uploads()
+    g_parquet_generation = None
+
+    if g_copy_conn is not None:
+        try:
+            g_copy_conn.close()
+        except Exception as e:
+            print("warning: copy conn close failed: "+str(e))
+        g_copy_conn = None
+        g_copy_cursor = None
+
     if g_cursor is not None:
         try:
             g_cursor.close()
@@ -386,13 +559,128 @@ def commit(args, line):
     
     g_prev_create_statement_table_name = None
 
-    n = len(g_exec_buf)
+    # wait for all --table_jobs dumps first - a failed table job raises here before any COPY/bulk insert is executed
+    resolve_table_jobs(args)
+    try:
+        # wait for the COPYs already running in the --pg_pipeline_copy thread - raises if any failed
+        stop_copy_pipeline()
 
-    # make sure all create/alters are committed
+        n = len(g_exec_buf)
+
+        # make sure all create/alters are committed
+        g_conn.commit()
+
+        print("### total cmds to execute for operation: "+str(n))
+
+        if args['reimport']:
+            # one transaction for the deletes of the old rows and the COPYs of the new ones - a failed statement rolls back all
+            with g_conn:
+                exec_buf_cmds(args)
+        else:
+            exec_buf_cmds(args)
+    except Exception as e:
+        if g_schema_cache_hit and is_column_error(str(e)):
+            # a cached table lost/never got a column since it was cached - check/alter the tables again in the retry of this azm
+            print("WARNING: column error on tables from the schema cache - invalidate it - exception: {}".format(e))
+            azm_schema_cache.invalidate(g_schema_cache_key)
+            raise Exception("{}: {}".format(azm_schema_cache.STALE_EXCEPTION_STR, e))
+        raise
+        
+    print("### all cmds exec success - COMMIT now...")    
     g_conn.commit()
+    if g_copy_conn is not None:
+        # the pipelined COPYs
+        g_copy_conn.commit()
+    print("### COMMIT success...")
+
+    if g_schema_cache_key is not None and g_schema_cache_new_tables:
+        azm_schema_cache.put_remote_column_names(g_schema_cache_key, g_schema_cache_new_tables)
+        print("put {} tables in schema cache".format(len(g_schema_cache_new_tables)))
+        g_schema_cache_new_tables.clear()
+
+    # do mc cp all parquet files to object store (or move them to the --parquet_dataset_dir)...
+    if args['dump_parquet']:
+        bucket_ym_folder_name = args['log_hash_ym_str'].replace("_", "-")
+        manifest_rel_path = azm_parquet_dataset.get_manifest_rel_path(azm_parquet_dataset.get_month_str(args['log_hash_ym_str']), args['log_hash'])
+        use_dataset_dir = args['parquet_hive_layout'] and args['parquet_dataset_dir']
+        if args['unmerge']:
+            removed_parquets = remove_log_parquet_files(args, manifest_rel_path, bucket_ym_folder_name)
+            if removed_parquets:
+                try:
+                    with g_conn:
+                        update_sql = "update uploaded_logs set non_azm_object_size_bytes = null where log_hash = {};".format(args['log_hash'])
+                        print("update_sql:", update_sql)
+                        g_cursor.execute(update_sql)
+                except:
+                    type_, value_, traceback_ = sys.exc_info()
+                    exstr = str(traceback.format_exception(type_, value_, traceback_))
+                    print("WARNING: update uploaded_logs set non_azm_object_size_bytes to null failed exception:", exstr)
+
+        else:
+            manifest = gen_parquet_manifest(args)
+            if args['reimport'] and not args['parquet_object_store']:
+                # the files of tables not in the new azm would stay (and be read with the new rows) - same named files are replaced below
+                remove_log_parquet_files(args, manifest_rel_path, bucket_ym_folder_name)
+            # the manifest is written last - after all its files are in place
+            if use_dataset_dir:
+                moved = azm_parquet_dataset.move_into_dataset(get_parquet_staging_dir(), args['parquet_dataset_dir'])
+                print("moved {} parquet files to parquet_dataset_dir".format(len(moved)))
+                azm_parquet_dataset.write_manifest(os.path.join(args['parquet_dataset_dir'], *manifest_rel_path.split("/")), manifest)
+            elif args['parquet_object_store']:
+                uploaded = get_parquet_object_store(args).finish_uploads()
+                print("uploaded {} parquet files to parquet_object_store".format(len(uploaded)))
+                old_manifest_data = None
+                if args['reimport']:
+                    old_manifest_data = azm_object_store.get_bytes(manifest_rel_path)
+                azm_object_store.put_bytes(manifest_rel_path, azm_parquet_dataset.manifest_to_bytes(manifest))
+                if args['reimport']:
+                    # the new files have their own keys (g_parquet_generation) - the old ones are only removed now that the new manifest replaced the old one
+                    if old_manifest_data is not None:
+                        n_removed = remove_manifest_objects(azm_parquet_dataset.manifest_from_bytes(old_manifest_data, manifest_rel_path), keep_manifest=manifest)
+                    else:
+                        # no manifest of the previous import (like from before the manifests): its files have the keys of the new ones without the generation
+                        n_removed = azm_object_store.delete_objects([f['path'].replace(".{}.parquet".format(g_parquet_generation), ".parquet") for f in manifest['files']])
+                    print("removed {} parquet files of the previous import from parquet_object_store".format(n_removed))
+            else:
+                cpcmd = "mc cp {}/*.parquet minio_logs/{}/{}/".format(
+                    g_dir_processing_azm,
+                    get_parquet_bucket_name(),
+                    bucket_ym_folder_name,
+                )
+                if args['parquet_hive_layout']:
+                    # only the data files - the partition summary files are kept for --parquet_dataset_dir only as they can't be rebuilt here without listing the bucket
+                    cpcmd = "mc cp --recursive {}/ minio_logs/{}/".format(
+                        get_parquet_staging_dir(),
+                        get_parquet_bucket_name(),
+                    )
+                print("mc cpcmd:", cpcmd)
+                cpcmdret = os.system(cpcmd)
+                if cpcmdret != 0:
+                    raise Exception("Copy files to object store failed cmcmdret: {}".format(cpcmdret))
+                manifest_fp = os.path.join(g_dir_processing_azm, *manifest_rel_path.split("/"))
+                azm_parquet_dataset.write_manifest(manifest_fp, manifest)
+                # one object put - readers see the whole manifest or none
+                cpcmd = "mc cp {} minio_logs/{}/{}".format(manifest_fp, get_parquet_bucket_name(), manifest_rel_path)
+                print("mc cpcmd:", cpcmd)
+                cpcmdret = os.system(cpcmd)
+                if cpcmdret != 0:
+                    raise Exception("Copy manifest to object store failed cmcmdret: {}".format(cpcmdret))
+            try:
+                with g_conn:
+                    update_sql = "update uploaded_logs set non_azm_object_size_bytes = {} where log_hash = {};".format(manifest['size_bytes'], args['log_hash'])
+                    print("update_sql:", update_sql)
+                    g_cursor.execute(update_sql)
+            except:
+                type_, value_, traceback_ = sys.exc_info()
+                exstr = str(traceback.format_exception(type_, value_, traceback_))
+                print("WARNING: update uploaded_logs set non_azm_object_size_bytes to parquets size failed exception:", exstr)
+
     
-    print("### total cmds to execute for operation: "+str(n))
-    
+    return True
+
+def exec_buf_cmds(args):
+    # execute the g_exec_buf statements and COPY/bulk inserts in order
+    n = len(g_exec_buf)
     i = 0
     for buf in g_exec_buf:
         #print("buf:", buf)
@@ -400,8 +688,7 @@ def commit(args, line):
             # for COPY from stdin            
             if g_is_postgre:
                 buf, dump_fp = buf
-                with open(dump_fp, "rb") as dump_fp_fo:
-                    g_cursor.copy_expert(buf, dump_fp_fo)
+                exec_pg_copy(args, g_cursor, buf, dump_fp)
             elif g_is_ms:
                 buf, dump_fp, dump_format_fp = buf
                 table = buf.split('"')[1].strip()
@@ -445,8 +732,12 @@ def commit(args, line):
                     if skip:
                         print("dump_parquet mode SKIP exec buf:", buf)
                         continue
-                with g_conn:  # needed otherwise cursor would become invalid and unmerge would fail for no table cases handled below
+                if args['reimport']:
+                    # already in the 'with g_conn' of all statements in commit() - the deletes must commit together with the COPYs
                     g_cursor.execute(buf)
+                else:
+                    with g_conn:  # needed otherwise cursor would become invalid and unmerge would fail for no table cases handled below
+                        g_cursor.execute(buf)
             except Exception as e:
                 if "does not exist" in str(e) and args['unmerge']:
                     print("WARNING: unmerge exception: {} - but ok for --umnerge mode if exec delete and face - does not exist exception...".format(e))
@@ -455,71 +746,258 @@ def commit(args, line):
 
         print("# done execute cmd {}/{}: {}".format(i, n, buf))
         i = i + 1
-        
-    print("### all cmds exec success - COMMIT now...")    
-    g_conn.commit()
-    print("### COMMIT success...")
 
-    # do mc cp all parquet files to object store...
-    if args['dump_parquet']:
-        bucket_name = ""
-        if "AZM_BUCKET_NAME_OVERRIDE" in os.environ and os.environ["AZM_BUCKET_NAME_OVERRIDE"]:
-            bucket_name = os.environ["AZM_BUCKET_NAME_OVERRIDE"]
-        else:
-            subdomain = os.environ['WEB_DOMAIN_NAME'].split(".")[0]
-            bucket_name = "azm-"+subdomain
 
-        bucket_ym_folder_name = args['log_hash_ym_str'].replace("_", "-")
-        if args['unmerge']:
-            if 'WEB_DOMAIN_NAME' in os.environ and os.environ['WEB_DOMAIN_NAME'] == 'localhost':
-                print('localhost mc rm old parquet files')
-                # object listing would cost too much cpu and class a operations so skip this for parquet mode
-                rmcmd = "mc find minio_logs/{}/{}/ --name '*_{}.parquet'".format(
-                    bucket_name,
-                    bucket_ym_folder_name,
-                    args['log_hash']
-                )
-                rmcmd += " --exec 'mc rm {}'"
-                print("mc rmcmd:", rmcmd)
-                rmcmdret = os.system(rmcmd)
-                if rmcmdret != 0:
-                    raise Exception("Remove files from object store failed cmcmdret: {}".format(rmcmdret))
-                try:
-                    with g_conn:
-                        update_sql = "update uploaded_logs set non_azm_object_size_bytes = null where log_hash = {};".format(args['log_hash'])
-                        print("update_sql:", update_sql)
-                        g_cursor.execute(update_sql)
-                except:
-                    type_, value_, traceback_ = sys.exc_info()
-                    exstr = str(traceback.format_exception(type_, value_, traceback_))
-                    print("WARNING: update uploaded_logs set non_azm_object_size_bytes to null failed exception:", exstr)
+def get_parquet_rel_path(args, pqfp):
+    # path of pqfp in the bucket/dataset/object store - '/' separated relative to its root
+    if args['parquet_hive_layout']:
+        rel_path = os.path.relpath(pqfp, get_parquet_staging_dir()).replace(os.sep, "/")
+    else:
+        rel_path = "{}/{}".format(args['log_hash_ym_str'].replace("_", "-"), os.path.basename(pqfp))
+    if g_parquet_generation is not None:
+        # like <table>_<log_hash>.<generation>.parquet
+        rel_path = "{}.{}.parquet".format(rel_path[:-len(".parquet")], g_parquet_generation)
+    return rel_path
+
+
+def get_parquet_object_store(args):
+    if not azm_object_store.is_open():
+        azm_object_store.open_store(args['parquet_object_store'], args['parquet_upload_threads'])
+    return azm_object_store
+
+
+def gen_parquet_manifest(args):
+    # manifest of the parquet files written for the current azm by write_parquet_batches() - paths relative to the bucket/dataset root
+    files = []
+    with g_parquet_files_lock:
+        for pqfp, pq_file in g_parquet_files.items():
+            files.append(dict(pq_file, path=get_parquet_rel_path(args, pqfp)))
+    return azm_parquet_dataset.gen_manifest(
+        args['log_hash'],
+        azm_parquet_dataset.get_month_str(args['log_hash_ym_str']),
+        "hive" if args['parquet_hive_layout'] else "flat",
+        files
+    )
+
 
+def remove_log_parquet_files(args, manifest_rel_path, bucket_ym_folder_name):
+    """
+    remove the parquet files of args['log_hash'] (and its manifest) from where --dump_parquet put them: for --unmerge - and for
+    --reimport before the new files are moved/copied in (except the parquet_object_store: see commit()).
+    returns True if files were removed
+    """
+    if args['parquet_hive_layout'] and args['parquet_dataset_dir']:
+        removed = []
+        manifest_fp = os.path.join(args['parquet_dataset_dir'], *manifest_rel_path.split("/"))
+        if os.path.isfile(manifest_fp):
+            removed = azm_parquet_dataset.remove_manifest_files(args['parquet_dataset_dir'], manifest_fp)
         else:
-            cpcmd = "mc cp {}/*.parquet minio_logs/{}/{}/".format(
-                g_dir_processing_azm,
+            print("no parquet manifest {} - remove parquet files of log_hash by name".format(manifest_fp))
+        # also files of log_hash not in its manifest - like of an import interrupted before its manifest was written
+        removed += azm_parquet_dataset.remove_log_files(args['parquet_dataset_dir'], azm_parquet_dataset.get_month_str(args['log_hash_ym_str']), args['log_hash'])
+        print("removed {} parquet files from parquet_dataset_dir".format(len(removed)))
+        return True
+    if args['parquet_object_store']:
+        manifest_data = get_parquet_object_store(args).get_bytes(manifest_rel_path)
+        if manifest_data is None:
+            print("WARNING: no parquet manifest {} in parquet_object_store - parquet files of log_hash {} not removed".format(manifest_rel_path, args['log_hash']))
+            return False
+        n_removed = remove_manifest_objects(azm_parquet_dataset.manifest_from_bytes(manifest_data, manifest_rel_path))
+        azm_object_store.delete_objects([manifest_rel_path])
+        print("removed {} parquet files from parquet_object_store".format(n_removed))
+        return True
+    return unmerge_parquet_object_store_files(args, manifest_rel_path, bucket_ym_folder_name)
+
+
+def remove_manifest_objects(manifest, keep_manifest=None):
+    # delete the parquet_object_store files of manifest - except the ones also in keep_manifest - returns the number of deleted files
+    keep_paths = set() if keep_manifest is None else set(f['path'] for f in keep_manifest['files'])
+    return azm_object_store.delete_objects([f['path'] for f in manifest['files'] if f['path'] not in keep_paths])
+
+
+def unmerge_parquet_object_store_files(args, manifest_rel_path, bucket_ym_folder_name):
+    """
+    rm the parquet files of args['log_hash'] listed in its manifest from the object store - then the manifest itself.
+    logs merged before the manifests were added have none: then the bucket folder is searched by file name (localhost only as
+    object listing would cost too much cpu and class a operations).
+    returns True if files were removed
+    """
+    bucket_name = get_parquet_bucket_name()
+    manifest_fp = os.path.join(g_dir_processing_azm, "unmerge_manifest.json")
+    getcmd = "mc cp minio_logs/{}/{} {}".format(bucket_name, manifest_rel_path, manifest_fp)
+    print("mc getcmd:", getcmd)
+    if os.system(getcmd) == 0:
+        manifest = azm_parquet_dataset.read_manifest(manifest_fp)
+        object_paths = ["minio_logs/{}/{}".format(bucket_name, f['path']) for f in manifest['files']]
+        print("mc rm {} parquet files listed in manifest".format(len(object_paths)))
+        for offset in range(0, len(object_paths), PARQUET_MC_RM_BATCH_SIZE):
+            rmcmdret = call(["mc", "rm"] + object_paths[offset:offset + PARQUET_MC_RM_BATCH_SIZE], shell=False)
+            if rmcmdret != 0:
+                raise Exception("Remove files from object store failed cmcmdret: {}".format(rmcmdret))
+        rmcmdret = call(["mc", "rm", "minio_logs/{}/{}".format(bucket_name, manifest_rel_path)], shell=False)
+        if rmcmdret != 0:
+            raise Exception("Remove manifest from object store failed cmcmdret: {}".format(rmcmdret))
+        return True
+
+    if 'WEB_DOMAIN_NAME' in os.environ and os.environ['WEB_DOMAIN_NAME'] == 'localhost':
+        print('no parquet manifest - localhost mc rm old parquet files')
+        rmcmd = "mc find minio_logs/{}/{}/ --name '*_{}.parquet'".format(
+            bucket_name,
+            bucket_ym_folder_name,
+            args['log_hash']
+        )
+        if args['parquet_hive_layout']:
+            rmcmd = "mc find minio_logs/{}/ --regex 'month={}/[^/]+_{}[.]parquet$'".format(
                 bucket_name,
-                bucket_ym_folder_name,
+                azm_parquet_dataset.get_month_str(args['log_hash_ym_str']),
+                args['log_hash']
             )
-            print("mc cpcmd:", cpcmd)
-            cpcmdret = os.system(cpcmd)
-            if cpcmdret != 0:
-                raise Exception("Copy files to object store failed cmcmdret: {}".format(cpcmdret))
-            try:
-                combined_pq_size = 0
-                for fp in glob.glob('{}/*.parquet'.format(g_dir_processing_azm)):
-                    fp_sz = os.path.getsize(fp)
-                    combined_pq_size += fp_sz
-                with g_conn:
-                    update_sql = "update uploaded_logs set non_azm_object_size_bytes = {} where log_hash = {};".format(combined_pq_size, args['log_hash'])
-                    print("update_sql:", update_sql)
-                    g_cursor.execute(update_sql)
-            except:
-                type_, value_, traceback_ = sys.exc_info()
-                exstr = str(traceback.format_exception(type_, value_, traceback_))
-                print("WARNING: update uploaded_logs set non_azm_object_size_bytes to parquets size failed exception:", exstr)
+        rmcmd += " --exec 'mc rm {}'"
+        print("mc rmcmd:", rmcmd)
+        rmcmdret = os.system(rmcmd)
+        if rmcmdret != 0:
+            raise Exception("Remove files from object store failed cmcmdret: {}".format(rmcmdret))
+        return True
+
+    print("WARNING: no parquet manifest {} in object store - parquet files of log_hash {} not removed".format(manifest_rel_path, args['log_hash']))
+    return False
+
+
+def get_parquet_bucket_name():
+    if "AZM_BUCKET_NAME_OVERRIDE" in os.environ and os.environ["AZM_BUCKET_NAME_OVERRIDE"]:
+        return os.environ["AZM_BUCKET_NAME_OVERRIDE"]
+    subdomain = os.environ['WEB_DOMAIN_NAME'].split(".")[0]
+    return "azm-"+subdomain
+
+
+def get_parquet_staging_dir():
+    # --parquet_hive_layout: root of the hive partitioned tree of the parquet files of the current azm
+    return os.path.join(g_dir_processing_azm, azm_parquet_dataset.STAGING_DIR_NAME)
+
+
+def get_table_jobs_executor(args):
+    global g_table_jobs_executor
+    if args['table_jobs'] > 1 and g_table_jobs_executor is None:
+        print("using --table_jobs pool of {} threads for table dumps".format(args['table_jobs']))
+        g_table_jobs_executor = concurrent.futures.ThreadPoolExecutor(max_workers=args['table_jobs'], thread_name_prefix="table_job")
+    return g_table_jobs_executor
+
+
+def get_table_job_result(table_name, job):
+    # the g_exec_buf entry returned by dump_table() in the --table_jobs pool - None if nothing to insert
+    try:
+        return job.result()
+    except Exception as e:
+        if table_name in azm_db_constants.IGNORE_ERROR_TABLES:
+            print("WARNING: ignoring error: {} for table: {}".format(e, table_name))
+            return None
+        raise e
+
+
+def resolve_table_jobs(args):
+    # replace the dump_table() futures in g_exec_buf with their results - keeping the table order
+    exec_buf = []
+    for buf in g_exec_buf:
+        if isinstance(buf, concurrent.futures.Future):
+            buf = get_table_job_result(g_table_jobs.pop(buf), buf)
+            if buf is None:
+                continue
+        exec_buf.append(buf)
+    g_exec_buf[:] = exec_buf
+
+
+def append_exec_buf_copy(args, table_name, buf):
+    # buf: COPY/bulk insert g_exec_buf entry of dump_table() or the --table_jobs future of it
+    global g_copy_queue, g_copy_thread
+    if g_copy_conn is None:
+        if isinstance(buf, concurrent.futures.Future):
+            g_table_jobs[buf] = table_name
+        g_exec_buf.append(buf)
+        return
+    if g_copy_exception is not None:
+        raise Exception("ABORT: --pg_pipeline_copy COPY failed: {}".format(g_copy_exception))
+    if g_copy_thread is None:
+        g_copy_queue = queue.Queue()
+        g_copy_thread = threading.Thread(target=copy_pipeline_thread_func, args=(args,), name="copy_pipeline", daemon=True)
+        g_copy_thread.start()
+    g_copy_queue.put((table_name, buf))
+
+
+def copy_pipeline_thread_func(args):
+    global g_copy_exception
+    while True:
+        item = g_copy_queue.get()
+        if item is None:
+            break
+        if g_copy_exception is not None:
+            continue  # azm failed - skip the rest
+        table_name, buf = item
+        try:
+            if isinstance(buf, concurrent.futures.Future):
+                buf = get_table_job_result(table_name, buf)
+                if buf is None:
+                    continue
+            copy_sql, dump_fp = buf
+            exec_pg_copy(args, g_copy_cursor, copy_sql, dump_fp)
+            print("# done pipeline copy: {}".format(copy_sql))
+        except Exception as e:
+            type_, value_, traceback_ = sys.exc_info()
+            exstr = str(traceback.format_exception(type_, value_, traceback_))
+            print("WARNING: --pg_pipeline_copy COPY failed for table: {} exception: {}".format(table_name, exstr))
+            g_copy_exception = e
+
+
+def stop_copy_pipeline(abort_exception=None):
+    # wait until all queued COPYs are done (or skipped if abort_exception) - raises the first COPY failure if not aborting
+    global g_copy_queue, g_copy_thread, g_copy_exception
+    if g_copy_thread is not None:
+        if abort_exception is not None and g_copy_exception is None:
+            g_copy_exception = abort_exception
+        if g_table_jobs_executor is not None and abort_exception is not None:
+            g_table_jobs_executor.shutdown(wait=False, cancel_futures=True)
+        g_copy_queue.put(None)
+        g_copy_thread.join()
+    g_copy_queue = None
+    g_copy_thread = None
+    copy_exception = g_copy_exception
+    g_copy_exception = None
+    if copy_exception is not None and abort_exception is None:
+        raise copy_exception
+
+
+def exec_pg_copy(args, cursor, copy_sql, dump_fp):
+    start_time = datetime.datetime.now()
+    if isinstance(dump_fp, azm_sqlite_reader.SelectStream):
+        # --pg_stream_copy: rows come directly from azqdata.db - no csv file
+        try:
+            cursor.copy_expert(copy_sql, dump_fp, size=PG_STREAM_COPY_READ_SIZE)
+        finally:
+            dump_fp.close()
+    else:
+        with open(dump_fp, "rb") as dump_fp_fo:
+            cursor.copy_expert(copy_sql, dump_fp_fo)
+    append_table_operation_stats(args, copy_sql.split('"')[1], "copy duration:", (datetime.datetime.now() - start_time).total_seconds())
+
+
+def adj_csv_line(csv_line):
+    if g_is_postgre:
+        csv_line = csv_line.replace(',NaT',',')
+    return find_and_conv_spatialite_blob_to_wkb(csv_line)
+
+
+def adj_csv_chunk(csv_chunk):
+    # same ',NaT' replace as adj_csv_line() but on a whole bytes chunk of csv lines from azm_sqlite_reader
+    if g_is_postgre:
+        csv_chunk = csv_chunk.replace(b',NaT', b',')
+    return csv_chunk
+
+
+def conv_geom_col_vals_to_wkb_hex(vals):
+    # azm_sqlite_reader col_funcs for 'geom' - batch version of find_and_conv_spatialite_blob_to_wkb()
+    if g_is_postgre:
+        return azm_geom_conv.conv_spatialite_point_blobs_to_hex(vals, azm_geom_conv.PG_EWKB_POINT_HEADER)
+    return azm_geom_conv.conv_spatialite_point_blobs_to_hex(vals, azm_geom_conv.MS_GEOGRAPHY_POINT_HEADER)
 
-    
-    return True
 
 def find_and_conv_spatialite_blob_to_wkb(csv_line):
     #print "fac csv_line:", csv_line
@@ -654,6 +1132,7 @@ def create(args, line):
     global g_is_ms, g_is_postgre
     global g_unmerge_logs_row
     global g_remote_columns_not_in_local
+    global g_schema_cache_hit
 
     g_prev_create_statement_column_names = None
 
@@ -695,8 +1174,7 @@ def create(args, line):
         start_dt_str = str(g_unmerge_logs_row['log_start_time'])[:-3] 
         end_dt_str = str(g_unmerge_logs_row['log_end_time'])[:-3]
         """
-        sqlstr = "delete from \""+table_name+"\" where \"log_hash\" = {}".format(g_unmerge_logs_row['log_hash'])
-        g_exec_buf.append(sqlstr)
+        g_exec_buf.extend(gen_log_delete_sqls(args, table_name, g_unmerge_logs_row['log_hash']))
         
         return True
     
@@ -745,8 +1223,19 @@ def create(args, line):
     g_prev_create_statement_column_names = str(local_column_names).replace("'","").replace("[","(").replace("]",")")
     
     remote_column_names = None
+    schema_cache_hit = False
+
+    if g_schema_cache_key is not None and ((not args['dump_parquet']) or (table_name == "logs")):
+        cached_remote_column_names = azm_schema_cache.get_remote_column_names(g_schema_cache_key, table_name)
+        if cached_remote_column_names is not None and set(local_column_names).issubset(cached_remote_column_names):
+            print("schema cache hit for table: {} - skip create/alter checks".format(table_name))
+            schema_cache_hit = True
+            g_schema_cache_hit = True
+            remote_column_names = cached_remote_column_names
+            if g_is_ms:
+                g_remote_columns_not_in_local[table_name] = [[x] for x in remote_column_names if x not in local_column_names]
 
-    if (not args['dump_parquet']) or (table_name == "logs"):
+    if ((not args['dump_parquet']) or (table_name == "logs")) and not schema_cache_hit:
         try:
             #dprint("create sqlstr: "+sqlstr)
 
@@ -761,17 +1250,7 @@ def create(args, line):
                         # ok - partition this table
                         sqlstr = sqlstr.replace(";","") +" PARTITION BY RANGE (time);"
                         try:
-                            with g_conn:
-                                g_cursor.execute("SELECT schema_name FROM information_schema.schemata WHERE schema_name = '{}';".format(schema_per_month_name))
-                                if bool(g_cursor.rowcount):
-                                    print("schema_per_month_name already exists:", schema_per_month_name)
-                                    pass
-                                else:
-                                    print("cre schema now because: NOT schema_per_month_name already exists:", schema_per_month_name)
-                                    c_table_per_month_sql = "create schema {};".format(schema_per_month_name)
-                                    ret = g_cursor.execute(c_table_per_month_sql)
-                                    g_conn.commit()
-                                    print("success: create per_month ["+c_table_per_month_sql+"] success")
+                            create_per_month_schema_if_not_exists(args, schema_per_month_name)
                         except:
                             type_, value_, traceback_ = sys.exc_info()
                             exstr = str(traceback.format_exception(type_, value_, traceback_))
@@ -787,20 +1266,11 @@ def create(args, line):
                 #dprint("create sqlstr mod mssql geom: "+sqlstr)
                 pass
 
-            if g_is_postgre:
-                with g_conn:
-                    #too slow and high cpu: g_cursor.execute("select * from information_schema.tables where table_schema=%s and table_name=%s", (args["pg_schema"],table_name,))
-                    g_cursor.execute("""
-                    SELECT FROM pg_catalog.pg_class c
-                        JOIN   pg_catalog.pg_namespace n ON n.oid = c.relnamespace
-                        WHERE  n.nspname = %s
-                        AND    c.relname = %s
-                        AND    c.relkind = 'r'""" , (args["pg_schema"],table_name,))
-                    if bool(g_cursor.rowcount):
-                        print("omit create already existing 'logs' table - raise exception to check columns instead")
-                        raise Exception("table {} already exists - no need to create".format(table_name))
-                    else:
-                        print("table not exists")
+            if get_remote_catalog_columns(args, table_name) is not None:
+                print("omit create already existing table - raise exception to check columns instead")
+                raise Exception("table {} already exists - no need to create".format(table_name))
+            else:
+                print("table not exists")
 
             ret = None
             # use with for auto rollback() on g_conn on expected fails like already exists
@@ -816,6 +1286,7 @@ def create(args, line):
             - table was not existing earlier - so remote cols must be the same
             """
             remote_column_names = local_column_names
+            g_remote_catalog[table_name] = [list(col) for col in local_columns]
 
         except Exception as e:
             emsg = str(e)
@@ -895,8 +1366,8 @@ def create(args, line):
                         print("execute alter_str: " + sqlstr)
                         exec_creatept_or_alter_handle_concurrency(sqlstr)
 
-                        # re-get remote cols
-                        remote_columns = get_remote_columns(args, table_name)
+                        # re-get remote cols - also updates g_remote_catalog
+                        remote_columns = get_remote_columns(args, table_name, refresh=True)
                         remote_column_names = get_col_names(remote_columns)
                         print(("get_remote_columns after alter: "+str(remote_column_names)))
                 else:
@@ -905,7 +1376,11 @@ def create(args, line):
             else:
                 raise Exception("FATAL: create table error - : \nemsg:\n "+emsg+" \nsqlstr:\n"+sqlstr)
 
-    if g_is_ms:
+    # put in cache at commit() - also for hits so a failed azm can invalidate it at close()
+    if g_schema_cache_key is not None and remote_column_names is not None:
+        g_schema_cache_new_tables[table_name] = remote_column_names
+
+    if g_is_ms and not schema_cache_hit:
         try:
             with g_conn:
                 print("ms create index start")
@@ -920,7 +1395,6 @@ def create(args, line):
                 print("WARNING: ms create index exception:", e)
 
 
-    local_col_name_to_type_dict = {}
 
     if g_bulk_insert_mode:
 
@@ -930,262 +1404,274 @@ def create(args, line):
                 pass
             else:                
                 
-                ##  check/create partitions for month for log_hash, prev month, after month                
-                ori_log_hash_datetime = args['ori_log_hash_datetime']
-                months_pt_check_list = [ori_log_hash_datetime+relativedelta(months=-1), ori_log_hash_datetime, ori_log_hash_datetime+relativedelta(months=+1)]
-                
-                for pre_post_month_log_hash_datetime in months_pt_check_list:
-                    log_hash_ym_str = pre_post_month_log_hash_datetime.strftime('%Y_%m')
-                    #print  "log_hash_datetime:", log_hash_datetime
+                ##  check/create month partitions of the months that can have rows of this log
+                for month_datetime in get_log_data_months(args['log_start_time'], args['log_end_time']):
+                    create_month_partition_if_not_exists(args, table_name, month_datetime)
+                if args['pg10_partition_by_log_hash']:
+                    # only for the months this table really has rows of this log in - no empty partitions left for unmerge to find
+                    for month_datetime in get_table_data_months(args, table_name):
+                        create_log_partition_if_not_exists(args, table_name, month_datetime, args['log_hash'])
+
+        if g_is_ms and table_name not in g_remote_columns_not_in_local:
+            g_remote_columns_not_in_local[table_name] = []
+
+        if get_table_jobs_executor(args) is not None:
+            # --table_jobs: dump/convert this table in the pool while the create/alter of the next tables continue here in order
+            exec_buf_entry = g_table_jobs_executor.submit(dump_table, args, table_name, local_columns, local_column_names, local_column_dict, remote_column_names)
+        else:
+            exec_buf_entry = dump_table(args, table_name, local_columns, local_column_names, local_column_dict, remote_column_names)
+        if exec_buf_entry is not None:
+            append_exec_buf_copy(args, table_name, exec_buf_entry)
 
-                    ntn = "logs_{}".format(log_hash_ym_str) # simpler name because we got cases where schema's table name got truncated: activate_dedicated_eps_bearer_context_request_params_3170932708
-                    pltn = "{}.{}".format(schema_per_month_name, ntn)
-                    per_month_table_already_exists = False
-                    with g_conn:
-                        # too slow and high cpu check_sql = "select * from information_schema.tables where table_schema='{}' and table_name='{}'".format(schema_per_month_name, ntn)
-                        check_sql = """SELECT FROM pg_catalog.pg_class c
-                        JOIN   pg_catalog.pg_namespace n ON n.oid = c.relnamespace
-                        WHERE  n.nspname = '{}'
-                        AND    c.relname = '{}'
-                        AND    c.relkind = 'r'""".format(schema_per_month_name, ntn)   
-                        print("check_sql partition of table exists or not:", check_sql)
-                        g_cursor.execute(check_sql)
-                        if bool(g_cursor.rowcount):
-                            per_month_table_already_exists = True
-
-                    if per_month_table_already_exists:
-                        print("omit create already existing per_month table:", pltn)
-                        pass
-                    else:
-                        print("NOT omit create already existing per_month table:", pltn)
-                        cre_target_pt_sql = "CREATE TABLE {} PARTITION OF {} FOR VALUES from ('{}-1') to ('{}-1');".format(
-                            pltn,
-                            table_name,
-                            pre_post_month_log_hash_datetime.strftime("%Y-%m"),
-                            (pre_post_month_log_hash_datetime+relativedelta(months=+1)).strftime("%Y-%m")
-                        )
-                        if args['pg10_partition_index_log_hash']:
-                            cre_index_for_pt_sql = "CREATE INDEX ON {} (log_hash);".format(pltn)
-                            cre_target_pt_sql += " "+cre_index_for_pt_sql
-                            
-                        print(("cre_target_pt_sql:", cre_target_pt_sql))                        
-                        exec_creatept_or_alter_handle_concurrency(cre_target_pt_sql, allow_exstr_list=[" already exists"])
-
-        ###### let sqlite3 dump contents of table into file
-        
-        table_dump_fp = os.path.join(g_dir_processing_azm, table_name + ".csv")
-        table_dump_format_fp = os.path.join(g_dir_processing_azm, table_name + ".fmt")
-        
-        #print("table_dump_fp: "+table_dump_fp)
-        #print("table_dump_format_fp: "+table_dump_format_fp)
+    return True
 
-        # create dump csv of that table            
-        """ 
-        example dump of logs table:
-        sqlite3 azqdata.db -list -newline "|" -separator "," ".out c:\\azq\\azq_report_gen\\azm_db_merge\\logs.csv" "select * from logs"
-        """
 
-        # get col list, and hex(col) for blob coulumns
+def dump_table(args, table_name, local_columns, local_column_names, local_column_dict, remote_column_names):
+    """
+    dump rows of table_name from azqdata.db (and convert to parquet in --dump_parquet mode)
+    returns the g_exec_buf entry to bulk insert the dump in commit() - or None if nothing to insert
+    
+    only reads args/globals (no target db access) so it can run in the --table_jobs pool
+    """
+    local_col_name_to_type_dict = {}
 
-        i = 0
-        col_select = ""
-        first = True
-        #dprint("local_columns: "+str(local_columns))
-        for col in local_columns:
-            col_name = col[0]
-            col_type = col[1]
-            local_col_name_to_type_dict[col_name] = col_type
-            if first:
-                first = False
-            else:
-                col_select = col_select + ","
-                
-            pre = " "
-            post = ""
-            if col_type == "geometry" or (g_is_postgre and col_type == "bytea") or (g_is_ms and col_type.startswith("varbinary")):
-                pre = " nullif(hex("
-                post = "),'')"
-                if col_name == "geom":
-                    pass
-                    #geom_col_index = i
+    ###### let sqlite3 dump contents of table into file
+    
+    table_dump_fp = os.path.join(g_dir_processing_azm, table_name + ".csv")
+    table_dump_format_fp = os.path.join(g_dir_processing_azm, table_name + ".fmt")
+    
+    #print("table_dump_fp: "+table_dump_fp)
+    #print("table_dump_format_fp: "+table_dump_format_fp)
 
-            ############## wrong data format fixes
-            
-            ### custom limit bsic len in case matched wrongly entered bsic to long str but pg takes max 5 char len for bsic
-            if col_name == "modem_time":
-                # handle invalid modem_time case: 159841018-03-10 07:24:42.191
-                col_name = "strftime('%Y-%m-%d %H:%M:%f', modem_time) as modem_time"
-            elif g_is_ms and (col_type.lower() == "timestamp" or col_type.lower() == "datetime"): #name == "time" or col_name.endswith("_datetime") or col_name.endswith("_date") or col_name.endswith("_time"):
-                col_name = f"strftime('%Y-%m-%d %H:%M:%f', {col_name}) as {col_name}"
-            elif col_name == "gsm_bsic":
-                col_name = "substr(gsm_bsic, 0, 6) as gsm_bsic"  # limit to 5 char len (6 is last index excluding)
-            elif col_name == "android_cellid_from_cellfile":
-                col_name = "cast(android_cellid_from_cellfile as int) as android_cellid_from_cellfile"  # type cast required to remove non-int in cellfile data
-            elif col_name.endswith("duration") or col_name.endswith("time"):                
-                # many _duration cols in detected_radion_voice_call_session and in pp_ tables have wrong types or even has right type but values came as "" so would be ,"" in csv which postgres and pyarrow wont allow for double/float/numeric cols - check by col_name only is faster than nullif() on all numericols - as most cases are these _duration cols only
-                col_name = "nullif({},'') as {}".format(col_name, col_name)
-            elif table_name == "nr_cell_meas":
-                # special table handling
-                if "int" in col_type.lower():
-                    print("nr_cell_meas cast to int:  col_name {} col_type {}".format(col_name, col_type))
-                    pre = "cast("
-                    post = " as int)"
-                elif "double" in col_type.lower():
-                    print("nr_cell_meas cast to double:  col_name {} col_type {}".format(col_name, col_type))
-                    pre = "cast("
-                    post = " as double)"
-            
-            col_select += pre + col_name + post
-            i = i + 1
-        
+    # create dump csv of that table            
+    """ 
+    example dump of logs table:
+    sqlite3 azqdata.db -list -newline "|" -separator "," ".out c:\\azq\\azq_report_gen\\azm_db_merge\\logs.csv" "select * from logs"
+    """
 
-                
-        if g_is_ms:
-            if table_name not in g_remote_columns_not_in_local:
-                g_remote_columns_not_in_local[table_name] = []
-            if len(g_remote_columns_not_in_local[table_name]):
-                col_select += ", "
-                col_select += ", ".join([f" NULL as {x[0]} " for x in g_remote_columns_not_in_local[table_name]])
-            print("ms col_select: " + col_select)
-            if ", gsm_band," in col_select:   # customer db for gsm_band expects int
-                col_select = col_select.replace(", gsm_band,", ", substr(gsm_band, 4) as gsm_band,")
-            ret = call(
-                [
-                args['sqlite3_executable'],
-                args['file'],
-                "-ascii",
-                "-list",            
-                '-separator', azm_db_constants.BULK_INSERT_COL_SEPARATOR_VALUE,
-                '-newline', azm_db_constants.BULK_INSERT_LINE_SEPARATOR_VALUE,
-                '.out ' + '"' +table_dump_fp.replace("\\","\\\\") + '"', # double backslash because it needs to go inside sqlite3 cmd parsing again      
-                'select '+col_select+' from '+ table_name + ' where time is not null'
-                ], shell = False
-            )
+    # get col list, and hex(col) for blob coulumns
 
-        if g_is_postgre:
-            select_sqlstr = 'select '+col_select+' from '+ table_name
+    # with azm_sqlite_reader: geom blobs are converted to wkb per batch of rows (col_funcs) while dumping - no separate adj csv pass
+    # parquet mode tables (except 'logs') convert the spatialite geom themselves
+    adj_in_reader = azm_sqlite_reader.is_open() and ((not args['dump_parquet']) or (table_name == "logs"))
+    # parquet mode tables (except 'logs') are read by azm_sqlite_reader directly into arrow - no csv dump
+    parquet_from_reader = azm_sqlite_reader.is_open() and args['dump_parquet'] and table_name != "logs"
 
-            # filter all tables but not the main logs table
-            if table_name != "logs":
-                pass
-                select_sqlstr += " where time >= '{}' and time <= '{}'".format(args['log_data_min_time'], args['log_data_max_time'])
-                
-            #print "select_sqlstr:", select_sqlstr
+    i = 0
+    col_select = ""
+    col_exprs = []
+    arrow_col_exprs = []  # parquet_from_reader: same as col_exprs but with the raw geom blobs instead of their hex
+    reader_col_funcs = {}
+    first = True
+    #dprint("local_columns: "+str(local_columns))
+    for col in local_columns:
+        col_name = col[0]
+        col_type = col[1]
+        local_col_name_to_type_dict[col_name] = col_type
+        if first:
+            first = False
+        else:
+            col_select = col_select + ","
             
-            dump_cmd = [
-                args['sqlite3_executable'],
-                args['file'],
-                "-ascii",
-                "-csv",
-                '-separator',',',
-                '-newline', '\n',
-                '.out ' + '"' +table_dump_fp.replace("\\","\\\\") + '"',  # double backslash because it needs to go inside sqlite3 cmd parsing again
-                select_sqlstr
-                ]
-            #dprint("dump_cmd:", dump_cmd)
-
-            # if parquet dump mode do only logs table dump to track already imported
-            start_time = datetime.datetime.now()
-            if True:#(not args['dump_parquet']) or parquet_arrow_mode or table_name == "logs":
-                ret = call(
-                    dump_cmd,
-                    shell=False
-                )
-            #print("dump_cmd:", dump_cmd)
-            #print "dump_cmd ret:", ret
-            append_table_operation_stats(args, table_name, "dump_csv duration:", (datetime.datetime.now() - start_time).total_seconds())
-
-        table_dump_fp_ori = table_dump_fp
-        pqfp = table_dump_fp_ori.replace(".csv","_{}.parquet".format(args['log_hash']))
-        table_dump_fp_adj = table_dump_fp + "_adj.csv"        
+        pre = " "
+        post = ""
+        if col_type == "geometry" or (g_is_postgre and col_type == "bytea") or (g_is_ms and col_type.startswith("varbinary")):
+            pre = " nullif(hex("
+            post = "),'')"
+            if col_name == "geom":
+                pass
+                #geom_col_index = i
 
-        geom_format_in_csv_is_wkb = False
-        # in parquet mode we are modifying geom anyway so assume geom is spatialite format instead of wkb
+        ############## wrong data format fixes
+        col_expr = col_name
         
-        if (not args['dump_parquet']) or (table_name == "logs"):           
-            geom_format_in_csv_is_wkb = True            
-            start_time = datetime.datetime.now()
-            with open(table_dump_fp,"rb") as of:
-                with open(table_dump_fp_adj,"w") as nf:  # wb required for windows so that \n is 0x0A - otherwise \n will be 0x0D 0x0A and doest go with our fmt file and only 1 row will be inserted per table csv in bulk inserts...
-                    while True:
-                        ofl = of.readline().decode()
+        ### custom limit bsic len in case matched wrongly entered bsic to long str but pg takes max 5 char len for bsic
+        if col_name == "modem_time":
+            # handle invalid modem_time case: 159841018-03-10 07:24:42.191
+            col_expr = "strftime('%Y-%m-%d %H:%M:%f', modem_time)"
+        elif g_is_ms and (col_type.lower() == "timestamp" or col_type.lower() == "datetime"): #name == "time" or col_name.endswith("_datetime") or col_name.endswith("_date") or col_name.endswith("_time"):
+            col_expr = f"strftime('%Y-%m-%d %H:%M:%f', {col_name})"
+        elif col_name == "gsm_bsic":
+            col_expr = "substr(gsm_bsic, 0, 6)"  # limit to 5 char len (6 is last index excluding)
+        elif col_name == "android_cellid_from_cellfile":
+            col_expr = "cast(android_cellid_from_cellfile as int)"  # type cast required to remove non-int in cellfile data
+        elif col_name.endswith("duration") or col_name.endswith("time"):                
+            # many _duration cols in detected_radion_voice_call_session and in pp_ tables have wrong types or even has right type but values came as "" so would be ,"" in csv which postgres and pyarrow wont allow for double/float/numeric cols - check by col_name only is faster than nullif() on all numericols - as most cases are these _duration cols only
+            col_expr = "nullif({},'')".format(col_name)
+        elif table_name == "nr_cell_meas":
+            # special table handling
+            if "int" in col_type.lower():
+                print("nr_cell_meas cast to int:  col_name {} col_type {}".format(col_name, col_type))
+                pre = "cast("
+                post = " as int)"
+            elif "double" in col_type.lower():
+                print("nr_cell_meas cast to double:  col_name {} col_type {}".format(col_name, col_type))
+                pre = "cast("
+                post = " as double)"
+        
+        col_select += pre + col_expr + post
+        if col_expr != col_name:
+            col_select += " as " + col_name
+        # same cols for the in-process reader which needs them as separate exprs (without 'as' aliases)
+        if adj_in_reader and col_type == "geometry":
+            col_exprs.append(" " + col_expr)
+            reader_col_funcs[i] = conv_geom_col_vals_to_wkb_hex
+        else:
+            col_exprs.append(pre + col_expr + post)
+        arrow_col_exprs.append(col_expr if col_type == "geometry" else pre + col_expr + post)
+        i = i + 1
+    
 
-                        ''' this causes python test_browse_performance_timing.py to fail as its json got changed
-                        if g_is_postgre:
-                            ofl = ofl.replace(',""',',')  # keep this legacy code for postgres mode code jus to be sure, although we already did nullif checks during sqlite csv dunp...
-                        '''
+            
+    if g_is_ms:
+        if len(g_remote_columns_not_in_local[table_name]):
+            col_select += ", "
+            col_select += ", ".join([f" NULL as {x[0]} " for x in g_remote_columns_not_in_local[table_name]])
+            col_exprs += ["NULL" for x in g_remote_columns_not_in_local[table_name]]
+        print("ms col_select: " + col_select)
+        if ", gsm_band," in col_select:   # customer db for gsm_band expects int
+            col_select = col_select.replace(", gsm_band,", ", substr(gsm_band, 4) as gsm_band,")
+            col_exprs = [" substr(gsm_band, 4)" if (x == " gsm_band" and 0 < j < len(col_exprs) - 1) else x for j, x in enumerate(col_exprs)]
+    if g_is_ms and azm_sqlite_reader.is_open():
+        ret = azm_sqlite_reader.dump_select_to_file(
+            col_exprs,
+            'from ' + table_name + ' where time is not null',
+            table_dump_fp,
+            azm_db_constants.BULK_INSERT_COL_SEPARATOR_VALUE,
+            azm_db_constants.BULK_INSERT_LINE_SEPARATOR_VALUE,
+            csv_mode=False,
+            col_funcs=reader_col_funcs,
+            chunk_func=adj_csv_chunk
+        )
+    elif g_is_ms:
+        ret = call(
+            [
+            args['sqlite3_executable'],
+            args['file'],
+            "-ascii",
+            "-list",            
+            '-separator', azm_db_constants.BULK_INSERT_COL_SEPARATOR_VALUE,
+            '-newline', azm_db_constants.BULK_INSERT_LINE_SEPARATOR_VALUE,
+            '.out ' + '"' +table_dump_fp.replace("\\","\\\\") + '"', # double backslash because it needs to go inside sqlite3 cmd parsing again      
+            'select '+col_select+' from '+ table_name + ' where time is not null'
+            ], shell = False
+        )
+
+    # --pg_stream_copy: no csv dump here - the COPY in commit() reads directly from azqdata.db
+    stream_copy = g_is_postgre and args['pg_stream_copy'] and azm_sqlite_reader.is_open() and not args['dump_parquet']
 
-                        """ no need to check this, only old stale thread versions would have these cases and will have other cases too so let it crash in all those cases
-                        if ofl.strip() == all_cols_null_line:
-                            continue
-                        """
-                        if g_is_postgre:
-                            ofl = ofl.replace(',NaT',',')
+    if g_is_postgre:
+        from_sqlstr = 'from '+ table_name
 
-                        ofl = find_and_conv_spatialite_blob_to_wkb(ofl)
+        # filter all tables but not the main logs table
+        if table_name != "logs":
+            pass
+            from_sqlstr += " where time >= '{}' and time <= '{}'".format(args['log_data_min_time'], args['log_data_max_time'])
+            if args['dump_parquet'] and args['parquet_hive_layout']:
+                # rows sorted by time in the parquet file so readers can skip row groups/pages by the time statistics - sqlite sorts in its temp store, not in our memory
+                from_sqlstr += " order by time"
+        select_sqlstr = 'select '+col_select+' '+from_sqlstr
+            
+        #print "select_sqlstr:", select_sqlstr
+        
+        dump_cmd = [
+            args['sqlite3_executable'],
+            args['file'],
+            "-ascii",
+            "-csv",
+            '-separator',',',
+            '-newline', '\n',
+            '.out ' + '"' +table_dump_fp.replace("\\","\\\\") + '"',  # double backslash because it needs to go inside sqlite3 cmd parsing again
+            select_sqlstr
+            ]
+        #dprint("dump_cmd:", dump_cmd)
+
+        # if parquet dump mode do only logs table dump to track already imported
+        start_time = datetime.datetime.now()
+        if stream_copy or parquet_from_reader:
+            ret = 0
+        elif azm_sqlite_reader.is_open():
+            ret = azm_sqlite_reader.dump_select_to_file(col_exprs, from_sqlstr, table_dump_fp, ",", "\n", csv_mode=True, col_funcs=reader_col_funcs, chunk_func=adj_csv_chunk)
+        else:
+            ret = call(
+                dump_cmd,
+                shell=False
+            )
+        #print("dump_cmd:", dump_cmd)
+        #print "dump_cmd ret:", ret
+        append_table_operation_stats(args, table_name, "dump_csv duration:", (datetime.datetime.now() - start_time).total_seconds())
+
+    table_dump_fp_ori = table_dump_fp
+    pqfp = table_dump_fp_ori.replace(".csv","_{}.parquet".format(args['log_hash']))
+    if args['dump_parquet'] and args['parquet_hive_layout']:
+        partition_dir = azm_parquet_dataset.get_partition_dir(get_parquet_staging_dir(), table_name, azm_parquet_dataset.get_month_str(args['log_hash_ym_str']))
+        os.makedirs(partition_dir, exist_ok=True)
+        pqfp = os.path.join(partition_dir, azm_parquet_dataset.get_log_file_name(table_name, args['log_hash']))
+    table_dump_fp_adj = table_dump_fp + "_adj.csv"        
+
+    geom_format_in_csv_is_wkb = False
+    # in parquet mode we are modifying geom anyway so assume geom is spatialite format instead of wkb
+    
+    if adj_in_reader:
+        # geom already converted to wkb and ',NaT' replaced by azm_sqlite_reader col_funcs/chunk_func
+        geom_format_in_csv_is_wkb = True
+    elif (not args['dump_parquet']) or (table_name == "logs"):           
+        geom_format_in_csv_is_wkb = True            
+        start_time = datetime.datetime.now()
+        with open(table_dump_fp,"rb") as of:
+            with open(table_dump_fp_adj,"w") as nf:  # wb required for windows so that \n is 0x0A - otherwise \n will be 0x0D 0x0A and doest go with our fmt file and only 1 row will be inserted per table csv in bulk inserts...
+                while True:
+                    ofl = of.readline().decode()
+
+                    ''' this causes python test_browse_performance_timing.py to fail as its json got changed
+                    if g_is_postgre:
+                        ofl = ofl.replace(',""',',')  # keep this legacy code for postgres mode code jus to be sure, although we already did nullif checks during sqlite csv dunp...
+                    '''
+
+                    """ no need to check this, only old stale thread versions would have these cases and will have other cases too so let it crash in all those cases
+                    if ofl.strip() == all_cols_null_line:
+                        continue
+                    """
+                    ofl = adj_csv_line(ofl)
 
-                        if ofl == "":
-                            break
+                    if ofl == "":
+                        break
 
-                        nf.write(ofl)
+                    nf.write(ofl)
 
-            table_dump_fp = table_dump_fp_adj
-            append_table_operation_stats(args, table_name, """find_and_conv_spatialite_blob_to_wkb, replace ,"" with , total file duration:""", (datetime.datetime.now() - start_time).total_seconds())
+        table_dump_fp = table_dump_fp_adj
+        append_table_operation_stats(args, table_name, """find_and_conv_spatialite_blob_to_wkb, replace ,"" with , total file duration:""", (datetime.datetime.now() - start_time).total_seconds())
 
 
 
-        #dprint("dump table: "+table_name+" for bulk insert ret: "+str(ret))
+    #dprint("dump table: "+table_name+" for bulk insert ret: "+str(ret))
+    
+    if (ret != 0):
+        print("WARNING: dump table: "+table_name+" for bulk insert failed - likely sqlite db file error like: database disk image is malformed. In many cases, data is still correct/complete so continue.")
         
-        if (ret != 0):
-            print("WARNING: dump table: "+table_name+" for bulk insert failed - likely sqlite db file error like: database disk image is malformed. In many cases, data is still correct/complete so continue.")
-            
-            
-        if (os.stat(table_dump_fp).st_size == 0):
-            print("this table is empty...")
-            return True
         
-        # if control reaches here then the table is not empty
-                
-        ################## read csv to arrow, set types, dump to parqet - return True, but if log_table dont return - let it enter pg too...
-        # yes, arrow read from csv, convert to pd to mod datetime col and add lat lon is faster than pd.read_sql() and converting fields and to parquet
-        if args['dump_parquet']:
-            #print "local_column_names:", local_column_names
-            if table_name == "nr_deb_stat":
-                if "nr_rlc_ul_tp_kbps" in local_column_dict:
-                    local_column_dict["nr_rlc_ul_tp_kbps"] = 'float'
-                if "nr_rlc_dl_tp_kbps" in local_column_dict:
-                    local_column_dict["nr_rlc_dl_tp_kbps"] = 'float'
-            pa_column_types = local_column_dict.copy()
-            for col in list(pa_column_types.keys()):
-                sqlite_col_type = pa_column_types[col].lower()
-                if sqlite_col_type in list(pa_type_replace_dict.keys()):
-                    pa_column_types[col] = pa_type_replace_dict[sqlite_col_type]
-                elif sqlite_col_type.startswith("varchar"):
-                    pa_column_types[col] = "string"
-
-                # special cases
-                if is_datetime_col(col):
-                    # because pyarrow is somehow not taking vals like this so use strings first: In CSV column #0: CSV conversion error to timestamp[ms]: invalid value '2018-07-24 09:59:48.218'
-                    pa_column_types[col] = pa.string()
-                elif col.endswith("duration"):
-                    pa_column_types[col] = pa.float64()
-                elif col.endswith("session_master_session_id"):
-                    pa_column_types[col] = pa.string()  # some old db invalid type cases
-                elif pa_column_types[col] == "test":
-                    pa_column_types[col] = pa.string()
-                elif col == "exynos_basic_info_nr_cellid":
-                    pa_column_types[col] = pa.uint64()
-                elif col in ["lte_m_tmsi", "lte_mmec"]:
-                    pa_column_types[col] = pa.int64()
-                    
+    if (not stream_copy) and (not parquet_from_reader) and (os.stat(table_dump_fp).st_size == 0):
+        print("this table is empty...")
+        return None
+    
+    # if control reaches here then the table is not empty
             
-            # adj types for pa
-            print("local_column_dict:", local_column_dict)
-            start_time = datetime.datetime.now()
+    ################## read table (or csv) to arrow, set types, dump to parqet - return True, but if log_table dont return - let it enter pg too...
+    # yes, arrow read directly from azm_sqlite_reader (or from the sqlite3 executable csv dump) and arrow compute conversions is faster than pd.read_sql() and converting fields and to parquet
+    if args['dump_parquet']:
+        pa_column_types = get_parquet_column_types(table_name, local_column_dict)
+        print("local_column_dict:", local_column_dict)
+        if parquet_from_reader:
+            print("read table into pa with azm_sqlite_reader:", table_name)
+            batches = azm_sqlite_reader.iter_select_record_batches(
+                # '' as null for string cols like null_values=[""] of the csv read below
+                ["nullif({},'')".format(col_expr) if pa_column_types[col] == pa.string() else col_expr for col, col_expr in zip(local_column_names, arrow_col_exprs)],
+                from_sqlstr,
+                pa.schema([pa.field(col, pa_column_types[col]) for col in local_column_names])
+            )
+        else:
             print("read csv into pa:", table_dump_fp)
-            #print("pa_column_types:", pa_column_types)
-            #print("local_column_names:", local_column_names)
-            padf = csv.read_csv(
+            batches = csv.open_csv(
                 table_dump_fp,
                 read_options=csv.ReadOptions(
                     column_names=local_column_names,
@@ -1200,228 +1686,113 @@ def create(args, line):
                     null_values=[""],
                     strings_can_be_null=True,
                 )
-                
             )
-            append_table_operation_stats(args, table_name, "padf read_csv duration:", (datetime.datetime.now() - start_time).total_seconds())
-            
-            start_time = datetime.datetime.now()
-            
-            cur_schema = padf.schema
-            field_indexes_need_pd_datetime = []
-            fields_need_pd_datetime = []
-            field_index_to_drop = []
-            has_geom_field = False            
-            geom_field_index = None
-            field_index = -1
-            signalling_symbol_column_index = None
-            for field in cur_schema:
-                field_index += 1
-                if field.name == "time_ms":
-                    field_index_to_drop.append(field_index)
-                    continue
-
-                if table_name == "signalling" and field.name == "symbol":
-                    signalling_symbol_column_index = field_index
-
-                # check if has geom
-                if field.name == "geom":
-                    has_geom_field = True
-                    geom_field_index = field_index
-
-                # change type of field in new schema to timestamp if required
-                if is_datetime_col(field.name):
-                    fields_need_pd_datetime.append(pa.field(field.name, pa.timestamp('ns')))
-                    field_indexes_need_pd_datetime.append(field_index)
-
-            ##### special mods for each table
-            if table_name == "signalling":
-                # create int column 'direction' for faster queries instead of the string 'symbol' column
-                assert signalling_symbol_column_index is not None
-                symbol_sr = padf.column(signalling_symbol_column_index).to_pandas().astype(str, copy=False)
-                direction_sr = pd.Series(np.zeros(len(symbol_sr), dtype=np.uint8))
-                uplink_mask = symbol_sr == "send"
-                direction_sr.loc[uplink_mask] = 1
-                #print "direction_sr.dtype", direction_sr.dtype
-                padf = padf.append_column(
-                    # org.apache.spark.sql.AnalysisException: Parquet type not supported: INT32 (UINT_8);
-                    # org.apache.spark.sql.AnalysisException: Parquet type not supported: INT32 (UINT_16);
-                    # so had to use uint32
-                    pa.field("direction", pa.uint32()),
-                    pa.Array.from_pandas(direction_sr.astype(np.uint32))
-                )
-                
-                #print "symbol_sr:", symbol_sr
-                #print "direction_sr:", direction_sr
-
-
-            # conv datetime fields with pandas then assign back to padf - do this before adding lat lon as index would change...
-            for i in range(len(fields_need_pd_datetime)):                
-                index = field_indexes_need_pd_datetime[i]
-                field = fields_need_pd_datetime[i]
-                print("converting field index {} name {} to datetime...".format(index, field))
-                # convert
-                converted_sr = pd.to_datetime(padf.column(index).to_pandas(), errors='coerce')
-                #print "converted_sr head:", converted_sr.head()
-                # assign it back
-                # print "padf.schema:\n", padf.schema
-                padf = padf.set_column(index, field, pa.Array.from_pandas(converted_sr))
-
-
-            if has_geom_field:                
-                # use pandas to decode geom from hex to binary, then extract lat, lon from wkb
-                geom_sr = padf.column(geom_field_index).to_pandas()
-                geom_sr_null_mask = pd.isnull(geom_sr)
-                geom_sr = geom_sr.str.decode('ascii')
-                geom_sr = geom_sr.fillna("")
-                #print("ori geom_sr:", geom_sr)
-                
-                if not geom_format_in_csv_is_wkb:
-                    print("geom in csv is in spatialite format - convert to wkb first...")
-                    spatialite_geom_sr = geom_sr
-                    class_type = "01000020E6100000"
-                    endian = "01"  # spatialite_geom_sr.str.slice(start=2, stop=4)
-                    point =  spatialite_geom_sr.str.slice(start=86, stop=118)   # 86 + 16 + 16                    
-                    geom_sr = endian + class_type + point  # wkb
-                    
-                
-                geom_sr = geom_sr.str.decode("hex")
-                geom_sr[geom_sr_null_mask] = None
-                #print('wkb geom_sr.head():', geom_sr.head())
-                lon_sr = geom_sr.apply(lambda x: None if (pd.isnull(x) or len(x) != WKB_POINT_LAT_LON_BYTES_LEN) else np.frombuffer(x[9:9+8], dtype=np.float64)).astype(np.float64)  # X                                
-                lat_sr = geom_sr.apply(lambda x: None if (pd.isnull(x) or len(x) != WKB_POINT_LAT_LON_BYTES_LEN) else np.frombuffer(x[9+8:9+8+8], dtype=np.float64)).astype(np.float64)  # Y
-                #print('lon_sr', lon_sr.head())
-                #print('lat_sr', lat_sr.head())
-                
-                ##### assign all three back to padf
-                ## replace geom with newly converted to binary geom_sr
-                geom_sr_len = len(geom_sr)
-                pa_array = None
-                if pd.isnull(geom_sr).all():
-                    print("geom_sr null all case")
-                    pa_array = pa.array(geom_sr.values.tolist()+[b'']).slice(0, geom_sr_len)  # convert tolist() and add [""] then slice() back to ori len required to avoid pyarrow.lib.ArrowInvalid: Field type did not match data type - see azq_report_gen/test_spark_wkb_exception.py
-                else:
-                    print("not geom_sr null all case")
-                    pa_array = pa.array(geom_sr)
-                assert pa_array is not None
-                padf = padf.set_column(geom_field_index, pa.field("geom", "binary"), pa_array)
-
-                ## insert lat, lon
-                padf = padf.add_column(geom_field_index+1, pa.field("lat", pa.float64()), pa.Array.from_pandas(lat_sr))
-                padf = padf.add_column(geom_field_index+2, pa.field("lon", pa.float64()), pa.Array.from_pandas(lon_sr))
-
-            # finally drop 'time_ms' legacy column used long ago in mysql where it didnt have milliseconds - not used anymore
-            for drop_index in field_index_to_drop:
-                padf = padf.remove_column(drop_index)            
-                
-            #print "padf.schema:\n", padf.schema
-            append_table_operation_stats(args, table_name, "padf processing and conversion with pd duration:", (datetime.datetime.now() - start_time).total_seconds())
-            
-            print("padf len:", len(padf))
-
-            start_time = datetime.datetime.now()
-
-            # use snappy and use_dictionary - https://wesmckinney.com/blog/python-parquet-multithreading/
-            pq.write_table(padf, pqfp, flavor='spark', compression=PARQUET_COMPRESSION, use_dictionary=True)
-            
-            assert os.path.isfile(pqfp)
-            pq_fsz = os.stat(pqfp).st_size
-            print("pq_fsz:", pq_fsz)
-            assert pq_fsz
-            append_table_operation_stats(args, table_name, "pq.write_table duration:", (datetime.datetime.now() - start_time).total_seconds())
-            print("wrote pqfp:", pqfp)
-            
-            # if log_table dont return - let it enter pg too...
-            if table_name == "logs":
-                pass  # import logs table to pg too
-            else:
-                return True
+        n_rows = write_parquet_batches(
+            args,
+            table_name,
+            batches,
+            pqfp,
+            geom_is_hex=not parquet_from_reader,
+            geom_is_wkb=geom_format_in_csv_is_wkb
+        )
+        if n_rows == 0:
+            print("this table is empty...")
+            return None
+        print("wrote pqfp:", pqfp)
+        
+        # if log_table dont return - let it enter pg too...
+        if table_name == "logs":
+            pass  # import logs table to pg too
+        else:
+            return None
 
 
-        if args['target_db_type'] == 'mssql':
-            # create fmt format file for that table
-            """        
-            generate format file:
-            https://msdn.microsoft.com/en-us/library/ms178129.aspx
+    if args['target_db_type'] == 'mssql':
+        # create fmt format file for that table
+        """        
+        generate format file:
+        https://msdn.microsoft.com/en-us/library/ms178129.aspx
 
-            format file contents:
-            https://msdn.microsoft.com/en-us/library/ms191479(v=sql.110).aspx                
-            """
+        format file contents:
+        https://msdn.microsoft.com/en-us/library/ms191479(v=sql.110).aspx                
+        """
 
-            ms_fmt_cols = list(local_column_names+[x[0] for x in g_remote_columns_not_in_local[table_name]])
-            n_local_cols = len(ms_fmt_cols)
-
-            fmt = open(table_dump_format_fp,"w")
-            fmt.write("11.0\n") # ver - 11.0 = SQL Server 2012
-            fmt.write(str(n_local_cols)+"\n") # n cols
-
-            host_field_order = 0 # dyn gen - first inc wil get it to 1
-            host_file_data_type = "SQLCHAR"
-            prefix_length = 0
-            host_file_data_length = 0 # When a delimited text file having a prefix length of 0 and a terminator is imported, the field-length value is ignored, because the storage space used by the field equals the length of the data plus the terminator
-            terminator = None # dyn gen
-            server_col_order = None # dyn gen
-            server_col_name = None # dyn gen
-            col_coalition = ""
-
-            for col in ms_fmt_cols:
-                host_field_order = host_field_order + 1
-                if (n_local_cols == host_field_order): #last
-                    terminator = azm_db_constants.BULK_INSERT_LINE_SEPARATOR_PARAM
-                else:
-                    terminator = azm_db_constants.BULK_INSERT_COL_SEPARATOR_PARAM
-                if not table_name.startswith("wifi_scanned"):
-                    #dprint("remote_column_names: "+str(remote_column_names))
-                    pass
-                #dprint("col: "+str(col))
-                server_col_order = remote_column_names.index(col) + 1 # not 0 based
-                server_col_name = col # always same col name
-                fmt.write(
-                        '{}\t{}\t{}\t{}\t"{}"\t{}\t"{}"\t"{}"\n'.format(
-                            host_field_order,
-                            host_file_data_type,
-                            prefix_length,
-                            host_file_data_length,
-                            terminator,
-                            server_col_order,
-                            server_col_name,
-                            col_coalition
-                            )
+        ms_fmt_cols = list(local_column_names+[x[0] for x in g_remote_columns_not_in_local[table_name]])
+        n_local_cols = len(ms_fmt_cols)
+
+        fmt = open(table_dump_format_fp,"w")
+        fmt.write("11.0\n") # ver - 11.0 = SQL Server 2012
+        fmt.write(str(n_local_cols)+"\n") # n cols
+
+        host_field_order = 0 # dyn gen - first inc wil get it to 1
+        host_file_data_type = "SQLCHAR"
+        prefix_length = 0
+        host_file_data_length = 0 # When a delimited text file having a prefix length of 0 and a terminator is imported, the field-length value is ignored, because the storage space used by the field equals the length of the data plus the terminator
+        terminator = None # dyn gen
+        server_col_order = None # dyn gen
+        server_col_name = None # dyn gen
+        col_coalition = ""
+
+        for col in ms_fmt_cols:
+            host_field_order = host_field_order + 1
+            if (n_local_cols == host_field_order): #last
+                terminator = azm_db_constants.BULK_INSERT_LINE_SEPARATOR_PARAM
+            else:
+                terminator = azm_db_constants.BULK_INSERT_COL_SEPARATOR_PARAM
+            if not table_name.startswith("wifi_scanned"):
+                #dprint("remote_column_names: "+str(remote_column_names))
+                pass
+            #dprint("col: "+str(col))
+            server_col_order = remote_column_names.index(col) + 1 # not 0 based
+            server_col_name = col # always same col name
+            fmt.write(
+                    '{}\t{}\t{}\t{}\t"{}"\t{}\t"{}"\t"{}"\n'.format(
+                        host_field_order,
+                        host_file_data_type,
+                        prefix_length,
+                        host_file_data_length,
+                        terminator,
+                        server_col_order,
+                        server_col_name,
+                        col_coalition
                         )
-            fmt.flush()
-            fmt.close()
-        
-        # both dump csv and format fmt files are ready        
-        # execute bulk insert sql now
+                    )
+        fmt.flush()
+        fmt.close()
+    
+    # both dump csv and format fmt files are ready        
+    # execute bulk insert sql now
 
-        if g_is_ms:
-            sqlstr = "bulk insert \"{}\" from '{}' with ( formatfile = '{}' );".format(
-                table_name,
-                table_dump_fp,
-                table_dump_format_fp
-            )
-            g_exec_buf.append((sqlstr, table_dump_fp, table_dump_format_fp))
-            return True
+    if g_is_ms:
+        sqlstr = "bulk insert \"{}\" from '{}' with ( formatfile = '{}' );".format(
+            table_name,
+            table_dump_fp,
+            table_dump_format_fp
+        )
+        return (sqlstr, table_dump_fp, table_dump_format_fp)
 
-        if g_is_postgre:
-            colnames = ""
-            first = True
-            for col in local_column_names:
-                if not first:
-                    colnames = colnames + ","
-                if first:
-                    first = False
-                colnames = colnames + '"' + col + '"'
-                
-            sqlstr = "copy \"{}\" ({}) from STDIN with (format csv, NULL '')".format(
-                table_name,
-                colnames               
-            )
-        
-        #dprint("START bulk insert sqlstr: "+sqlstr)
-        g_exec_buf.append((sqlstr, table_dump_fp))
-        # print("DONE bulk insert - nrows inserted: "+str(ret.rowcount))
+    if g_is_postgre:
+        colnames = ""
+        first = True
+        for col in local_column_names:
+            if not first:
+                colnames = colnames + ","
+            if first:
+                first = False
+            colnames = colnames + '"' + col + '"'
+            
+        sqlstr = "copy \"{}\" ({}) from STDIN with (format csv, NULL '')".format(
+            table_name,
+            colnames               
+        )
     
-    return True
+    if stream_copy:
+        table_dump_fp = azm_sqlite_reader.SelectStream(col_exprs, from_sqlstr, ",", "\n", csv_mode=True, col_funcs=reader_col_funcs, chunk_func=adj_csv_chunk)
+
+    #dprint("START bulk insert sqlstr: "+sqlstr)
+    return (sqlstr, table_dump_fp)
+    # print("DONE bulk insert - nrows inserted: "+str(ret.rowcount))
+
 
 
 ### below are functions not used by azq_db_merge
@@ -1483,9 +1854,55 @@ def get_col_names(cols):
     return ret
 
 
-def get_remote_columns(args, table_name):
+def load_remote_catalog(args):
+    global g_remote_catalog
+
+    # cols of all tables (and partitioned parent tables) of the target schema in one query instead of one probe per table
+    if g_is_postgre:
+        sqlstr = """SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_catalog.pg_attribute a
+        JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = '{}'
+        AND c.relkind in ('r', 'p')
+        AND a.attnum > 0
+        AND NOT a.attisdropped
+        ORDER BY c.relname, a.attnum""".format(args["pg_schema"])
+    if g_is_ms:
+        sqlstr = """SELECT t.name, c.name, ty.name
+        FROM sys.columns c
+        JOIN sys.tables t ON t.object_id = c.object_id
+        JOIN sys.types ty ON ty.user_type_id = c.user_type_id
+        WHERE t.schema_id = SCHEMA_ID('dbo')
+        ORDER BY t.name, c.column_id"""
+    start_time = datetime.datetime.now()
+    with g_conn:
+        g_cursor.execute(sqlstr)
+        rows = g_cursor.fetchall()
+    remote_catalog = {}
+    for row in rows:
+        remote_catalog.setdefault(row[0], []).append([row[1], row[2]])
+    g_remote_catalog = remote_catalog
+    print("load_remote_catalog: {} tables {} columns in {} seconds".format(len(remote_catalog), len(rows), (datetime.datetime.now() - start_time).total_seconds()))
+    return remote_catalog
+
+
+def get_remote_catalog_columns(args, table_name):
+    # [[col_name, col_type], ...] of table_name in g_remote_catalog or None if it is not there
+    if g_remote_catalog is None:
+        load_remote_catalog(args)
+    return g_remote_catalog.get(table_name)
+
+
+def get_remote_columns(args, table_name, refresh=False):
     global g_cursor
     global g_is_ms, g_is_postgre
+
+    if not refresh:
+        remote_columns = get_remote_catalog_columns(args, table_name)
+        if remote_columns is not None:
+            return [list(col) for col in remote_columns]
+        # table created by another process after the catalog was loaded - probe it below
     
     #dprint("table_name: "+table_name)
     sqlstr = ""
@@ -1509,6 +1926,8 @@ def get_remote_columns(args, table_name):
         colnames = [desc[0] for desc in g_cursor.description]
         for col in colnames:
             remote_columns.append([col,""])
+        if g_remote_catalog is not None:
+            g_remote_catalog[table_name] = [list(col) for col in remote_columns]
         return remote_columns
 
     if g_is_ms:
@@ -1532,9 +1951,272 @@ def get_remote_columns(args, table_name):
             #dprint("col_type: "+col_type)
             remote_columns.append([col_name,col_type])
 
+        if g_remote_catalog is not None:
+            g_remote_catalog[table_name] = [list(col) for col in remote_columns]
         return remote_columns
 
 
+def load_remote_partitions(args):
+    global g_remote_per_month_schemas, g_remote_partitions, g_remote_log_hash_partitioned
+    start_time = datetime.datetime.now()
+    with g_conn:
+        g_cursor.execute("""SELECT n.nspname, c.relname, c.relkind
+        FROM pg_catalog.pg_namespace n
+        LEFT JOIN pg_catalog.pg_class c ON c.relnamespace = n.oid AND c.relkind in ('r', 'p')
+        WHERE n.nspname LIKE 'per\\_month\\_%'""")
+        rows = g_cursor.fetchall()
+    g_remote_per_month_schemas = set([row[0] for row in rows])
+    g_remote_partitions = set(["{}.{}".format(row[0], row[1]) for row in rows if row[1] is not None])
+    # the only partitioned tables in the per_month schemas are the month partitions of --pg10_partition_by_log_hash
+    g_remote_log_hash_partitioned = set(["{}.{}".format(row[0], row[1]) for row in rows if row[1] is not None and row[2] == 'p'])
+    print("load_remote_partitions: {} per_month schemas {} partitions in {} seconds".format(len(g_remote_per_month_schemas), len(g_remote_partitions), (datetime.datetime.now() - start_time).total_seconds()))
+
+
+def gen_log_delete_sqls(args, table_name, log_hash, reimport=False):
+    # sqls to remove the rows of log_hash from table_name for --unmerge (or --reimport)
+    sqls = []
+    if g_is_postgre and args['pg10_partition_by_month'] and table_name != "logs":
+        # --pg10_partition_by_log_hash partitions of this log: drop them instead of deleting their rows - no dead tuples to vacuum
+        # - or truncate them for --reimport as the new rows are copied into them in the same transaction
+        for month_datetime in get_log_data_months(args['log_start_time'], args['log_end_time']):
+            log_partition_name = get_log_partition_name(get_month_partition_name(table_name, month_datetime), log_hash)
+            if log_partition_name in get_remote_partitions(args):
+                sqls.append(("TRUNCATE {};" if reimport else "DROP TABLE IF EXISTS {};").format(log_partition_name))
+    # still needed for the month partitions not partitioned by log_hash (created before --pg10_partition_by_log_hash) and
+    # unpartitioned tables - the log_hash partitions of the other logs are pruned from this delete
+    sqls.append("delete from \""+table_name+"\" where \"log_hash\" = {}".format(log_hash))
+    return sqls
+
+
+def get_remote_partitions(args):
+    if g_remote_partitions is None:
+        load_remote_partitions(args)
+    return g_remote_partitions
+
+
+def get_log_data_months(log_start_time, log_end_time):
+    # first days (datetimes) of the months that can have rows of a log: imported rows are within LOG_DATA_TIME_MARGIN of its
+    # start/end time - the month set of both the partition create at import and the partition drop/delete at unmerge
+    return get_months_between(log_start_time - LOG_DATA_TIME_MARGIN, log_end_time + LOG_DATA_TIME_MARGIN)
+
+
+def get_months_between(first_time, last_time):
+    # first days (datetimes) of the months from the month of first_time to the month of last_time
+    month = first_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    months = []
+    while month <= last_time:
+        months.append(month)
+        month += relativedelta(months=+1)
+    return months
+
+
+def get_table_data_months(args, table_name):
+    # months of get_log_data_months() that table_name really has rows of this log in - from the time of its imported rows in azqdata.db
+    sqlstr = "select substr(min(time), 1, 7), substr(max(time), 1, 7) from \"{}\" where time >= '{}' and time <= '{}'".format(
+        table_name, args['log_data_min_time'], args['log_data_max_time'])
+    if azm_sqlite_reader.is_open():
+        result = azm_sqlite_reader.get_sql_result(sqlstr)
+    else:
+        result = check_output([args['sqlite3_executable'], args['file'], sqlstr]).decode().strip()
+    first_month_str, last_month_str = result.split("|")
+    if not first_month_str:
+        # no rows
+        return []
+    return get_months_between(datetime.datetime.strptime(first_month_str, "%Y-%m"), datetime.datetime.strptime(last_month_str, "%Y-%m"))
+
+
+def get_month_partition_name(table_name, month_datetime):
+    ntn = "logs_{}".format(month_datetime.strftime('%Y_%m')) # simpler name because we got cases where schema's table name got truncated: activate_dedicated_eps_bearer_context_request_params_3170932708
+    return "per_month_{}.{}".format(table_name, ntn)
+
+
+def get_log_partition_name(month_partition_name, log_hash):
+    # --pg10_partition_by_log_hash partition of log_hash in month_partition_name (same per_month schema) - log_hash is a
+    # signed int64: 'n' instead of '-' for negative ones as the unquoted name can't have a '-'
+    log_hash = int(log_hash)
+    if log_hash < 0:
+        return "{}_n{}".format(month_partition_name, -log_hash)
+    return "{}_{}".format(month_partition_name, log_hash)
+
+
+def create_per_month_schema_if_not_exists(args, schema_per_month_name):
+    if g_remote_per_month_schemas is None:
+        load_remote_partitions(args)
+    if schema_per_month_name in g_remote_per_month_schemas:
+        print("schema_per_month_name already exists:", schema_per_month_name)
+        return
+    print("cre schema now because: NOT schema_per_month_name already exists:", schema_per_month_name)
+    c_table_per_month_sql = "create schema if not exists {};".format(schema_per_month_name)
+    with g_conn:
+        g_cursor.execute(c_table_per_month_sql)
+    print("success: create per_month ["+c_table_per_month_sql+"] success")
+    g_remote_per_month_schemas.add(schema_per_month_name)
+
+
+def create_month_partition_if_not_exists(args, table_name, month_datetime):
+    pltn = get_month_partition_name(table_name, month_datetime)
+    if pltn in get_remote_partitions(args):
+        print("omit create already existing per_month table:", pltn)
+        return
+    print("NOT omit create already existing per_month table:", pltn)
+    cre_target_pt_sql = "CREATE TABLE {} PARTITION OF {} FOR VALUES from ('{}-1') to ('{}-1');".format(
+        pltn,
+        table_name,
+        month_datetime.strftime("%Y-%m"),
+        (month_datetime+relativedelta(months=+1)).strftime("%Y-%m")
+    )
+    if args['pg10_partition_by_log_hash']:
+        # each log gets its own partition of this month partition (create_log_partition_if_not_exists) - a log_hash index is not needed
+        cre_target_pt_sql = cre_target_pt_sql.replace(";", " PARTITION BY LIST (log_hash);")
+    elif args['pg10_partition_index_log_hash']:
+        cre_index_for_pt_sql = "CREATE INDEX ON {} (log_hash);".format(pltn)
+        cre_target_pt_sql += " "+cre_index_for_pt_sql
+        
+    print(("cre_target_pt_sql:", cre_target_pt_sql))                        
+    exec_creatept_or_alter_handle_concurrency(cre_target_pt_sql, allow_exstr_list=[" already exists"])
+    g_remote_partitions.add(pltn)
+    if args['pg10_partition_by_log_hash']:
+        g_remote_log_hash_partitioned.add(pltn)
+
+
+def create_log_partition_if_not_exists(args, table_name, month_datetime, log_hash):
+    """
+    --pg10_partition_by_log_hash: create the partition of log_hash in the month partition of table_name so unmerge can
+    drop it instead of deleting its rows. month partitions created before --pg10_partition_by_log_hash are not
+    partitioned: the rows of the log go there (and are deleted by unmerge) like before.
+    """
+    pltn = get_month_partition_name(table_name, month_datetime)
+    if pltn not in g_remote_log_hash_partitioned:
+        print("WARNING: month partition {} is not partitioned by log_hash - rows of this log would be deleted instead of dropped at unmerge".format(pltn))
+        return False
+    log_pltn = get_log_partition_name(pltn, log_hash)
+    if log_pltn in g_remote_partitions:
+        # a previous import of this log failed before its commit
+        print("omit create already existing log_hash partition:", log_pltn)
+        return True
+    cre_log_pt_sql = "CREATE TABLE {} PARTITION OF {} FOR VALUES IN ({});".format(log_pltn, pltn, int(log_hash))
+    print(("cre_log_pt_sql:", cre_log_pt_sql))
+    exec_creatept_or_alter_handle_concurrency(cre_log_pt_sql, allow_exstr_list=[" already exists"])
+    g_remote_partitions.add(log_pltn)
+    return True
+
+
+def get_remote_partitioned_table_names(args):
+    # names of the partitioned (--pg10_partition_by_month) parent tables of the target schema
+    with g_conn:
+        g_cursor.execute("""SELECT c.relname
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s
+        AND c.relkind = 'p'
+        ORDER BY c.relname""", (args["pg_schema"],))
+        return [row[0] for row in g_cursor.fetchall()]
+
+
+def provision_partitions(args, months):
+    """
+    --pg10_provision_partitions: create the per_month schema and month partitions of the given months (datetimes)
+    for all partitioned tables already in the target schema - ahead of a batch so the imports only need the set lookups
+    """
+    if args["pg_schema"] != "public":
+        g_cursor.execute("SET search_path = '{}','public';".format(args["pg_schema"]))
+    table_names = get_remote_partitioned_table_names(args)
+    print("provision_partitions: {} partitioned tables for months: {}".format(len(table_names), [month.strftime('%Y_%m') for month in months]))
+    load_remote_partitions(args)
+    n_partitions_before = len(g_remote_partitions)
+    for table_name in table_names:
+        create_per_month_schema_if_not_exists(args, "per_month_{}".format(table_name))
+        for month in months:
+            create_month_partition_if_not_exists(args, table_name, month)
+    print("provision_partitions: created {} partitions".format(len(g_remote_partitions) - n_partitions_before))
+    return True
+
+
+def unmerge_log_hashes(args, log_hashes):
+    """
+    --unmerge_log_hashes: delete all rows of the logs of log_hashes from all tables with a log_hash col - without their azm files.
+
+    partitioned tables: the deletes go directly to the month partitions that can have rows of each log (from its
+    log_start_time/log_end_time in the logs table) so postgres doesn't scan (or lock) the partitions of other months -
+    and the --pg10_partition_by_log_hash partitions of the logs are dropped instead.
+    all deletes (and the logs table rows last) are in one transaction - a failure leaves the logs fully merged.
+    returns True if all given log_hashes were found and unmerged.
+    """
+    if g_is_postgre and args["pg_schema"] != "public":
+        g_cursor.execute("SET search_path = '{}','public';".format(args["pg_schema"]))
+
+    # the log_hash vals are ints (from parse_log_hashes) so they are safe to format into the mssql sql
+    if g_is_postgre:
+        logs_sqlstr = "select \"log_hash\", \"log_start_time\", \"log_end_time\" from \"logs\" where \"log_hash\" = ANY(%s)"
+        logs_params = (list(log_hashes),)
+    else:
+        logs_sqlstr = "select \"log_hash\", \"log_start_time\", \"log_end_time\" from \"logs\" where \"log_hash\" in ({})".format(",".join(str(int(log_hash)) for log_hash in log_hashes))
+        logs_params = None
+    with g_conn:
+        if logs_params is None:
+            g_cursor.execute(logs_sqlstr)
+        else:
+            g_cursor.execute(logs_sqlstr, logs_params)
+        rows = g_cursor.fetchall()
+    found_log_hashes = [row[0] for row in rows]
+    missing_log_hashes = [log_hash for log_hash in log_hashes if log_hash not in found_log_hashes]
+    if missing_log_hashes:
+        print("WARNING: unmerge_log_hashes: {} log_hashes not in the logs table - skip: {}".format(len(missing_log_hashes), missing_log_hashes))
+    if not found_log_hashes:
+        print("unmerge_log_hashes: nothing to unmerge")
+        return not missing_log_hashes
+
+    # month (datetime of its first day) -> log_hashes that can have rows in that month - same months as their import created partitions for
+    month_log_hashes = {}
+    for log_hash, log_start_time, log_end_time in rows:
+        for month_datetime in get_log_data_months(log_start_time, log_end_time):
+            month_log_hashes.setdefault(month_datetime, []).append(log_hash)
+
+    remote_catalog = load_remote_catalog(args)
+    table_names = sorted(
+        table_name for table_name, cols in remote_catalog.items()
+        if table_name != "logs" and "log_hash" in [col[0] for col in cols]
+    )
+    partitioned_table_names = set()
+    if g_is_postgre and args['pg10_partition_by_month']:
+        partitioned_table_names = set(get_remote_partitioned_table_names(args))
+        load_remote_partitions(args)
+
+    # (sqlstr, log_hashes) of each delete - or drop of the --pg10_partition_by_log_hash partitions (log_hashes None)
+    deletes = []
+    for table_name in table_names:
+        if table_name in partitioned_table_names:
+            for month_datetime, month_hashes in sorted(month_log_hashes.items()):
+                pltn = get_month_partition_name(table_name, month_datetime)
+                if pltn in g_remote_log_hash_partitioned:
+                    for log_hash in month_hashes:
+                        log_pltn = get_log_partition_name(pltn, log_hash)
+                        if log_pltn in g_remote_partitions:
+                            deletes.append(("DROP TABLE IF EXISTS {}".format(log_pltn), None))
+                elif pltn in g_remote_partitions:
+                    deletes.append(("delete from {} where \"log_hash\" = ANY(%s)".format(pltn), month_hashes))
+        else:
+            deletes.append(("delete from \"{}\" where \"log_hash\" = ANY(%s)".format(table_name), found_log_hashes))
+    deletes.append(("delete from \"logs\" where \"log_hash\" = ANY(%s)", found_log_hashes))
+    print("unmerge_log_hashes: {} log_hashes {} tables ({} partitioned) {} months - {} deletes".format(
+        len(found_log_hashes), len(table_names), len(partitioned_table_names & set(table_names)), len(month_log_hashes), len(deletes)))
+
+    start_time = datetime.datetime.now()
+    n_rows = 0
+    with g_conn:
+        for sqlstr, delete_log_hashes in deletes:
+            if delete_log_hashes is None:
+                g_cursor.execute(sqlstr)
+            elif g_is_postgre:
+                g_cursor.execute(sqlstr, (list(delete_log_hashes),))
+            else:
+                g_cursor.execute(sqlstr.replace("= ANY(%s)", "in ({})".format(",".join(str(int(log_hash)) for log_hash in delete_log_hashes))))
+            print("unmerge_log_hashes: {} rows: {}".format(g_cursor.rowcount, sqlstr))
+            n_rows += max(g_cursor.rowcount, 0)
+    print("unmerge_log_hashes: deleted {} rows of {} logs in {} seconds".format(n_rows, len(found_log_hashes), (datetime.datetime.now() - start_time).total_seconds()))
+    return not missing_log_hashes
+
+
 def exec_creatept_or_alter_handle_concurrency(sqlstr, raise_exception_if_fail=True, allow_exstr_list=[]):
     global g_conn
     global g_cursor
@@ -1552,6 +2234,8 @@ def exec_creatept_or_alter_handle_concurrency(sqlstr, raise_exception_if_fail=Tr
             # use with for auto rollback() on g_conn on expected fails like already exists
             with g_conn as con:
                 print(("exec_creatept_or_alter_handle_concurrency retry {} sqlstr: {}".format(retry, sqlstr)))
+                if g_copy_conn is not None:
+                    g_cursor.execute("SET LOCAL lock_timeout = '{}';".format(PG_PIPELINE_COPY_DDL_LOCK_TIMEOUT))
                 execret = g_cursor.execute(sqlstr)
                 print(("exec_creatept_or_alter_handle_concurrency retry {} sqlstr: {} execret: {}".format(retry, sqlstr, execret)))
 
@@ -1589,6 +2273,251 @@ def is_datetime_col(col):
     return col.endswith("time") and (not col.endswith("trip_time")) and (not col.endswith("_interruption_time"))
 
 
+def conv_parquet_table(table_name, padf, geom_is_hex, geom_is_wkb):
+    # conversions of each batch (as a pa.Table) of a --dump_parquet table before it is written - returns the converted pa.Table
+    cur_schema = padf.schema
+    field_indexes_need_datetime = []
+    fields_need_datetime = []
+    geom_field_index = None
+    signalling_symbol_column_index = None
+    for field_index, field in enumerate(cur_schema):
+        if field.name == "time_ms":
+            continue
+
+        if table_name == "signalling" and field.name == "symbol":
+            signalling_symbol_column_index = field_index
+
+        # check if has geom
+        if field.name == "geom":
+            geom_field_index = field_index
+
+        # change type of field in new schema to timestamp if required
+        if is_datetime_col(field.name):
+            fields_need_datetime.append(pa.field(field.name, pa.timestamp('ns')))
+            field_indexes_need_datetime.append(field_index)
+
+    ##### special mods for each table
+    if table_name == "signalling":
+        # create int column 'direction' for faster queries instead of the string 'symbol' column
+        assert signalling_symbol_column_index is not None
+        # 1 for uplink ('send' symbol), 0 for all others (and null symbols)
+        uplink_mask = pc.fill_null(pc.equal(padf.column(signalling_symbol_column_index), "send"), False)
+        padf = padf.append_column(
+            # org.apache.spark.sql.AnalysisException: Parquet type not supported: INT32 (UINT_8);
+            # org.apache.spark.sql.AnalysisException: Parquet type not supported: INT32 (UINT_16);
+            # so had to use uint32
+            pa.field("direction", pa.uint32()),
+            pc.cast(uplink_mask, pa.uint32())
+        )
+
+    # conv datetime fields with arrow compute then assign back to padf - do this before adding lat lon as index would change...
+    for index, field in zip(field_indexes_need_datetime, fields_need_datetime):
+        padf = padf.set_column(index, field, conv_datetime_strs_to_timestamp_ns(padf.column(index)))
+
+    if geom_field_index is not None:
+        # geom is the spatialite blob (or the wkb if geom_is_wkb) - or the hex of it in csv - decode to wkb and extract lat, lon from it
+        wkb_array, lat_array, lon_array = azm_geom_conv.conv_geom_arrow_array_to_wkb_lat_lon(
+            padf.column(geom_field_index),
+            geom_is_hex=geom_is_hex,
+            geom_is_wkb=geom_is_wkb
+        )
+        padf = padf.set_column(geom_field_index, pa.field("geom", "binary"), wkb_array)
+
+        ## insert lat, lon
+        padf = padf.add_column(geom_field_index+1, pa.field("lat", pa.float64()), lat_array)
+        padf = padf.add_column(geom_field_index+2, pa.field("lon", pa.float64()), lon_array)
+
+    # finally drop 'time_ms' legacy column used long ago in mysql where it didnt have milliseconds - not used anymore
+    if "time_ms" in padf.column_names:
+        padf = padf.drop_columns(["time_ms"])
+    return padf
+
+
+def write_parquet_batches(args, table_name, batches, pqfp, geom_is_hex, geom_is_wkb):
+    """
+    convert (conv_parquet_table()) and write the arrow RecordBatches of a --dump_parquet table to pqfp
+    with a pq.ParquetWriter - one row group per --parquet_row_group_size rows so only about that many
+    rows are in memory at once instead of the whole table. returns the number of rows written (0: no file written).
+    """
+    row_group_size = args['parquet_row_group_size']
+    writer = None
+    n_rows = 0
+    pending_tables = []
+    n_pending_rows = 0
+    read_duration = 0.0
+    conv_duration = 0.0
+    write_duration = 0.0
+    min_time = None
+    max_time = None
+
+    def write_pending(final):
+        # write full row groups of the pending rows - the remainder stays pending unless final
+        nonlocal writer, pending_tables, n_pending_rows, write_duration
+        start_time = datetime.datetime.now()
+        pending = pa.concat_tables(pending_tables)
+        n_write_rows = len(pending) if final else (len(pending) // row_group_size) * row_group_size
+        if writer is None:
+            # use snappy and use_dictionary - https://wesmckinney.com/blog/python-parquet-multithreading/
+            writer_kwargs = {}
+            if args['parquet_hive_layout']:
+                writer_kwargs['write_statistics'] = True
+                writer_kwargs['write_page_index'] = True
+                writer_kwargs.update(azm_parquet_dataset.TIMESTAMP_WRITER_KWARGS)
+                if table_name != "logs" and "time" in pending.column_names:
+                    # rows are from 'order by time' - see dump_table()
+                    writer_kwargs['sorting_columns'] = [pq.SortingColumn(pending.schema.get_field_index("time"))]
+            writer_kwargs.update(get_parquet_writer_kwargs(args['parquet_profile'], pending.schema))
+            writer = pq.ParquetWriter(pqfp, pending.schema, flavor='spark', **writer_kwargs)
+        writer.write_table(pending.slice(0, n_write_rows), row_group_size=row_group_size)
+        pending_tables = [pending.slice(n_write_rows)] if n_write_rows < len(pending) else []
+        n_pending_rows = len(pending) - n_write_rows
+        write_duration += (datetime.datetime.now() - start_time).total_seconds()
+
+    try:
+        batches = iter(batches)
+        while True:
+            start_time = datetime.datetime.now()
+            batch = next(batches, None)
+            read_duration += (datetime.datetime.now() - start_time).total_seconds()
+            if batch is None:
+                break
+            if batch.num_rows == 0:
+                continue
+            start_time = datetime.datetime.now()
+            padf = conv_parquet_table(table_name, pa.Table.from_batches([batch]), geom_is_hex, geom_is_wkb)
+            if table_name != "logs" and "time" in padf.column_names:
+                # for the manifest
+                time_min_max = pc.min_max(padf.column("time"))
+                if time_min_max["min"].is_valid:
+                    min_time = time_min_max["min"] if min_time is None or pc.less(time_min_max["min"], min_time).as_py() else min_time
+                    max_time = time_min_max["max"] if max_time is None or pc.greater(time_min_max["max"], max_time).as_py() else max_time
+            pending_tables.append(padf)
+            conv_duration += (datetime.datetime.now() - start_time).total_seconds()
+            n_pending_rows += batch.num_rows
+            n_rows += batch.num_rows
+            if n_pending_rows >= row_group_size:
+                write_pending(final=False)
+        if n_pending_rows:
+            write_pending(final=True)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    append_table_operation_stats(args, table_name, "padf read duration:", read_duration)
+    append_table_operation_stats(args, table_name, "padf processing and conversion duration:", conv_duration)
+    append_table_operation_stats(args, table_name, "pq write duration:", write_duration)
+    print("padf len:", n_rows)
+    if n_rows:
+        pq_fsz = os.stat(pqfp).st_size
+        print("pq_fsz:", pq_fsz)
+        assert pq_fsz
+        if args['parquet_object_store']:
+            # upload while the next tables are dumped - the manifest is only put after all uploads are done in commit()
+            get_parquet_object_store(args)
+            azm_object_store.submit_upload(pqfp, get_parquet_rel_path(args, pqfp))
+        with g_parquet_files_lock:
+            g_parquet_files[pqfp] = {
+                'table': table_name,
+                'num_rows': n_rows,
+                'size_bytes': pq_fsz,
+                'min_time': None if min_time is None else pc.strftime(min_time, format="%Y-%m-%d %H:%M:%S").as_py(),
+                'max_time': None if max_time is None else pc.strftime(max_time, format="%Y-%m-%d %H:%M:%S").as_py(),
+            }
+    return n_rows
+
+
+def get_parquet_column_kind(pa_type):
+    if pa.types.is_floating(pa_type):
+        return 'float'
+    if pa.types.is_integer(pa_type):
+        return 'int'
+    if pa.types.is_string(pa_type) or pa.types.is_large_string(pa_type):
+        return 'string'
+    if pa.types.is_timestamp(pa_type):
+        return 'timestamp'
+    if pa.types.is_boolean(pa_type):
+        return 'bool'
+    return 'binary'
+
+
+def get_parquet_writer_kwargs(profile_name, schema):
+    # pq.ParquetWriter() compression/encoding kwargs of the --parquet_profile for the cols of schema
+    profile = PARQUET_PROFILES[profile_name]
+    kinds = {field.name: get_parquet_column_kind(field.type) for field in schema}
+    kwargs = {
+        'compression': profile['compression'],
+        'use_dictionary': [name for name, kind in kinds.items() if kind in profile['dictionary']],
+    }
+    if profile['compression_level'] is not None:
+        kwargs['compression_level'] = profile['compression_level']
+    if profile['byte_stream_split']:
+        kwargs['use_byte_stream_split'] = [name for name, kind in kinds.items() if kind in profile['byte_stream_split']]
+    if profile['data_page_size'] is not None:
+        kwargs['data_page_size'] = profile['data_page_size']
+    return kwargs
+
+
+def get_parquet_column_types(table_name, local_column_dict):
+    # col_name -> arrow type of the --dump_parquet table from the declared sqlite col types (and known wrongly declared cols)
+    local_column_dict = local_column_dict.copy()
+    if table_name == "nr_deb_stat":
+        if "nr_rlc_ul_tp_kbps" in local_column_dict:
+            local_column_dict["nr_rlc_ul_tp_kbps"] = 'float'
+        if "nr_rlc_dl_tp_kbps" in local_column_dict:
+            local_column_dict["nr_rlc_dl_tp_kbps"] = 'float'
+    pa_column_types = {}
+    for col, sqlite_col_type in local_column_dict.items():
+        sqlite_col_type = sqlite_col_type.lower()
+        # varchar(n) and unknown types like 'test' of some old dbs as string
+        pa_column_types[col] = pa_type_replace_dict.get(sqlite_col_type, pa.string())
+
+        # special cases
+        if is_datetime_col(col):
+            # because pyarrow is somehow not taking vals like this so use strings first: In CSV column #0: CSV conversion error to timestamp[ms]: invalid value '2018-07-24 09:59:48.218'
+            pa_column_types[col] = pa.string()
+        elif col.endswith("duration"):
+            pa_column_types[col] = pa.float64()
+        elif col.endswith("session_master_session_id"):
+            pa_column_types[col] = pa.string()  # some old db invalid type cases
+        elif col == "exynos_basic_info_nr_cellid":
+            pa_column_types[col] = pa.uint64()
+        elif col in ["lte_m_tmsi", "lte_mmec"]:
+            pa_column_types[col] = pa.int64()
+    return pa_column_types
+
+
+def conv_datetime_strs_to_timestamp_ns(arr):
+    """
+    arrow (chunked) string array of sqlite datetime text like '2018-07-24 09:59:48.218' (or only the date)
+    to timestamp[ns] - values that can't be parsed become null (like pd.to_datetime(errors='coerce') before)
+    """
+    try:
+        # strict iso8601 cast of the whole col at once - fails if any value is invalid
+        return pc.cast(arr, pa.timestamp('ns'))
+    except pa.ArrowInvalid:
+        pass
+    # strptime the seconds part then add the fractional seconds - per value null on errors
+    seconds_strs = pc.utf8_slice_codeunits(arr, 0, 19)
+    seconds = pc.strptime(seconds_strs, format="%Y-%m-%d %H:%M:%S", unit="ns", error_is_null=True)
+    # strptime() accepts days like '2018-02-30' - so only keep values that format back to the same text
+    # (arrow %S also formats the fractional seconds - so compare only the first 19 chars)
+    seconds_ok = pc.fill_null(pc.equal(pc.utf8_slice_codeunits(pc.strftime(seconds, format="%Y-%m-%d %H:%M:%S"), 0, 19), seconds_strs), False)
+    frac_strs = pc.utf8_slice_codeunits(arr, 19, DATETIME_STR_MAX_LEN)
+    frac_ok = pc.or_(pc.equal(frac_strs, ""), pc.match_substring_regex(frac_strs, r"^\.[0-9]+$"))
+    frac_ns = pc.cast(
+        pc.utf8_rpad(pc.if_else(frac_ok, pc.utf8_slice_codeunits(frac_strs, 1, 10), ""), width=9, padding="0"),
+        pa.int64()
+    )
+    timestamps = pc.add(seconds, pc.cast(frac_ns, pa.duration('ns')))
+    dates = pc.strptime(arr, format="%Y-%m-%d", unit="ns", error_is_null=True)
+    is_date = pc.equal(pc.utf8_length(arr), 10)
+    return pc.if_else(
+        is_date,
+        dates,
+        pc.if_else(pc.and_(seconds_ok, frac_ok), timestamps, pa.scalar(None, pa.timestamp('ns')))
+    )
+
+
 def is_numeric_col_type(col_type):
     cl = col_type.lower()
     if cl in ("int", "integer", "bigint", "biginteger", "real", "double", "float"):
@@ -1599,6 +2528,7 @@ def is_numeric_col_type(col_type):
 def append_table_operation_stats(args, table, operation, duration):
     print("operation_stats: {}:{}:{} seconds".format(table, operation, duration))
     od = args["table_operation_stats"]
-    od["table"].append(table)
-    od["operation"].append(operation)
-    od["duration"].append(duration)
+    with g_table_operation_stats_lock:  # also called from --table_jobs threads
+        od["table"].append(table)
+        od["operation"].append(operation)
+        od["duration"].append(duration)
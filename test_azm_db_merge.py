@@ -0,0 +1,201 @@
+import os
+import shutil
+import signal
+import sqlite3
+import sys
+import tempfile
+import zipfile
+from datetime import datetime
+from datetime import timezone
+
+import azm_db_merge
+import azm_sqlite_reader
+
+
+def parse_args(argv):
+    prev_argv = sys.argv
+    sys.argv = ["azm_db_merge.py", "--target_db_type", "postgresql", "--server_user", "postgres", "--server_password", "pass", "--server_database", "azqdb"] + argv
+    try:
+        args = azm_db_merge.parse_cmd_args()
+    finally:
+        sys.argv = prev_argv
+    args["table_operation_stats"] = {
+        "table": [],
+        "operation": [],
+        "duration": []
+    }
+    return args
+
+
+def check_workers(tmp_dir):
+    # --workers: each azm in a pool process - a failed azm doesn't stop the others
+    azm_dir = os.path.join(tmp_dir, "azm_files")
+    imported_dir = os.path.join(tmp_dir, "imported")
+    os.makedirs(azm_dir)
+    azm_files = []
+    for name in ["a.azm", "b.azm", "c.azm"]:
+        fp = os.path.join(azm_dir, name)
+        with open(fp, "wb") as f:
+            f.write(b"azm")
+        azm_files.append(fp)
+    missing_azm = os.path.join(azm_dir, "missing.azm")
+    args = parse_args(["--azm_file", azm_dir, "--dry", "true", "--workers", "2", "--move_imported_azm_files_to_folder", imported_dir])
+    failed_azm_files = []
+    n_done, n_failed, ret = azm_db_merge.process_azm_files_with_workers(args, azm_files + [missing_azm], failed_azm_files)
+    assert (n_done, n_failed, ret) == (4, 1, 0)
+    assert failed_azm_files == [missing_azm]
+    assert sorted(os.listdir(imported_dir)) == ["a.azm", "b.azm", "c.azm"]
+
+
+def check_pipeline_copy_args():
+    # the uncommitted COPYs of one worker would block the DDL of the others
+    try:
+        parse_args(["--azm_file", "example_logs", "--workers", "2", "--pg_pipeline_copy"])
+        assert False
+    except SystemExit:
+        pass
+    assert parse_args(["--azm_file", "example_logs", "--pg_pipeline_copy"])['pg_pipeline_copy']
+
+
+def check_log_metadata(tmp_dir):
+    # one query on the logs table - and the log_end_time/imei from the other tables
+    db_fp = os.path.join(tmp_dir, "azqdata.db")
+    conn = sqlite3.connect(db_fp)
+    conn.execute("create table logs (log_hash bigint, log_timezone_offset integer, log_start_time timestamp, log_end_time timestamp, log_app_version text)")
+    conn.execute("insert into logs values (?, ?, ?, ?, ?)", (1484036963391758847, 25200000, "2023-11-13 13:44:29.014", None, "v3.0.600"))
+    conn.execute("create table android_info_1sec (time timestamp)")
+    conn.executemany("insert into android_info_1sec values (?)", [("2023-11-13 13:50:00.000",), ("2023-11-13 13:52:22.000",)])
+    conn.execute("create table log_info (seqid integer, IMEI text)")
+    conn.executemany("insert into log_info values (?, ?)", [(1, "352497331102030"), (2, "")])
+    conn.commit()
+    conn.close()
+    args = parse_args(["--azm_file", "example_logs", "--add_imei_id_to_all_tables"])
+    args['file'] = db_fp
+    # azm_sqlite_reader - and the sqlite3 executable (--sqlite3_cli_reader) if installed
+    use_readers = [True]
+    if shutil.which(args['sqlite3_executable']) is not None:
+        use_readers.append(False)
+    for use_reader in use_readers:
+        if use_reader:
+            azm_sqlite_reader.open_db(db_fp)
+        try:
+            log_metadata = azm_db_merge.read_log_metadata(args)
+        finally:
+            azm_sqlite_reader.close_db()
+        assert log_metadata.log_hash == 1484036963391758847
+        assert log_metadata.log_timezone_offset == 25200000
+        assert (log_metadata.log_start_time_str, log_metadata.log_end_time_str) == ("2023-11-13 13:44:29.014", "")
+        # sqlite strftime('%s') of the azqdata.db time str
+        assert log_metadata.log_start_time == datetime.fromtimestamp(datetime(2023, 11, 13, 13, 44, 29, tzinfo=timezone.utc).timestamp())
+        # no log_end_time in logs: the last android_info_1sec time
+        assert (log_metadata.log_end_time - log_metadata.log_start_time).total_seconds() == 8 * 60 - 29 + 22
+        assert log_metadata.imei == "352497331102030"
+    args['log_metadata'] = log_metadata
+    assert azm_db_merge.check_azm_azq_app_version(args) == "3.0.600"
+    assert args["azm_apk_version"] == 3000600
+
+
+def check_provision_partitions_months():
+    assert azm_db_merge.parse_provision_partitions_months("2023_11:2024_02") == [datetime(2023, 11, 1), datetime(2023, 12, 1), datetime(2024, 1, 1), datetime(2024, 2, 1)]
+    assert azm_db_merge.parse_provision_partitions_months("2023_11") == [datetime(2023, 11, 1)]
+    for months_str in ["2023_12:2023_11", "2023_11:2023_12:2024_01"]:
+        try:
+            azm_db_merge.parse_provision_partitions_months(months_str)
+            assert False
+        except Exception as e:
+            assert "ABORT" in str(e)
+
+
+def check_parse_log_hashes(tmp_dir):
+    # --unmerge_log_hashes: comma/whitespace separated - or a file of them - duplicates removed in the given order
+    assert azm_db_merge.parse_log_hashes("22,11, 22 -33") == [22, 11, -33]
+    log_hashes_fp = os.path.join(tmp_dir, "log_hashes.txt")
+    with open(log_hashes_fp, "w") as f:
+        f.write("1484036963391758847\n11\n\n1484036963391758847\n")
+    assert azm_db_merge.parse_log_hashes(log_hashes_fp) == [1484036963391758847, 11]
+    for log_hashes_str in ["11,abc", "0", " , "]:
+        try:
+            azm_db_merge.parse_log_hashes(log_hashes_str)
+            assert False
+        except Exception as e:
+            assert "ABORT" in str(e)
+
+
+def check_prefetch(tmp_dir):
+    # --prefetch_azm_files: the next azm is unzipped and checked in the background - a corrupt one leaves nothing behind
+    azm_dir = os.path.join(tmp_dir, "prefetch")
+    os.makedirs(azm_dir)
+    db_fp = os.path.join(azm_dir, "azqdata.db")
+    conn = sqlite3.connect(db_fp)
+    conn.execute("create table logs (log_hash bigint)")
+    conn.commit()
+    conn.close()
+    good_azm = os.path.join(azm_dir, "good.azm")
+    with zipfile.ZipFile(good_azm, "w") as azm:
+        azm.write(db_fp, "azqdata.db")
+    bad_azm = os.path.join(azm_dir, "bad.azm")
+    with zipfile.ZipFile(bad_azm, "w") as azm:
+        azm.writestr("azqdata.db", b"not a sqlite db" * 1000)
+    os.remove(db_fp)
+    args = parse_args(["--azm_file", azm_dir, "--prefetch_azm_files", "1"])
+    try:
+        azm_db_merge.submit_azm_prefetches(args, [good_azm])
+        prefetched = azm_db_merge.pop_prefetched_azm(good_azm)
+        assert prefetched['file'] == os.path.join(prefetched['dir_processing_azm'], "azqdata.db")
+        assert os.path.isfile(prefetched['file'])
+        # taken by process_azm_file() - it cleans it up
+        assert prefetched['dir_processing_azm'] not in azm_db_merge.g_prefetched_dirs
+        azm_db_merge.cleanup_tmp_dir(prefetched['dir_processing_azm'])
+        assert azm_db_merge.pop_prefetched_azm(good_azm) is None
+
+        bad_args = dict(args, azm_file=bad_azm)
+        try:
+            azm_db_merge.prefetch_azm_file(bad_args)
+            assert False
+        except Exception as e:
+            assert "quick_check" in str(e) or "not a database" in str(e)
+        assert not os.path.exists(bad_args['dir_processing_azm'])
+        assert azm_db_merge.g_prefetched_dirs == set()
+        azm_db_merge.submit_azm_prefetches(args, [bad_azm])
+        assert azm_db_merge.pop_prefetched_azm(bad_azm) is None
+
+        # SIGTERM: the prefetched azms not taken yet are cleaned up
+        azm_db_merge.submit_azm_prefetches(args, [good_azm])
+        azm_db_merge.g_prefetch_futures[good_azm].result()
+        dirs = list(azm_db_merge.g_prefetched_dirs)
+        assert len(dirs) == 1
+        azm_db_merge.stop_azm_prefetches()
+        assert not os.path.exists(dirs[0])
+        assert azm_db_merge.g_prefetched_dirs == set()
+
+        # SIGTERM while the main thread is in pop_prefetched_azm()/submit_azm_prefetches(): the handler must not wait on it
+        azm_db_merge.g_prefetch_stopped = False
+        azm_db_merge.g_prefetch_executor = None
+        azm_db_merge.submit_azm_prefetches(args, [good_azm])
+        azm_db_merge.g_prefetch_futures[good_azm].result()
+        dirs = list(azm_db_merge.g_prefetched_dirs)
+        with azm_db_merge.g_prefetch_lock:
+            try:
+                azm_db_merge.sigterm_handler(signal.SIGTERM, None)
+                assert False
+            except SystemExit:
+                pass
+        assert not os.path.exists(dirs[0])
+    finally:
+        azm_db_merge.stop_azm_prefetches()
+        azm_db_merge.g_prefetch_executor = None
+        azm_db_merge.g_prefetch_stopped = False
+
+
+def test():
+    tmp_dir = tempfile.mkdtemp()
+    check_log_metadata(tmp_dir)
+    check_workers(tmp_dir)
+    check_pipeline_copy_args()
+    check_provision_partitions_months()
+    check_parse_log_hashes(tmp_dir)
+    check_prefetch(tmp_dir)
+
+
+if __name__ == '__main__':
+    test()
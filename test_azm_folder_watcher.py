@@ -0,0 +1,44 @@
+import os
+import tempfile
+import time
+
+import azm_folder_watcher
+
+
+def write_file(fp, data=b"azm"):
+    with open(fp, "wb") as f:
+        f.write(data)
+
+
+def test():
+    for mode in ["inotify", "poll"]:
+        root_dir = tempfile.mkdtemp()
+        write_file(os.path.join(root_dir, "old.azm"))
+        assert azm_folder_watcher.start(root_dir, mode, poll_interval_seconds=0.2) == [os.path.join(root_dir, "old.azm")]
+        assert azm_folder_watcher.get_mode() == mode
+        assert azm_folder_watcher.wait_for_azm_files(0.5) == []
+
+        # written in place
+        write_file(os.path.join(root_dir, "new.azm"))
+        write_file(os.path.join(root_dir, "not_an_azm.txt"))
+        assert azm_folder_watcher.wait_for_azm_files(5) == [os.path.join(root_dir, "new.azm")]
+
+        # uploaded to a tmp name then renamed - in a new sub folder
+        sub_dir = os.path.join(root_dir, "2023", "11")
+        os.makedirs(sub_dir)
+        write_file(os.path.join(sub_dir, "upload.azm.part"))
+        os.rename(os.path.join(sub_dir, "upload.azm.part"), os.path.join(sub_dir, "upload.azm"))
+        assert azm_folder_watcher.wait_for_azm_files(5) == [os.path.join(sub_dir, "upload.azm")]
+
+        # unchanged files are not queued again - re-uploaded files are
+        time.sleep(0.01)
+        write_file(os.path.join(root_dir, "new.azm"), b"azm v2")
+        azm_files = azm_folder_watcher.wait_for_azm_files(5)
+        assert azm_files == [os.path.join(root_dir, "new.azm")]
+        assert azm_folder_watcher.wait_for_azm_files(0.5) == []
+        azm_folder_watcher.stop()
+        assert azm_folder_watcher.get_mode() is None
+
+
+if __name__ == '__main__':
+    test()
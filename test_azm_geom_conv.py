@@ -0,0 +1,50 @@
+import binascii
+import struct
+
+import pyarrow as pa
+
+import azm_geom_conv
+import gen_sql_handler
+
+
+def gen_spatialite_point_blob(lon, lat):
+    xy = struct.pack("<dd", lon, lat)
+    return azm_geom_conv.SPATIALITE_POINT_BLOB_HEADER + xy + xy + b"\x7c" + struct.pack("<I", 1) + xy + b"\xfe"
+
+
+def test():
+    point = gen_spatialite_point_blob(100.54692563, 13.78626123)
+    not_point = b"\x00\x01\xe6\x10\x00\x00" + b"\x01" * 70
+    blobs = [point, None, b"", not_point, point]
+
+    gen_sql_handler.g_is_postgre = True
+    gen_sql_handler.g_is_ms = False
+    hex_vals = gen_sql_handler.conv_geom_col_vals_to_wkb_hex(blobs)
+    # must be same as the per csv line conversion of the sqlite3 csv dump
+    for blob, hex_val in zip(blobs, hex_vals):
+        csv_geom = "" if not blob else binascii.hexlify(blob).decode().upper()
+        old = gen_sql_handler.find_and_conv_spatialite_blob_to_wkb("1,{},2\n".format(csv_geom)).split(",")[1]
+        assert old == ("" if hex_val is None else hex_val.decode())
+    assert hex_vals[0] == b"0101000020E6100000" + binascii.hexlify(point[43:59]).upper()
+    assert hex_vals[1] is None and hex_vals[2] is None
+    assert hex_vals[3] == binascii.hexlify(not_point).upper()
+
+    wkb_vals = azm_geom_conv.conv_spatialite_point_blobs_to_wkb(blobs, azm_geom_conv.MS_GEOGRAPHY_POINT_HEADER)
+    assert wkb_vals[4] == bytes.fromhex("E6100000010C") + struct.pack("<dd", 100.54692563, 13.78626123)
+    assert wkb_vals[1] is None and wkb_vals[2] is None
+    assert wkb_vals[3] == not_point
+
+    # --dump_parquet: arrow geom col of hex text (like the csv dump) - non-point blobs become NULL too
+    hex_arr = pa.array([None if blob is None else binascii.hexlify(blob).upper() for blob in blobs], type=pa.binary())
+    for geom_arr, geom_is_wkb in [(hex_arr, False), (pa.array(hex_vals, type=pa.binary()), True)]:
+        wkb_arr, lat_arr, lon_arr = azm_geom_conv.conv_geom_arrow_array_to_wkb_lat_lon(geom_arr, geom_is_hex=True, geom_is_wkb=geom_is_wkb)
+        assert wkb_arr.type == pa.binary()
+        assert wkb_arr.to_pylist() == [binascii.unhexlify(hex_vals[0]), None, None, None, binascii.unhexlify(hex_vals[4])]
+        assert lat_arr.to_pylist() == [13.78626123, None, None, None, 13.78626123]
+        assert lon_arr.to_pylist() == [100.54692563, None, None, None, 100.54692563]
+    wkb_arr, lat_arr, lon_arr = azm_geom_conv.conv_geom_arrow_array_to_wkb_lat_lon(pa.chunked_array([hex_arr[3:], hex_arr[:1]]), geom_is_hex=True, geom_is_wkb=False)
+    assert lon_arr.to_pylist() == [None, 100.54692563, 100.54692563]
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import time
+
+import azm_ledger
+
+
+def test():
+    tmp_dir = tempfile.mkdtemp()
+    ledger_fp = os.path.join(tmp_dir, "ledger.db")
+    key = ("postgresql://localhost:5432/azqdb/public", "merge")
+    fps = []
+    for name in ["ok.azm", "merged.azm", "bad.azm", "new.azm"]:
+        fp = os.path.join(tmp_dir, name)
+        with open(fp, "wb") as f:
+            f.write(name.encode())
+        fps.append(fp)
+    ok_fp, merged_fp, bad_fp, new_fp = fps
+
+    azm_ledger.open_ledger(ledger_fp)
+    now = time.time()
+    # record() doesn't read the whole file
+    get_content_hash = azm_ledger.get_content_hash
+    azm_ledger.get_content_hash = None
+    try:
+        azm_ledger.record(key, ok_fp, now, 1.5, log_hash=1)
+    finally:
+        azm_ledger.get_content_hash = get_content_hash
+    assert azm_ledger.record(key, ok_fp, now, 1.5, log_hash=1) == azm_ledger.OUTCOME_SUCCESS
+    assert azm_ledger.record(key, merged_fp, now, 0.5, "ABORT: This log (2) has already been imported/exists in target db", log_hash=2) == azm_ledger.OUTCOME_ALREADY_MERGED
+    assert azm_ledger.record(key, bad_fp, now, 0.5, "BadZipFile: File is not a zip file") == azm_ledger.OUTCOME_FAILED
+    azm_ledger.close_ledger()
+
+    # persistent across runs
+    azm_ledger.open_ledger(ledger_fp)
+    assert azm_ledger.get_entry(key, ok_fp)['log_hash'] == 1
+    assert azm_ledger.filter_azm_files(key, fps, now + 1) == ([new_fp], [bad_fp])
+    # other operation/target
+    assert azm_ledger.filter_azm_files((key[0], "unmerge"), fps, now + 1) == (fps, [])
+    # failed: retried after the backoff - doubled after each failure of the same file
+    assert azm_ledger.filter_azm_files(key, [bad_fp], now + azm_ledger.LEDGER_RETRY_BASE_SECONDS + 1) == ([bad_fp], [])
+    azm_ledger.record(key, bad_fp, now + 100, 0.5, "BadZipFile: File is not a zip file")
+    entry = azm_ledger.get_entry(key, bad_fp)
+    assert entry['n_failures'] == 2 and entry['next_retry_time'] == now + 100.5 + 2 * azm_ledger.LEDGER_RETRY_BASE_SECONDS
+    # changed files are processed again right away
+    with open(bad_fp, "wb") as f:
+        f.write(b"fixed upload")
+    with open(ok_fp, "wb") as f:
+        f.write(b"new content")
+    assert azm_ledger.filter_azm_files(key, [ok_fp, bad_fp], now + 101) == ([ok_fp, bad_fp], [])
+    # only the mtime changed: no content hash recorded yet - processed again, recorded with the hash taken by the filter
+    os.utime(merged_fp, ns=(0, 0))
+    assert azm_ledger.get_entry(key, merged_fp)['content_hash'] is None
+    assert azm_ledger.filter_azm_files(key, [merged_fp], now + 101) == ([merged_fp], [])
+    azm_ledger.record(key, merged_fp, now + 101, 0.5, "ABORT: This log (2) has already been imported/exists in target db", log_hash=2)
+    assert azm_ledger.get_entry(key, merged_fp)['content_hash'] == azm_ledger.get_content_hash(merged_fp)
+    # then a further mtime only change: same content hash - skipped
+    os.utime(merged_fp, ns=(10**9, 10**9))
+    assert azm_ledger.filter_azm_files(key, [merged_fp], now + 102) == ([], [])
+    assert azm_ledger.get_entry(key, merged_fp)['mtime_ns'] == 10**9
+
+    # unmerge then merge of the same unchanged azm: the merge is not skipped
+    unmerge_key = (key[0], "unmerge")
+    azm_ledger.record(key, new_fp, now, 1.0, log_hash=4)
+    assert azm_ledger.filter_azm_files(key, [new_fp], now + 1) == ([], [])
+    assert azm_ledger.record(unmerge_key, new_fp, now + 2, 1.0, log_hash=4) == azm_ledger.OUTCOME_SUCCESS
+    assert azm_ledger.get_entry(key, new_fp) is None
+    assert azm_ledger.filter_azm_files(key, [new_fp], now + 3) == ([new_fp], [])
+    # the merge again: now the unmerge is not skipped
+    azm_ledger.record(key, new_fp, now + 4, 1.0, log_hash=4)
+    assert azm_ledger.filter_azm_files(unmerge_key, [new_fp], now + 5) == ([new_fp], [])
+    # a failed unmerge keeps the merge entry
+    azm_ledger.record(unmerge_key, new_fp, now + 6, 1.0, "connection refused")
+    assert azm_ledger.get_entry(key, new_fp)['outcome'] == azm_ledger.OUTCOME_SUCCESS
+
+    # --unmerge_log_hashes: the entries of its logs are removed - the already merged one too
+    assert azm_ledger.invalidate_log_hashes(key[0], [2, 4]) == 2
+    assert azm_ledger.filter_azm_files(key, [merged_fp, new_fp], now + 7) == ([merged_fp, new_fp], [])
+    assert azm_ledger.get_entry(key, ok_fp) is not None
+    azm_ledger.close_ledger()
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,206 @@
+import io
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.fs as pafs
+
+import azm_object_store
+import azm_parquet_dataset
+import gen_sql_handler
+
+
+class S3StandInHandler(pafs.FileSystemHandler):
+    # in-memory stand-in of an s3 bucket: flat keys (no dirs), objects only appear when their upload stream is closed
+    def __init__(self, n_put_failures=0):
+        self.objects = {}
+        self.n_put_failures = n_put_failures
+
+    def get_type_name(self):
+        return "s3_stand_in"
+
+    def normalize_path(self, path):
+        return path
+
+    def equals(self, other):
+        return self is other
+
+    def get_file_info(self, paths):
+        return [pafs.FileInfo(path, pafs.FileType.File, size=len(self.objects[path])) if path in self.objects else pafs.FileInfo(path, pafs.FileType.NotFound) for path in paths]
+
+    def get_file_info_selector(self, selector):
+        return [pafs.FileInfo(path, pafs.FileType.File, size=len(data)) for path, data in sorted(self.objects.items()) if path.startswith(selector.base_dir + "/")]
+
+    def delete_file(self, path):
+        # like s3: deleting a missing key is ok
+        self.objects.pop(path, None)
+
+    def open_input_stream(self, path):
+        if path not in self.objects:
+            raise FileNotFoundError(path)
+        return pa.BufferReader(self.objects[path])
+
+    def open_output_stream(self, path, metadata):
+        if self.n_put_failures:
+            self.n_put_failures -= 1
+            raise OSError("stand-in put failure")
+        handler = self
+
+        class Upload(io.BytesIO):
+            def close(self):
+                handler.objects[path] = self.getvalue()
+                super().close()
+
+        return pa.PythonFile(Upload(), mode="w")
+
+    def create_dir(self, path, recursive):
+        raise NotImplementedError()
+
+    def delete_dir(self, path):
+        raise NotImplementedError()
+
+    def delete_dir_contents(self, path, missing_dir_ok=False):
+        raise NotImplementedError()
+
+    def delete_root_dir_contents(self):
+        raise NotImplementedError()
+
+    def move(self, src, dest):
+        raise NotImplementedError()
+
+    def copy_file(self, src, dest):
+        raise NotImplementedError()
+
+    def open_input_file(self, path):
+        return self.open_input_stream(path)
+
+    def open_append_stream(self, path, metadata):
+        raise NotImplementedError()
+
+
+class Conn(object):
+    # stand-in of the psycopg2 conn for gen_sql_handler.commit()
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def commit(self):
+        pass
+
+
+def check_reimport(tmp_dir, store_dir):
+    # --reimport --parquet_object_store: the new files never replace the files of the current import before the commit
+    handler = S3StandInHandler()
+    azm_object_store.open_store(store_dir, 2)
+    azm_object_store.g_fs = pafs.PyFileSystem(handler)
+    azm_object_store.g_root = "azm-test"
+    args = {
+        'reimport': True, 'unmerge': False, 'dump_parquet': True, 'log_hash': 11, 'log_hash_ym_str': "2023_11",
+        'parquet_hive_layout': False, 'parquet_dataset_dir': None, 'parquet_object_store': store_dir,
+    }
+    manifest_rel_path = azm_parquet_dataset.get_manifest_rel_path("2023-11", 11)
+    old_files = []
+    for path in ["2023-11/events_11.parquet", "2023-11/old_table_11.parquet"]:
+        handler.objects["azm-test/" + path] = b"old"
+        old_files.append({'path': path, 'table': path.split("/")[1].rsplit("_", 1)[0], 'num_rows': 1, 'size_bytes': 3, 'min_time': None, 'max_time': None})
+    old_manifest_data = azm_parquet_dataset.manifest_to_bytes(azm_parquet_dataset.gen_manifest(11, "2023-11", "flat", old_files))
+    handler.objects["azm-test/" + manifest_rel_path] = old_manifest_data
+    old_objects = dict(handler.objects)
+    pqfp = os.path.join(tmp_dir, "events_11.parquet")
+    with open(pqfp, "wb") as f:
+        f.write(b"new")
+    try:
+        # an azm failed before its commit: only its own uploads are removed
+        gen_sql_handler.g_parquet_generation = "gen1"
+        new_path = gen_sql_handler.get_parquet_rel_path(args, pqfp)
+        assert new_path == "2023-11/events_11.gen1.parquet"
+        azm_object_store.submit_upload(pqfp, new_path).result()
+        assert handler.objects["azm-test/" + new_path] == b"new"
+        gen_sql_handler.close(args)
+        assert handler.objects == old_objects
+        assert gen_sql_handler.g_parquet_generation is None
+
+        # committed: the new manifest replaces the old one - then the old files are removed
+        gen_sql_handler.g_parquet_generation = "gen2"
+        gen_sql_handler.g_conn = Conn()
+        new_path = gen_sql_handler.get_parquet_rel_path(args, pqfp)
+        azm_object_store.submit_upload(pqfp, new_path)
+        gen_sql_handler.g_parquet_files[pqfp] = {'table': "events", 'num_rows': 1, 'size_bytes': 3, 'min_time': None, 'max_time': None}
+        assert gen_sql_handler.commit(args, "")
+        manifest = azm_parquet_dataset.manifest_from_bytes(handler.objects["azm-test/" + manifest_rel_path], manifest_rel_path)
+        assert [f['path'] for f in manifest['files']] == ["2023-11/events_11.gen2.parquet"]
+        assert sorted(handler.objects) == ["azm-test/2023-11/events_11.gen2.parquet", "azm-test/" + manifest_rel_path]
+
+        # a previous import without a manifest: its files have the keys of the new ones without the generation
+        handler.objects = {"azm-test/2023-11/events_11.parquet": b"old"}
+        gen_sql_handler.g_parquet_generation = "gen3"
+        azm_object_store.submit_upload(pqfp, gen_sql_handler.get_parquet_rel_path(args, pqfp))
+        gen_sql_handler.g_parquet_files[pqfp] = {'table': "events", 'num_rows': 1, 'size_bytes': 3, 'min_time': None, 'max_time': None}
+        assert gen_sql_handler.commit(args, "")
+        assert sorted(handler.objects) == ["azm-test/2023-11/events_11.gen3.parquet", "azm-test/" + manifest_rel_path]
+    finally:
+        gen_sql_handler.close(args)
+        azm_object_store.close_store()
+
+
+def test():
+    tmp_dir = tempfile.mkdtemp()
+    local_fps = []
+    for i in range(5):
+        fp = os.path.join(tmp_dir, "t{}_123.parquet".format(i))
+        with open(fp, "wb") as f:
+            f.write(os.urandom(1000 + i))
+        local_fps.append(fp)
+
+    # local dir store
+    store_dir = os.path.join(tmp_dir, "store")
+    azm_object_store.open_store(store_dir, 4)
+    for i, fp in enumerate(local_fps):
+        azm_object_store.submit_upload(fp, "2023-11/{}".format(os.path.basename(fp)))
+    assert len(azm_object_store.finish_uploads()) == 5
+    assert sorted(os.listdir(os.path.join(store_dir, "2023-11"))) == sorted(os.path.basename(fp) for fp in local_fps)
+    azm_object_store.put_bytes("_manifests/2023-11/123.json", b"{}")
+    assert azm_object_store.get_bytes("_manifests/2023-11/123.json") == b"{}"
+    assert azm_object_store.get_bytes("_manifests/2023-11/456.json") is None
+    # an azm failed before its commit: its uploads are removed
+    azm_object_store.submit_upload(local_fps[0], "2023-12/t0_456.parquet").result()
+    assert azm_object_store.abort_uploads() == ["2023-12/t0_456.parquet"]
+    assert os.listdir(os.path.join(store_dir, "2023-12")) == []
+    azm_object_store.delete_objects(["2023-11/t0_123.parquet", "2023-11/missing.parquet"])
+    assert len(os.listdir(os.path.join(store_dir, "2023-11"))) == 4
+    azm_object_store.close_store()
+    assert not azm_object_store.is_open()
+
+    # s3 stand-in - failed puts are retried
+    upload_retry_sleep_seconds = azm_object_store.UPLOAD_RETRY_SLEEP_SECONDS
+    azm_object_store.UPLOAD_RETRY_SLEEP_SECONDS = 0
+    try:
+        handler = S3StandInHandler(n_put_failures=2)
+        azm_object_store.open_store(store_dir, 2)
+        azm_object_store.g_fs = pafs.PyFileSystem(handler)
+        azm_object_store.g_root = "azm-test"
+        for fp in local_fps:
+            azm_object_store.submit_upload(fp, "2023-11/{}".format(os.path.basename(fp)))
+        azm_object_store.finish_uploads()
+        assert sorted(handler.objects) == sorted("azm-test/2023-11/{}".format(os.path.basename(fp)) for fp in local_fps)
+        with open(local_fps[4], "rb") as f:
+            assert handler.objects["azm-test/2023-11/t4_123.parquet"] == f.read()
+        # a put failing more than UPLOAD_RETRIES times fails the commit
+        handler.n_put_failures = azm_object_store.UPLOAD_RETRIES
+        azm_object_store.submit_upload(local_fps[0], "2023-12/t0_789.parquet")
+        try:
+            azm_object_store.finish_uploads()
+            assert False
+        except Exception as e:
+            assert "2023-12/t0_789.parquet" in str(e)
+        azm_object_store.close_store()
+        check_reimport(tmp_dir, store_dir)
+    finally:
+        azm_object_store.close_store()
+        azm_object_store.UPLOAD_RETRY_SLEEP_SECONDS = upload_retry_sleep_seconds
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import threading
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import azm_parquet_dataset
+
+
+def write_log_file(root_dir, table_name, log_hash, table):
+    partition_dir = azm_parquet_dataset.get_partition_dir(root_dir, table_name, "2023-11")
+    os.makedirs(partition_dir, exist_ok=True)
+    pq.write_table(table, os.path.join(partition_dir, azm_parquet_dataset.get_log_file_name(table_name, log_hash)), flavor='spark', **azm_parquet_dataset.TIMESTAMP_WRITER_KWARGS)
+
+
+def test():
+    dataset_dir = tempfile.mkdtemp()
+    times = pa.array([1699883069014000000, 1699883070014000000], type=pa.timestamp('ns'))
+    for log_hash in [1, 2]:
+        staging_dir = tempfile.mkdtemp()
+        write_log_file(staging_dir, "signalling", log_hash, pa.table({"log_hash": [log_hash] * 2, "time": times}))
+        moved = azm_parquet_dataset.move_into_dataset(staging_dir, dataset_dir)
+        assert moved == [os.path.join("table=signalling", "month=2023-11", "signalling_{}.parquet".format(log_hash))]
+        assert azm_parquet_dataset.list_partition_files(azm_parquet_dataset.get_partition_dir(staging_dir, "signalling", "2023-11")) == []
+
+    partition_dir = azm_parquet_dataset.get_partition_dir(dataset_dir, "signalling", "2023-11")
+    assert sorted(os.listdir(partition_dir)) == ["_common_metadata", "_metadata", "signalling_1.parquet", "signalling_2.parquet"]
+    summary = pq.read_metadata(os.path.join(partition_dir, "_metadata"))
+    assert summary.num_row_groups == 2 and summary.num_rows == 4
+    assert sorted(summary.row_group(i).column(0).file_path for i in range(2)) == ["signalling_1.parquet", "signalling_2.parquet"]
+    # time col statistics for row group skipping
+    assert summary.row_group(0).column(1).statistics.has_min_max
+    assert ds.parquet_dataset(os.path.join(partition_dir, "_metadata")).to_table().column("log_hash").to_pylist() == [1, 1, 2, 2]
+    assert ds.dataset(dataset_dir, format="parquet", partitioning="hive").to_table().num_rows == 4
+    assert os.path.isfile(azm_parquet_dataset.get_partition_lock_path(partition_dir))
+
+    # reimport of a log: its file is replaced - the '_metadata' is rebuilt, not appended to
+    staging_dir = tempfile.mkdtemp()
+    write_log_file(staging_dir, "signalling", 2, pa.table({"log_hash": [2] * 2, "time": times}))
+    azm_parquet_dataset.move_into_dataset(staging_dir, dataset_dir)
+    summary = pq.read_metadata(os.path.join(partition_dir, "_metadata"))
+    assert summary.num_row_groups == 2 and summary.num_rows == 4
+
+    # concurrent imports (--workers) into the same partition: no lost summary updates
+    threads = []
+    for log_hash in range(10, 18):
+        staging_dir = tempfile.mkdtemp()
+        write_log_file(staging_dir, "signalling", log_hash, pa.table({"log_hash": [log_hash] * 2, "time": times}))
+        threads.append(threading.Thread(target=azm_parquet_dataset.move_into_dataset, args=(staging_dir, dataset_dir)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pq.read_metadata(os.path.join(partition_dir, "_metadata")).num_rows == 20
+    for log_hash in range(10, 18):
+        azm_parquet_dataset.remove_log_files(dataset_dir, "2023-11", log_hash)
+    assert pq.read_metadata(os.path.join(partition_dir, "_metadata")).num_rows == 4
+
+    # a new app version log with an extra column: no '_metadata' but the unified schema in '_common_metadata'
+    staging_dir = tempfile.mkdtemp()
+    write_log_file(staging_dir, "signalling", 3, pa.table({"log_hash": [3], "time": times[:1], "direction": pa.array([1], type=pa.uint32())}))
+    azm_parquet_dataset.move_into_dataset(staging_dir, dataset_dir)
+    assert not os.path.isfile(os.path.join(partition_dir, "_metadata"))
+    assert pq.read_schema(os.path.join(partition_dir, "_common_metadata")).names == ["log_hash", "time", "direction"]
+
+    removed = azm_parquet_dataset.remove_log_files(dataset_dir, "2023-11", 3)
+    assert removed == [os.path.join(partition_dir, "signalling_3.parquet")]
+    assert pq.read_metadata(os.path.join(partition_dir, "_metadata")).num_rows == 4
+    azm_parquet_dataset.remove_log_files(dataset_dir, "2023-11", 1)
+
+    # unmerge by the manifest of the log - only its listed files are removed
+    manifest = azm_parquet_dataset.gen_manifest(2, "2023-11", "hive", [
+        {'path': "table=signalling/month=2023-11/signalling_2.parquet", 'table': "signalling", 'num_rows': 2, 'size_bytes': 10, 'min_time': "2023-11-13 13:44:29.014000000", 'max_time': "2023-11-13 13:44:30.014000000"},
+        {'path': "table=logs/month=2023-11/logs_2.parquet", 'table': "logs", 'num_rows': 1, 'size_bytes': 5, 'min_time': None, 'max_time': None},
+    ])
+    assert (manifest['num_rows'], manifest['size_bytes']) == (3, 15)
+    assert (manifest['min_time'], manifest['max_time']) == ("2023-11-13 13:44:29.014000000", "2023-11-13 13:44:30.014000000")
+    manifest_fp = os.path.join(dataset_dir, *azm_parquet_dataset.get_manifest_rel_path("2023-11", 2).split("/"))
+    azm_parquet_dataset.write_manifest(manifest_fp, manifest)
+    assert azm_parquet_dataset.read_manifest(manifest_fp) == manifest
+    assert os.listdir(os.path.dirname(manifest_fp)) == ["2.json"]
+    removed = azm_parquet_dataset.remove_manifest_files(dataset_dir, manifest_fp)
+    assert removed == [os.path.join(partition_dir, "signalling_2.parquet")]
+    assert os.listdir(partition_dir) == []
+    assert not os.path.isfile(manifest_fp)
+
+
+if __name__ == '__main__':
+    test()
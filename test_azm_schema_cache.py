@@ -0,0 +1,47 @@
+import os
+import sqlite3
+import tempfile
+
+import azm_schema_cache
+
+
+def test():
+    cache_fp = os.path.join(tempfile.mkdtemp(), "schema_cache.db")
+    key = ("5e9d800a1fa78243b1c9940a8ecf86d0a238f9b9", "import_geom_column_in_location_table_only=0", "postgresql://localhost:5432/azqdb", "public")
+    other_key = (key[0], key[1], key[2], "all_logs")
+    other_args_key = (key[0], "import_geom_column_in_location_table_only=1", key[2], key[3])
+
+    azm_schema_cache.open_cache(cache_fp)
+    assert azm_schema_cache.get_remote_column_names(key, "logs") is None
+    azm_schema_cache.put_remote_column_names(key, {"logs": ["log_hash", "time"], "signalling": ["log_hash", "time", "symbol"]})
+    azm_schema_cache.put_remote_column_names(other_key, {"logs": ["log_hash"]})
+    azm_schema_cache.close_cache()
+
+    # persistent across runs
+    azm_schema_cache.open_cache(cache_fp)
+    assert azm_schema_cache.get_remote_column_names(key, "signalling") == ["log_hash", "time", "symbol"]
+    assert azm_schema_cache.get_remote_column_names(other_key, "logs") == ["log_hash"]
+    assert azm_schema_cache.get_remote_column_names(other_args_key, "logs") is None
+    azm_schema_cache.invalidate(key)
+    assert azm_schema_cache.get_remote_column_names(key, "logs") is None
+    assert azm_schema_cache.get_remote_column_names(other_key, "logs") == ["log_hash"]
+    azm_schema_cache.close_cache()
+
+    # cache file of the old format (no schema_args in the key): its entries are dropped
+    old_cache_fp = os.path.join(tempfile.mkdtemp(), "schema_cache.db")
+    conn = sqlite3.connect(old_cache_fp)
+    with conn:
+        conn.execute("create table remote_tables (schema_shasum text, target text, pg_schema text, table_name text, remote_column_names text, primary key (schema_shasum, target, pg_schema, table_name))")
+        conn.execute("insert into remote_tables values (?, ?, ?, ?, ?)", (key[0], key[2], key[3], "logs", '["log_hash"]'))
+    conn.close()
+    azm_schema_cache.open_cache(old_cache_fp)
+    assert azm_schema_cache.get_remote_column_names(key, "logs") is None
+    azm_schema_cache.put_remote_column_names(key, {"logs": ["log_hash"]})
+    azm_schema_cache.close_cache()
+    azm_schema_cache.open_cache(old_cache_fp)
+    assert azm_schema_cache.get_remote_column_names(key, "logs") == ["log_hash"]
+    azm_schema_cache.close_cache()
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import zipfile
+
+import pyarrow as pa
+
+import azm_db_constants
+import azm_sqlite_reader
+
+
+def check_same_as_sqlite3_executable(db_fp, tmp_dir):
+    # the dumps of the reader must be the same bytes as the dumps of the sqlite3 executable it replaced
+    conn = sqlite3.connect(db_fp)
+    conn.execute("create table vals (i integer, r real, t text, n text)")
+    conn.executemany("insert into vals values (?, ?, ?, ?)", [
+        (1, 1.0, "plain", None),
+        (-2, 0.1, "with, comma", ""),
+        (2 ** 40, 1e20, 'with "quote"', "x"),
+        (0, 1 / 3.0, "with\nnewline", None),
+        (None, -2.5e-7, "", "y"),
+    ])
+    conn.commit()
+    conn.close()
+    assert azm_sqlite_reader.value_to_text(1e20) == "1.0e+20"
+    assert azm_sqlite_reader.value_to_text(None) == ""
+    azm_sqlite_reader.open_db(db_fp)
+    assert azm_sqlite_reader.get_sql_result("select count(*), max(r) from vals") == "5|1.0e+20"
+    sqlite3_executable = shutil.which("sqlite3")
+    if sqlite3_executable is None:
+        print("no sqlite3 executable - skip the compare with its dumps")
+        return
+    for mode, col_separator, row_separator in [
+        ("-csv", ",", "\n"),
+        ("-list", azm_db_constants.BULK_INSERT_COL_SEPARATOR_VALUE, azm_db_constants.BULK_INSERT_LINE_SEPARATOR_VALUE),
+    ]:
+        cli_fp = os.path.join(tmp_dir, "cli" + mode)
+        reader_fp = os.path.join(tmp_dir, "reader" + mode)
+        subprocess.check_call([
+            sqlite3_executable, db_fp, "-ascii", mode, "-separator", col_separator, "-newline", row_separator,
+            '.out "{}"'.format(cli_fp), "select i, r, t, n from vals",
+        ])
+        assert azm_sqlite_reader.dump_select_to_file(["i", "r", "t", "n"], "from vals", reader_fp, col_separator, row_separator, csv_mode=(mode == "-csv")) == 0
+        with open(cli_fp, "rb") as cli_f, open(reader_fp, "rb") as reader_f:
+            assert reader_f.read() == cli_f.read()
+    azm_sqlite_reader.close_db()
+
+
+def test():
+    tmp_dir = tempfile.mkdtemp()
+    db_fp = os.path.join(tmp_dir, "azqdata.db")
+    conn = sqlite3.connect(db_fp)
+    conn.execute("create table t (a integer, b real, c text)")
+    conn.executemany("insert into t values (?, ?, ?)", [(i, i / 3.0, "row, {}".format(i)) for i in range(1000)])
+    conn.commit()
+    conn.close()
+    check_same_as_sqlite3_executable(os.path.join(tmp_dir, "vals.db"), tmp_dir)
+    azm_fp = os.path.join(tmp_dir, "test.azm")
+    with zipfile.ZipFile(azm_fp, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.write(db_fp, "azqdata.db")
+
+    # check_db: a private conn - nothing registered for close_db()
+    assert azm_sqlite_reader.check_db(db_fp)
+    assert azm_sqlite_reader.g_thread_conns == []
+    garbage_fp = os.path.join(tmp_dir, "garbage.db")
+    with open(garbage_fp, "wb") as f:
+        f.write(os.urandom(8192))
+    try:
+        azm_sqlite_reader.check_db(garbage_fp)
+        assert False
+    except sqlite3.DatabaseError:
+        pass
+
+    azm_sqlite_reader.open_db(db_fp)
+    on_disk = b"".join(azm_sqlite_reader.iter_select_chunks(["a", "b", "c"], "from t", ",", "\n", csv_mode=True))
+    on_disk_schema = azm_sqlite_reader.get_schema()
+
+    azm_sqlite_reader.open_db_from_zip(azm_fp, "azqdata.db")
+    assert azm_sqlite_reader.get_schema() == on_disk_schema
+    assert b"".join(azm_sqlite_reader.iter_select_chunks(["a", "b", "c"], "from t", ",", "\n", csv_mode=True)) == on_disk
+    # other threads (like --table_jobs) read the same in-memory db with their own conn
+    thread_ret = []
+    thread = threading.Thread(target=lambda: thread_ret.append(azm_sqlite_reader.get_sql_result("select count(*) from t")))
+    thread.start()
+    thread.join()
+    assert thread_ret == ["1000"]
+
+    # --dump_parquet: typed arrow batches - values not fitting the col type become null
+    conn = sqlite3.connect(db_fp)
+    conn.execute("create table mixed (i integer, d double, s text, g blob)")
+    conn.executemany("insert into mixed values (?, ?, ?, ?)", [
+        (1, 1.5, "a", b"\x00\x01"),
+        ("x", "", 2, None),
+        (2 ** 40, "2.5", b"\xff", b"\x02"),
+    ])
+    conn.commit()
+    conn.close()
+    azm_sqlite_reader.open_db(db_fp)
+    schema = pa.schema([("i", pa.int32()), ("d", pa.float64()), ("s", pa.string()), ("g", pa.binary())])
+    table = pa.Table.from_batches(list(azm_sqlite_reader.iter_select_record_batches(["i", "d", "s", "g"], "from mixed order by rowid", schema)), schema=schema)
+    assert table.schema == schema
+    assert table.to_pydict() == {
+        "i": [1, None, None],
+        "d": [1.5, None, 2.5],
+        "s": ["a", "2", "\ufffd"],
+        "g": [b"\x00\x01", None, b"\x02"],
+    }
+    azm_sqlite_reader.close_db()
+    assert not azm_sqlite_reader.is_open()
+
+
+if __name__ == '__main__':
+    test()
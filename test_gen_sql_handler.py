@@ -0,0 +1,574 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import azm_db_constants
+import azm_sqlite_reader
+import gen_sql_handler
+
+
+class CopyCursor(object):
+    # stand-in of the psycopg2 cursor for exec_pg_copy(): reads the whole file-like like copy_expert()
+    def __init__(self, fail_table_name=None):
+        self.copied = []
+        self.fail_table_name = fail_table_name
+
+    def copy_expert(self, sql, f, size=8192):
+        if self.fail_table_name is not None and '"{}"'.format(self.fail_table_name) in sql:
+            raise Exception('relation "{}" does not exist'.format(self.fail_table_name))
+        data = b""
+        while True:
+            buf = f.read(size)
+            if not buf:
+                break
+            data += buf
+        self.copied.append((sql, data))
+
+
+def new_args():
+    return {'table_operation_stats': {'table': [], 'operation': [], 'duration': []}}
+
+
+def check_stream_copy(tmp_dir):
+    # --pg_stream_copy: the COPY gets the same bytes from the SelectStream as from the csv dump file
+    db_fp = os.path.join(tmp_dir, "azqdata.db")
+    conn = sqlite3.connect(db_fp)
+    conn.execute("create table signalling (log_hash integer, time text, name text)")
+    conn.executemany("insert into signalling values (?, ?, ?)", [(1, "2023-11-13 13:44:29.014", "msg, {}".format(i)) for i in range(5000)])
+    conn.commit()
+    conn.close()
+    azm_sqlite_reader.open_db(db_fp)
+    dump_fp = os.path.join(tmp_dir, "signalling.csv")
+    col_exprs = ["log_hash", "time", "name"]
+    assert azm_sqlite_reader.dump_select_to_file(col_exprs, "from signalling", dump_fp, ",", "\n", csv_mode=True) == 0
+    cursor = CopyCursor()
+    args = new_args()
+    copy_sql = 'COPY "signalling" (log_hash,time,name) FROM STDIN WITH (FORMAT CSV)'
+    gen_sql_handler.exec_pg_copy(args, cursor, copy_sql, dump_fp)
+    stream = azm_sqlite_reader.SelectStream(col_exprs, "from signalling", ",", "\n", csv_mode=True)
+    gen_sql_handler.exec_pg_copy(args, cursor, copy_sql, stream)
+    with open(dump_fp, "rb") as f:
+        assert cursor.copied[1][1] == cursor.copied[0][1] == f.read()
+    assert stream.n_bytes_read == os.path.getsize(dump_fp)
+    assert args['table_operation_stats']['table'] == ["signalling", "signalling"]
+    azm_sqlite_reader.close_db()
+
+
+def dump_table_job(table_name, sleep_seconds, fail=False):
+    # stand-in of dump_table() in the --table_jobs pool
+    time.sleep(sleep_seconds)
+    if fail:
+        raise Exception("dump of {} failed".format(table_name))
+    if table_name == "empty_table":
+        return None
+    return ('COPY "{}" FROM STDIN'.format(table_name), table_name + ".csv")
+
+
+def check_table_jobs():
+    # --table_jobs: the COPYs stay in table order whatever the order the dumps finished in
+    args = {'table_jobs': 3}
+    executor = gen_sql_handler.get_table_jobs_executor(args)
+    assert gen_sql_handler.get_table_jobs_executor(args) is executor
+    try:
+        ignored_table = azm_db_constants.IGNORE_ERROR_TABLES[0]
+        gen_sql_handler.g_exec_buf.append("ALTER TABLE \"events\" ADD \"info\" text")
+        for table_name, sleep_seconds, fail in [("slow_table", 0.3, False), ("empty_table", 0, False), (ignored_table, 0, True), ("fast_table", 0, False)]:
+            gen_sql_handler.append_exec_buf_copy(args, table_name, executor.submit(dump_table_job, table_name, sleep_seconds, fail))
+        gen_sql_handler.resolve_table_jobs(args)
+        assert gen_sql_handler.g_exec_buf == [
+            "ALTER TABLE \"events\" ADD \"info\" text",
+            ('COPY "slow_table" FROM STDIN', "slow_table.csv"),
+            ('COPY "fast_table" FROM STDIN', "fast_table.csv"),
+        ]
+        assert gen_sql_handler.g_table_jobs == {}
+        # a failed dump of another table fails the azm
+        del gen_sql_handler.g_exec_buf[:]
+        gen_sql_handler.append_exec_buf_copy(args, "signalling", executor.submit(dump_table_job, "signalling", 0, True))
+        try:
+            gen_sql_handler.resolve_table_jobs(args)
+            assert False
+        except Exception as e:
+            assert "dump of signalling failed" in str(e)
+    finally:
+        del gen_sql_handler.g_exec_buf[:]
+        gen_sql_handler.g_table_jobs.clear()
+        executor.shutdown(wait=True)
+        gen_sql_handler.g_table_jobs_executor = None
+
+
+class Cursor(object):
+    # stand-in of the psycopg2 cursor: logs the executed statements - results: [(part of the sql, rows, col names)] of the queries
+    def __init__(self, results=(), fail_sql_part=None):
+        self.executed = []
+        self.results = results
+        self.fail_sql_part = fail_sql_part
+        self.rows = []
+        self.description = None
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql if params is None else (sql, params))
+        if self.fail_sql_part is not None and self.fail_sql_part in sql:
+            raise Exception("{} failed".format(sql))
+        self.rows = []
+        self.description = None
+        self.rowcount = -1
+        for sql_part, rows, col_names in self.results:
+            if sql_part in sql:
+                self.rows = rows
+                self.description = [(col_name,) for col_name in col_names]
+                break
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class Conn(object):
+    # stand-in of the psycopg2 conn: 'with conn' is one transaction - logs the transaction ends
+    def __init__(self):
+        self.transactions = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.transactions.append("commit" if exc_type is None else "rollback")
+        return False
+
+    def commit(self):
+        self.transactions.append("commit")
+
+
+def check_pipeline_copy(tmp_dir):
+    # --pg_pipeline_copy: the COPYs run in the copy thread in table order as the tables are dumped
+    args = new_args()
+    table_names = ["events", "signalling", "lte_cell_meas"]
+    bufs = []
+    for table_name in table_names:
+        dump_fp = os.path.join(tmp_dir, table_name + ".csv")
+        with open(dump_fp, "wb") as f:
+            f.write("{}\n".format(table_name).encode())
+        bufs.append(('COPY "{}" FROM STDIN'.format(table_name), dump_fp))
+    gen_sql_handler.g_copy_conn = Conn()
+    try:
+        gen_sql_handler.g_copy_cursor = CopyCursor()
+        for table_name, buf in zip(table_names, bufs):
+            gen_sql_handler.append_exec_buf_copy(args, table_name, buf)
+        assert gen_sql_handler.g_exec_buf == []
+        gen_sql_handler.stop_copy_pipeline()
+        assert gen_sql_handler.g_copy_cursor.copied == [(buf[0], "{}\n".format(table_name).encode()) for table_name, buf in zip(table_names, bufs)]
+        assert gen_sql_handler.g_copy_thread is None
+
+        # a failed COPY: the next ones are skipped and the failure is raised at commit()
+        gen_sql_handler.g_copy_cursor = CopyCursor(fail_table_name="events")
+        for table_name, buf in zip(table_names, bufs):
+            gen_sql_handler.append_exec_buf_copy(args, table_name, buf)
+        try:
+            gen_sql_handler.stop_copy_pipeline()
+            assert False
+        except Exception as e:
+            assert 'relation "events" does not exist' in str(e)
+        assert gen_sql_handler.g_copy_cursor.copied == []
+        # close() of a failed azm: no raise
+        gen_sql_handler.append_exec_buf_copy(args, "events", bufs[0])
+        gen_sql_handler.stop_copy_pipeline(Exception("close() before commit()"))
+
+        # the DDL of the main conn gets a lock_timeout for its own transaction only
+        gen_sql_handler.g_cursor = Cursor()
+        gen_sql_handler.g_conn = Conn()
+        assert gen_sql_handler.exec_creatept_or_alter_handle_concurrency('ALTER TABLE "events" ADD "info" text')
+        assert gen_sql_handler.g_cursor.executed == [
+            "SET LOCAL lock_timeout = '{}';".format(gen_sql_handler.PG_PIPELINE_COPY_DDL_LOCK_TIMEOUT),
+            'ALTER TABLE "events" ADD "info" text',
+        ]
+    finally:
+        gen_sql_handler.g_copy_conn = None
+        gen_sql_handler.g_copy_cursor = None
+        gen_sql_handler.g_cursor = None
+        gen_sql_handler.g_conn = None
+
+
+def use_pg_cursor(results=()):
+    gen_sql_handler.g_is_postgre = True
+    gen_sql_handler.g_cursor = Cursor(results)
+    gen_sql_handler.g_conn = Conn()
+    gen_sql_handler.g_remote_catalog = None
+    gen_sql_handler.g_remote_per_month_schemas = None
+    gen_sql_handler.g_remote_partitions = None
+    gen_sql_handler.g_remote_log_hash_partitioned = None
+    return gen_sql_handler.g_cursor
+
+
+def reset_pg_cursor():
+    use_pg_cursor()
+    gen_sql_handler.g_is_postgre = False
+    gen_sql_handler.g_cursor = None
+    gen_sql_handler.g_conn = None
+
+
+def check_remote_catalog():
+    # the cols of all tables of the target schema in one query - a probe only for tables created since by other processes
+    cursor = use_pg_cursor([
+        ("pg_catalog.pg_attribute", [("events", "log_hash", "bigint"), ("events", "time", "timestamp"), ("logs", "log_hash", "bigint")], ["relname", "attname", "format_type"]),
+        ('"new_table" where false', [], ["log_hash", "time", "info"]),
+        ('"events" where false', [], ["log_hash", "time", "info"]),
+    ])
+    try:
+        args = {'pg_schema': "all_logs"}
+        assert gen_sql_handler.get_remote_columns(args, "events") == [["log_hash", "bigint"], ["time", "timestamp"]]
+        assert gen_sql_handler.get_remote_columns(args, "logs") == [["log_hash", "bigint"]]
+        assert len(cursor.executed) == 1 and "n.nspname = 'all_logs'" in cursor.executed[0]
+        assert gen_sql_handler.get_remote_columns(args, "new_table") == [["log_hash", ""], ["time", ""], ["info", ""]]
+        assert gen_sql_handler.get_remote_catalog_columns(args, "new_table") == [["log_hash", ""], ["time", ""], ["info", ""]]
+        assert len(cursor.executed) == 2
+        # refresh: probe again (like after an alter)
+        assert gen_sql_handler.get_remote_columns(args, "events", refresh=True) == [["log_hash", ""], ["time", ""], ["info", ""]]
+        assert cursor.executed[-1] == 'select * from "events" where false'
+    finally:
+        reset_pg_cursor()
+
+
+PER_MONTH_RESULT = (
+    "per\\_month",
+    [("per_month_events", "logs_2023_10", "r"), ("per_month_events", "logs_2023_11", "r"), ("per_month_signalling", None, None)],
+    ["nspname", "relname", "relkind"],
+)
+
+
+def check_partition_cache():
+    # the per_month schemas/partitions are loaded once per conn - only the missing ones are created
+    cursor = use_pg_cursor([
+        PER_MONTH_RESULT,
+        ("c.relkind = 'p'", [("events",), ("signalling",)], ["relname"]),
+    ])
+    try:
+        args = {'pg_schema': "public", 'pg10_partition_by_log_hash': False, 'pg10_partition_index_log_hash': True}
+        gen_sql_handler.create_month_partition_if_not_exists(args, "events", datetime.datetime(2023, 11, 1))
+        assert len(cursor.executed) == 1
+        gen_sql_handler.create_month_partition_if_not_exists(args, "events", datetime.datetime(2023, 12, 1))
+        gen_sql_handler.create_month_partition_if_not_exists(args, "events", datetime.datetime(2023, 12, 1))
+        assert cursor.executed[1:] == [
+            "CREATE TABLE per_month_events.logs_2023_12 PARTITION OF events FOR VALUES from ('2023-12-1') to ('2024-01-1'); CREATE INDEX ON per_month_events.logs_2023_12 (log_hash);",
+        ]
+
+        # --pg10_provision_partitions: all months of all partitioned tables ahead of a batch
+        cursor.executed = []
+        gen_sql_handler.provision_partitions(args, [datetime.datetime(2023, 11, 1), datetime.datetime(2023, 12, 1)])
+        creates = [sql for sql in cursor.executed if isinstance(sql, str) and sql.startswith("CREATE TABLE")]
+        assert [sql.split(" PARTITION OF ")[0] for sql in creates] == [
+            "CREATE TABLE per_month_events.logs_2023_12",
+            "CREATE TABLE per_month_signalling.logs_2023_11",
+            "CREATE TABLE per_month_signalling.logs_2023_12",
+        ]
+        # the per_month schema of signalling already exists
+        assert not any(isinstance(sql, str) and sql.startswith("create schema") for sql in cursor.executed)
+    finally:
+        reset_pg_cursor()
+
+
+def check_log_partitions(tmp_dir):
+    # --pg10_partition_by_log_hash: the same months (log start/end time +- LOG_DATA_TIME_MARGIN) at import and unmerge
+    log_start_time = datetime.datetime(2023, 11, 30, 23, 0)
+    log_end_time = datetime.datetime(2023, 12, 1, 1, 0)
+    assert gen_sql_handler.get_log_data_months(log_start_time, log_end_time) == [datetime.datetime(2023, 11, 1), datetime.datetime(2023, 12, 1)]
+    assert gen_sql_handler.get_log_data_months(datetime.datetime(2023, 12, 1, 12, 0), datetime.datetime(2023, 12, 1, 13, 0)) == [datetime.datetime(2023, 11, 1), datetime.datetime(2023, 12, 1)]
+    assert gen_sql_handler.get_months_between(datetime.datetime(2023, 12, 31, 23, 59), datetime.datetime(2024, 2, 1)) == [datetime.datetime(2023, 12, 1), datetime.datetime(2024, 1, 1), datetime.datetime(2024, 2, 1)]
+    pltn = gen_sql_handler.get_month_partition_name("lte_cell_meas", datetime.datetime(2023, 11, 1))
+    assert pltn == "per_month_lte_cell_meas.logs_2023_11"
+    assert gen_sql_handler.get_log_partition_name(pltn, "11") == "per_month_lte_cell_meas.logs_2023_11_11"
+    # negative log_hash: no '-' in the unquoted name
+    assert gen_sql_handler.get_log_partition_name(pltn, -11) == "per_month_lte_cell_meas.logs_2023_11_n11"
+
+    # log partitions only for the months the table has rows of this log in
+    db_fp = os.path.join(tmp_dir, "log_partitions.db")
+    conn = sqlite3.connect(db_fp)
+    conn.execute("create table lte_cell_meas (log_hash integer, time text)")
+    conn.executemany("insert into lte_cell_meas values (11, ?)", [("2023-11-30 23:10:00.000",), ("2023-11-30 23:59:59.999",), ("1970-01-01 00:00:00.000",)])
+    conn.execute("create table events (log_hash integer, time text)")
+    conn.commit()
+    conn.close()
+    args = {'log_data_min_time': "2023-11-28 23:00:00", 'log_data_max_time': "2023-12-03 01:00:00"}
+    azm_sqlite_reader.open_db(db_fp)
+    try:
+        assert gen_sql_handler.get_table_data_months(args, "lte_cell_meas") == [datetime.datetime(2023, 11, 1)]
+        assert gen_sql_handler.get_table_data_months(args, "events") == []
+    finally:
+        azm_sqlite_reader.close_db()
+
+    cursor = use_pg_cursor([
+        ("per\\_month", [
+            ("per_month_lte_cell_meas", "logs_2023_10", "r"), ("per_month_lte_cell_meas", "logs_2023_11", "p"),
+            ("per_month_lte_cell_meas", "logs_2023_11_11", "r"), ("per_month_lte_cell_meas", "logs_2023_12", "p"),
+        ], ["nspname", "relname", "relkind"]),
+    ])
+    try:
+        args = {'pg_schema': "public", 'pg10_partition_by_month': True, 'log_start_time': log_start_time, 'log_end_time': log_end_time}
+        gen_sql_handler.load_remote_partitions(args)
+        # a month partition from before --pg10_partition_by_log_hash: the rows go there
+        assert not gen_sql_handler.create_log_partition_if_not_exists(args, "lte_cell_meas", datetime.datetime(2023, 10, 1), 11)
+        assert gen_sql_handler.create_log_partition_if_not_exists(args, "lte_cell_meas", datetime.datetime(2023, 11, 1), 11)
+        assert gen_sql_handler.create_log_partition_if_not_exists(args, "lte_cell_meas", datetime.datetime(2023, 12, 1), 11)
+        assert cursor.executed[1:] == ["CREATE TABLE per_month_lte_cell_meas.logs_2023_12_11 PARTITION OF per_month_lte_cell_meas.logs_2023_12 FOR VALUES IN (11);"]
+        # unmerge: drop the log partitions - reimport: truncate them - and the delete for the rest
+        assert gen_sql_handler.gen_log_delete_sqls(args, "lte_cell_meas", 11) == [
+            "DROP TABLE IF EXISTS per_month_lte_cell_meas.logs_2023_11_11;",
+            "DROP TABLE IF EXISTS per_month_lte_cell_meas.logs_2023_12_11;",
+            'delete from "lte_cell_meas" where "log_hash" = 11',
+        ]
+        assert gen_sql_handler.gen_log_delete_sqls(args, "lte_cell_meas", 11, reimport=True)[:2] == [
+            "TRUNCATE per_month_lte_cell_meas.logs_2023_11_11;",
+            "TRUNCATE per_month_lte_cell_meas.logs_2023_12_11;",
+        ]
+        assert gen_sql_handler.gen_log_delete_sqls(args, "logs", 11) == ['delete from "logs" where "log_hash" = 11']
+        # a negative log_hash: the same sign-safe name at create and drop - the value is still the signed log_hash
+        assert gen_sql_handler.create_log_partition_if_not_exists(args, "lte_cell_meas", datetime.datetime(2023, 11, 1), -1484036963391758847)
+        assert cursor.executed[-1] == "CREATE TABLE per_month_lte_cell_meas.logs_2023_11_n1484036963391758847 PARTITION OF per_month_lte_cell_meas.logs_2023_11 FOR VALUES IN (-1484036963391758847);"
+        assert gen_sql_handler.gen_log_delete_sqls(args, "lte_cell_meas", "-1484036963391758847") == [
+            "DROP TABLE IF EXISTS per_month_lte_cell_meas.logs_2023_11_n1484036963391758847;",
+            'delete from "lte_cell_meas" where "log_hash" = -1484036963391758847',
+        ]
+    finally:
+        reset_pg_cursor()
+
+
+def check_unmerge_log_hashes():
+    # --unmerge_log_hashes: one delete per table with all log_hashes as an array param - per month partition for partitioned tables
+    cursor = use_pg_cursor([
+        ('from "logs" where "log_hash" = ANY(%s)', [
+            (11, datetime.datetime(2023, 11, 30, 23, 0), datetime.datetime(2023, 12, 1, 1, 0)),
+            (22, datetime.datetime(2023, 6, 15, 0, 0), datetime.datetime(2023, 6, 15, 1, 0)),
+        ], ["log_hash", "log_start_time", "log_end_time"]),
+        ("pg_catalog.pg_attribute", [
+            ("events", "log_hash", "bigint"), ("logs", "log_hash", "bigint"), ("lte_cell_meas", "log_hash", "bigint"),
+            ("signalling", "log_hash", "bigint"), ("spatial_ref_sys", "srid", "integer"),
+        ], ["relname", "attname", "format_type"]),
+        ("c.relkind = 'p'", [("events",), ("lte_cell_meas",)], ["relname"]),
+        ("per\\_month", [
+            ("per_month_events", "logs_2023_06", "r"), ("per_month_events", "logs_2023_11", "p"),
+            ("per_month_events", "logs_2023_11_11", "r"), ("per_month_events", "logs_2023_12", "p"),
+        ], ["nspname", "relname", "relkind"]),
+    ])
+    try:
+        args = {'pg_schema': "public", 'pg10_partition_by_month': True}
+        # 33 is not in the logs table
+        assert not gen_sql_handler.unmerge_log_hashes(args, [11, 22, 33])
+        assert cursor.executed[0] == ('select "log_hash", "log_start_time", "log_end_time" from "logs" where "log_hash" = ANY(%s)', ([11, 22, 33],))
+        assert cursor.executed[4:] == [
+            # june: a month partition from before --pg10_partition_by_log_hash
+            ('delete from per_month_events.logs_2023_06 where "log_hash" = ANY(%s)', ([22],)),
+            # november: the log_hash partition of 11 is dropped - december has none
+            "DROP TABLE IF EXISTS per_month_events.logs_2023_11_11",
+            ('delete from "signalling" where "log_hash" = ANY(%s)', ([11, 22],)),
+            ('delete from "logs" where "log_hash" = ANY(%s)', ([11, 22],)),
+        ]
+    finally:
+        reset_pg_cursor()
+
+
+def check_reimport():
+    # --reimport: the old rows of all tables with a log_hash col are removed in the same transaction as the new rows are added
+    cursor = use_pg_cursor([
+        ('from "logs" where "log_hash" = %s', [(11,)], ["log_hash"]),
+        ("pg_catalog.pg_attribute", [
+            ("events", "log_hash", "bigint"), ("logs", "log_hash", "bigint"), ("old_table", "log_hash", "bigint"), ("spatial_ref_sys", "srid", "integer"),
+        ], ["relname", "attname", "format_type"]),
+        ("per\\_month", [("per_month_events", "logs_2023_11", "p"), ("per_month_events", "logs_2023_11_11", "r")], ["nspname", "relname", "relkind"]),
+    ])
+    try:
+        args = {
+            'pg_schema': "public", 'unmerge': False, 'reimport': True, 'dump_parquet': False, 'pg10_partition_by_month': True,
+            'log_start_time': datetime.datetime(2023, 11, 13, 13, 44), 'log_end_time': datetime.datetime(2023, 11, 13, 14, 44),
+        }
+        assert not gen_sql_handler.check_if_already_merged(args, "11")
+        # old_table: not in the new azm anymore
+        assert gen_sql_handler.g_exec_buf == [
+            "TRUNCATE per_month_events.logs_2023_11_11;",
+            'delete from "events" where "log_hash" = 11',
+            'delete from "logs" where "log_hash" = 11',
+            'delete from "old_table" where "log_hash" = 11',
+        ]
+
+        # a failed statement rolls back the deletes too
+        gen_sql_handler.g_exec_buf.append('insert into "logs" ("log_hash") values (11)')
+        cursor = gen_sql_handler.g_cursor = Cursor(fail_sql_part='insert into "logs"')
+        conn = gen_sql_handler.g_conn
+        conn.transactions = []
+        try:
+            gen_sql_handler.commit(args, "")
+            assert False
+        except Exception as e:
+            assert 'insert into "logs"' in str(e)
+        assert len(cursor.executed) == 5
+        assert conn.transactions == ["commit", "rollback"]
+        cursor.fail_sql_part = None
+        conn.transactions = []
+        assert gen_sql_handler.commit(args, "")
+        assert conn.transactions == ["commit", "commit", "commit"]
+    finally:
+        del gen_sql_handler.g_exec_buf[:]
+        reset_pg_cursor()
+
+
+def check_parquet_conv():
+    # --dump_parquet: sqlite datetime text to timestamp[ns] - unparsable values null like pd.to_datetime(errors='coerce')
+    arr = pa.chunked_array([["2018-07-24 09:59:48.218", "2018-07-24 09:59:48", None]])
+    converted = gen_sql_handler.conv_datetime_strs_to_timestamp_ns(arr)
+    assert converted.type == pa.timestamp('ns')
+    assert converted.to_pylist() == [pd.Timestamp("2018-07-24 09:59:48.218"), pd.Timestamp("2018-07-24 09:59:48"), None]
+    arr = pa.chunked_array([[
+        "2018-07-24 09:59:48.218", "2018-07-24 09:59:48.123456789", "2018-07-24",
+        "2018-02-30 10:00:00", "2018-07-24 09:59:48.x", "bad", None,
+    ]])
+    assert gen_sql_handler.conv_datetime_strs_to_timestamp_ns(arr).to_pylist() == [
+        pd.Timestamp("2018-07-24 09:59:48.218"), pd.Timestamp("2018-07-24 09:59:48.123456789"), pd.Timestamp("2018-07-24"),
+        None, None, None, None,
+    ]
+
+    # signalling: the uint32 direction col from the symbol - and time_ms dropped
+    padf = pa.table({
+        "time": ["2018-07-24 09:59:48.218", "2018-07-24 09:59:49", "2018-07-24 09:59:50"],
+        "time_ms": [218, 0, 0],
+        "symbol": ["send", "recv", None],
+    })
+    padf = gen_sql_handler.conv_parquet_table("signalling", padf, geom_is_hex=False, geom_is_wkb=False)
+    assert padf.column_names == ["time", "symbol", "direction"]
+    assert padf.schema.field("time").type == pa.timestamp('ns')
+    assert padf.schema.field("direction").type == pa.uint32()
+    assert padf.column("direction").to_pylist() == [1, 0, 0]
+
+
+def check_parquet_column_types(tmp_dir):
+    # --dump_parquet: the arrow type plan of the sqlite cols - read into typed batches without csv in between
+    local_column_dict = {
+        "log_hash": "bigint", "time": "timestamp", "nr_rlc_dl_tp_kbps": "int", "lte_sinr": "DOUBLE",
+        "call_duration": "int", "lte_m_tmsi": "text", "name": "varchar(100)", "geom": "geometry",
+    }
+    pa_column_types = gen_sql_handler.get_parquet_column_types("nr_deb_stat", local_column_dict)
+    assert pa_column_types == {
+        "log_hash": pa.int64(), "time": pa.string(), "nr_rlc_dl_tp_kbps": pa.float64(), "lte_sinr": pa.float64(),
+        "call_duration": pa.float64(), "lte_m_tmsi": pa.int64(), "name": pa.string(), "geom": pa.binary(),
+    }
+    # only nr_deb_stat has the wrongly declared tp cols
+    assert gen_sql_handler.get_parquet_column_types("events", {"nr_rlc_dl_tp_kbps": "int"}) == {"nr_rlc_dl_tp_kbps": pa.int32()}
+
+    db_fp = os.path.join(tmp_dir, "column_types.db")
+    conn = sqlite3.connect(db_fp)
+    conn.execute("create table nr_deb_stat (log_hash bigint, time timestamp, nr_rlc_dl_tp_kbps int, lte_sinr double)")
+    conn.executemany("insert into nr_deb_stat values (?, ?, ?, ?)", [
+        (11, "2023-11-13 13:44:29.014", 1.5, 20.25),
+        (11, "2023-11-13 13:44:30.014", 2, ""),
+    ])
+    conn.commit()
+    conn.close()
+    col_names = ["log_hash", "time", "nr_rlc_dl_tp_kbps", "lte_sinr"]
+    schema = pa.schema([(col, pa_column_types[col]) for col in col_names])
+    azm_sqlite_reader.open_db(db_fp)
+    try:
+        batches = list(azm_sqlite_reader.iter_select_record_batches(col_names, "from nr_deb_stat order by time", schema))
+    finally:
+        azm_sqlite_reader.close_db()
+    padf = gen_sql_handler.conv_parquet_table("nr_deb_stat", pa.Table.from_batches(batches, schema=schema), geom_is_hex=False, geom_is_wkb=False)
+    assert padf.to_pydict() == {
+        "log_hash": [11, 11],
+        "time": [pd.Timestamp("2023-11-13 13:44:29.014"), pd.Timestamp("2023-11-13 13:44:30.014")],
+        # the int declared col keeps its fractions - '' in a double col is null
+        "nr_rlc_dl_tp_kbps": [1.5, 2.0],
+        "lte_sinr": [20.25, None],
+    }
+
+
+def check_write_parquet_batches(tmp_dir):
+    # --dump_parquet: batches streamed into row groups of --parquet_row_group_size rows - whatever the batch sizes
+    args = dict(new_args(), parquet_row_group_size=4, parquet_hive_layout=False, parquet_profile="fast", parquet_object_store=None)
+    schema = pa.schema([("log_hash", pa.int64()), ("time", pa.string())])
+    times = ["2023-11-13 13:44:{:02d}.000".format(i) for i in range(9)]
+    batches = []
+    for start, end in [(0, 3), (3, 3), (3, 7), (7, 9)]:
+        batches.append(pa.RecordBatch.from_arrays([pa.array([11] * (end - start), pa.int64()), pa.array(times[start:end])], schema=schema))
+    pqfp = os.path.join(tmp_dir, "events.parquet")
+    try:
+        assert gen_sql_handler.write_parquet_batches(args, "events", batches, pqfp, geom_is_hex=False, geom_is_wkb=False) == 9
+        pqf = pq.ParquetFile(pqfp)
+        assert [pqf.metadata.row_group(i).num_rows for i in range(pqf.metadata.num_row_groups)] == [4, 4, 1]
+        table = pqf.read()
+        assert table.schema.field("time").type == pa.timestamp('ns')
+        assert table.column("time").to_pylist() == [pd.Timestamp(time_str) for time_str in times]
+        assert gen_sql_handler.g_parquet_files[pqfp] == {
+            'table': "events", 'num_rows': 9, 'size_bytes': os.path.getsize(pqfp),
+            'min_time': "2023-11-13 13:44:00.000000000", 'max_time': "2023-11-13 13:44:08.000000000",
+        }
+        # no rows: no file
+        empty_pqfp = os.path.join(tmp_dir, "empty.parquet")
+        assert gen_sql_handler.write_parquet_batches(args, "empty", [batches[1]], empty_pqfp, geom_is_hex=False, geom_is_wkb=False) == 0
+        assert not os.path.exists(empty_pqfp)
+        assert empty_pqfp not in gen_sql_handler.g_parquet_files
+    finally:
+        gen_sql_handler.g_parquet_files.clear()
+
+
+def check_parquet_profiles(tmp_dir):
+    # --parquet_profile: compression and per col kind encodings
+    schema = pa.schema([
+        ("log_hash", pa.int64()), ("time", pa.timestamp('ns')), ("lte_sinr", pa.float64()), ("name", pa.string()),
+        ("geom", pa.binary()), ("is_ok", pa.bool_()),
+    ])
+    assert [gen_sql_handler.get_parquet_column_kind(field.type) for field in schema] == ['int', 'timestamp', 'float', 'string', 'binary', 'bool']
+    assert gen_sql_handler.get_parquet_writer_kwargs("fast", schema) == {
+        'compression': "snappy",
+        'use_dictionary': ["log_hash", "time", "lte_sinr", "name", "geom", "is_ok"],
+    }
+    assert gen_sql_handler.get_parquet_writer_kwargs("balanced", schema) == {
+        'compression': "zstd",
+        'compression_level': 3,
+        'use_dictionary': ["log_hash", "name", "is_ok"],
+        'use_byte_stream_split': ["lte_sinr"],
+        'data_page_size': 1024 * 1024,
+    }
+    # the kwargs are valid for the ParquetWriter
+    table = pa.table({
+        "log_hash": pa.array([11, 11], pa.int64()), "time": pa.array([0, 1], pa.timestamp('ns')), "lte_sinr": [20.25, 1.5],
+        "name": ["a", "b"], "geom": [b"\x00", None], "is_ok": [True, False],
+    }, schema=schema)
+    pqfp = os.path.join(tmp_dir, "archive.parquet")
+    with pq.ParquetWriter(pqfp, schema, **gen_sql_handler.get_parquet_writer_kwargs("archive", schema)) as writer:
+        writer.write_table(table)
+    row_group = pq.ParquetFile(pqfp).metadata.row_group(0)
+    assert row_group.column(0).compression == "ZSTD"
+    assert "BYTE_STREAM_SPLIT" in row_group.column(2).encodings
+    assert pq.read_table(pqfp).equals(table)
+
+
+def test():
+    tmp_dir = tempfile.mkdtemp()
+    check_stream_copy(tmp_dir)
+    check_table_jobs()
+    check_pipeline_copy(tmp_dir)
+    check_remote_catalog()
+    check_partition_cache()
+    check_log_partitions(tmp_dir)
+    check_unmerge_log_hashes()
+    check_reimport()
+    check_parquet_conv()
+    check_parquet_column_types(tmp_dir)
+    check_write_parquet_batches(tmp_dir)
+    check_parquet_profiles(tmp_dir)
+
+    # --schema_cache_file key: the args that change the created tables/columns
+    args = {'import_geom_column_in_location_table_only': True, 'pg10_partition_by_month': False}
+    assert gen_sql_handler.get_schema_cache_args_str(args) == "import_geom_column_in_location_table_only=1,pg10_partition_by_month=0"
+    assert gen_sql_handler.is_column_error('column "lte_sinr_rx2" of relation "lte_cell_meas" does not exist')
+    assert gen_sql_handler.is_column_error("[42S22] [Microsoft][ODBC Driver 17 for SQL Server][SQL Server]Invalid column name 'lte_sinr_rx2'.")
+    assert not gen_sql_handler.is_column_error('relation "lte_cell_meas" does not exist')
+
+
+if __name__ == '__main__':
+    test()